@@ -1,23 +1,2369 @@
-from PySide6.QtCore import Qt, QMimeData, QByteArray, Signal
-from PySide6.QtWebEngineWidgets import QWebEngineView
+from PySide6.QtCore import Qt, QMimeData, QByteArray, Signal, QObject, QTimer, QUrl, QProcess, QProcessEnvironment, \
+    QRectF, QThread
+from PySide6.QtWebEngineCore import QWebEnginePage
 from PySide6.QtWidgets import QMessageBox, QLabel, QPushButton, QWidget, QApplication, QMainWindow, QTextEdit, QVBoxLayout, \
     QHBoxLayout, QFileDialog, QInputDialog
-import threading, re, time, tempfile, pyperclip
-import os
-from PySide6.QtGui import QGuiApplication
-
-try:
-    import win32com.client as win32
-    import win32gui
-    import pythoncom
-    win32comsupport = True
-    from pynput import keyboard
-except Exception as err:
-    win32comsupport = False
-    print(f'Win32com not supported: {err} \nWordHook disabled.')
+import threading, re, time, tempfile, queue, shutil
+import os, sys, json, hashlib, bisect, argparse
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from abc import ABC, ABCMeta, abstractmethod
+from PySide6.QtGui import QGuiApplication, QPainter, QColor, QImage, QFontDatabase
+from PySide6.QtSvg import QSvgRenderer
+
+# WordHook is offered on Windows, its modules are only imported the first time it is used, see loadWordSupport
+win32comsupport = sys.platform == 'win32'
+win32 = win32gui = pythoncom = keyboard = None
+wordSupportError = None
+
+
+def loadWordSupport():
+    global win32, win32gui, pythoncom, keyboard, wordSupportError
+    if pythoncom is None and wordSupportError is None:
+        try:
+            import win32com.client as win32
+            import win32gui
+            import pythoncom
+            from pynput import keyboard
+        except Exception as e:
+            wordSupportError = e
+            print(f'Win32com not supported: {e} \nWordHook disabled.')
+    return pythoncom is not None
+
+# Normally done by importing QtWebEngineWidgets, which nothing here needs since MathJax runs in a page without a view
+QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
 
 ver = " Bleeding Edge 1.3.4"
 
+savedValuesPath = './MJ2GSavedValues.ini'
+cacheDir = './MJ2GCache'
+
+
+# Saved values are stored one per line as !key:value
+def loadSavedValues():
+    values = {}
+    try:
+        with open(savedValuesPath, 'r') as f:
+            for line in f:
+                if line.startswith('!') and ':' in line:
+                    key, value = line[1:].rstrip('\n').split(':', 1)
+                    values[key] = value
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'Error loading saved values: {e}')
+    return values
+
+
+def saveValues(newValues):
+    values = loadSavedValues()
+    values.update(newValues)
+    with open(savedValuesPath, 'w') as f:
+        f.write('\n'.join(f'!{key}:{value}' for key, value in values.items()))
+
+
+# Timing spans across threads, kept per stage over the last window samples for p50/p95, and written as JSON lines to
+# logPath when given. Set MJ2G_TRACE to a file path (or 1 for ./MJ2GTrace.jsonl) to turn the log on.
+class Tracer:
+    def __init__(self, logPath=None, window=512):
+        self.lock = threading.Lock()
+        self.window = window
+        self.samples = {}
+        self.log = None
+        if logPath:
+            try:
+                self.log = open(logPath, 'a', encoding='utf-8', buffering=1)
+            except OSError as e:
+                print(f'Error opening trace log: {e}')
+
+    def record(self, name, seconds, **fields):
+        milliseconds = seconds * 1000
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=self.window)).append(milliseconds)
+            if self.log is not None:
+                self.log.write(json.dumps({'time': round(time.time(), 6), 'span': name, 'ms': round(milliseconds, 3),
+                                           'thread': threading.current_thread().name, **fields}) + '\n')
+
+    # Span from started (a time.perf_counter() value) to now
+    def since(self, name, started, **fields):
+        self.record(name, time.perf_counter() - started, **fields)
+
+    @contextmanager
+    def span(self, name, **fields):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.since(name, started, **fields)
+
+    # {name: (count, p50, p95)} in milliseconds
+    def stats(self):
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items() if values}
+        return {name: (len(values), values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.95))])
+                for name, values in samples.items()}
+
+    def summary(self):
+        return '\n'.join(f'{name:<16} p50 {p50:7.1f}  p95 {p95:7.1f} ms  n={count}'
+                         for name, (count, p50, p95) in sorted(self.stats().items()))
+
+
+tracer = Tracer({'': None, '1': './MJ2GTrace.jsonl'}.get(os.environ.get('MJ2G_TRACE', ''),
+                                                          os.environ.get('MJ2G_TRACE')))
+
+
+# LRU cache of rendered SVGs keyed by equation + preamble state, with an optional on-disk tier that survives restarts
+class RenderCache:
+    # Bumped whenever the stored SVG changes shape so stale disk entries are not picked up
+    version = 2
+
+    def __init__(self, maxEntries=256, diskDir=None):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.diskDir = diskDir
+        if self.diskDir:
+            try:
+                os.makedirs(self.diskDir, exist_ok=True)
+            except Exception as e:
+                print(f'Error creating render cache directory, disk cache disabled: {e}')
+                self.diskDir = None
+
+    @staticmethod
+    def normalize(equation):
+        # Runs of spaces are insignificant to TeX, newlines are kept since they terminate % comments
+        lines = equation.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return '\n'.join(' '.join(line.split()) for line in lines).strip()
+
+    @staticmethod
+    def key(equation, displayStyle, physicsEnabled, colorsv2Enabled, mathjaxScript):
+        state = json.dumps([RenderCache.version, RenderCache.normalize(equation), displayStyle, physicsEnabled,
+                            colorsv2Enabled, mathjaxScript])
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.diskDir:
+            try:
+                with open(os.path.join(self.diskDir, f'{key}.svg'), 'r', encoding='utf-8') as f:
+                    svg = f.read()
+                self.put(key, svg, persist=False)
+                return svg
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f'Error reading render cache: {e}')
+        return None
+
+    def put(self, key, svg, persist=True):
+        self.entries[key] = svg
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        if self.diskDir and persist:
+            path = os.path.join(self.diskDir, f'{key}.svg')
+            try:
+                with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+                    f.write(svg)
+                os.replace(f'{path}.tmp', path)
+            except Exception as e:
+                print(f'Error writing render cache: {e}')
+
+
+# Per-view render scheduling. request() is latest-wins: it is debounced, bounded by a max latency and stale requests
+# are dropped. submit() queues a job that must not be dropped (e.g. the equation about to be inserted). Only one
+# render is in flight per target, jobs are called with a done(svg) callback and completion is reported back.
+class RenderTarget:
+    def __init__(self):
+        self.latest = None
+        self.firstRequest = None
+        self.queued = deque()
+        self.inFlight = False
+        self.onFinished = None
+        self.generation = 0
+        self.timer = None
+        self.watchdog = None
+
+
+class RenderScheduler(QObject):
+    renderFinished = Signal(str, str)
+
+    def __init__(self, debounceMs=30, maxLatencyMs=150, inFlightTimeoutMs=5000, parent=None):
+        super(RenderScheduler, self).__init__(parent)
+        self.debounceMs = debounceMs
+        self.maxLatencyMs = max(maxLatencyMs, debounceMs)
+        self.inFlightTimeoutMs = inFlightTimeoutMs
+        self.targets = {}
+
+    def target(self, name):
+        if name not in self.targets:
+            state = RenderTarget()
+            state.timer = QTimer(self)
+            state.timer.setSingleShot(True)
+            state.timer.timeout.connect(lambda: self.dispatch(name))
+            # A render whose callback never comes back (e.g. the page got reloaded) must not block the view forever
+            state.watchdog = QTimer(self)
+            state.watchdog.setSingleShot(True)
+            state.watchdog.timeout.connect(lambda: self.finished(name, self.targets[name].generation, ''))
+            self.targets[name] = state
+        return self.targets[name]
+
+    def request(self, name, job):
+        state = self.target(name)
+        state.latest = job
+        now = time.monotonic()
+        if state.firstRequest is None:
+            state.firstRequest = now
+        remaining = self.maxLatencyMs - (now - state.firstRequest) * 1000
+        state.timer.start(int(max(0, min(self.debounceMs, remaining))))
+
+    def submit(self, name, job, onFinished):
+        self.target(name).queued.append((job, onFinished))
+        self.dispatch(name)
+
+    def isIdle(self, name):
+        state = self.target(name)
+        return not state.inFlight and state.latest is None and not state.queued
+
+    def dispatch(self, name):
+        state = self.target(name)
+        if state.inFlight:
+            return
+        if state.queued:
+            job, onFinished = state.queued.popleft()
+        elif state.latest is not None and not state.timer.isActive():
+            job, onFinished = state.latest, None
+            state.latest = None
+            state.firstRequest = None
+        else:
+            return
+        state.inFlight = True
+        state.onFinished = onFinished
+        state.generation += 1
+        generation = state.generation
+        state.watchdog.start(self.inFlightTimeoutMs)
+        try:
+            job(lambda svg: self.finished(name, generation, svg))
+        except Exception as e:
+            print(f'Error starting render: {e}')
+            self.finished(name, generation, '')
+
+    def finished(self, name, generation, svg):
+        state = self.target(name)
+        if not state.inFlight or generation != state.generation:
+            return
+        state.inFlight = False
+        state.watchdog.stop()
+        onFinished, state.onFinished = state.onFinished, None
+        try:
+            if onFinished is not None:
+                onFinished(svg or '')
+            else:
+                self.renderFinished.emit(name, svg or '')
+        finally:
+            self.dispatch(name)
+
+
+# Finds $$...$$ blocks as (start, end) offsets, end being past the closing $$. A closing $$ preceded by a backslash
+# does not count, like the old findall. Between snapshots only the part that changed is rescanned: blocks before the
+# edit are kept, and once the rescan ends a block past the edit at a point that was also outside a block before,
+# the rest of the old blocks are reused shifted by the length difference.
+class DelimiterScanner:
+    pattern = re.compile(r'\$\$(.*?)(?<!\\)\$\$', re.DOTALL)
+
+    def __init__(self):
+        self.text = ''
+        self.blocks = []
+
+    @staticmethod
+    def commonPrefixLength(a, b):
+        lo, hi = 0, min(len(a), len(b))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[lo:mid] == b[lo:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    @staticmethod
+    def commonSuffixLength(a, b, limit):
+        lo, hi = 0, min(len(a), len(b), limit)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    @staticmethod
+    def equation(text, block):
+        return text[block[0] + 2:block[1] - 2]
+
+    def reset(self):
+        self.text = ''
+        self.blocks = []
+
+    def scan(self, text):
+        oldText, oldBlocks = self.text, self.blocks
+        if text == oldText:
+            return self.blocks
+        prefix = self.commonPrefixLength(oldText, text)
+        suffix = self.commonSuffixLength(oldText, text, min(len(oldText), len(text)) - prefix)
+        oldChangeEnd = len(oldText) - suffix
+        newChangeEnd = len(text) - suffix
+        delta = len(text) - len(oldText)
+
+        # Blocks that end before the edit are untouched, rescan from the end of the last one
+        # (the lookbehind on the closing $$ can see one character back, hence the < instead of <=)
+        keep = 0
+        while keep < len(oldBlocks) and oldBlocks[keep][1] < prefix:
+            keep += 1
+        blocks = oldBlocks[:keep]
+        position = blocks[-1][1] if blocks else 0
+        oldStarts = [block[0] for block in oldBlocks]
+
+        for match in self.pattern.finditer(text, position):
+            blocks.append((match.start(), match.end()))
+            oldPosition = match.end() - delta
+            if match.end() >= newChangeEnd and oldPosition >= oldChangeEnd:
+                # Back in the unchanged tail, if the old scan was also outside a block here the rest is identical
+                following = bisect.bisect_left(oldStarts, oldPosition)
+                if following == 0 or oldBlocks[following - 1][1] <= oldPosition:
+                    blocks.extend((start + delta, end + delta) for start, end in oldBlocks[following:])
+                    break
+
+        self.text = text
+        self.blocks = blocks
+        return blocks
+
+
+# Reads the text WordHook scans each tick. In window mode only a few paragraphs around the selection are marshaled
+# over COM instead of the whole document. Pairing up the $$ of the window is only right when it starts outside an
+# equation, so when it holds any, the window is widened with Find to the opening $$ of an equation it starts in and
+# to the closing $$ of one it leaves open. Whether it starts inside one comes from the count of $$ before it, kept per
+# session so that typing, which happens inside the window, never copies the text before it.
+class WordReader:
+    wdParagraph = 4
+
+    def __init__(self, mode='window', windowParagraphs=3):
+        self.mode = mode
+        self.windowParagraphs = windowParagraphs
+
+    @staticmethod
+    def delimiterCount(text):
+        return len(re.findall(r'(?<!\\)\$\$', text))
+
+    @staticmethod
+    def delimitersBalanced(text):
+        return WordReader.delimiterCount(text) % 2 == 0
+
+    # Position of the nearest $$ in [start, end), the last one when searching backward, None when there is none
+    @staticmethod
+    def find(wordDoc, start, end, forward=True):
+        rangeFind = wordDoc.Range(start, end)
+        rangeFind.Find.ClearFormatting()
+        rangeFind.Find.Text = '$$'
+        rangeFind.Find.Forward = forward
+        if not rangeFind.Find.Execute():
+            return None
+        return rangeFind.Start
+
+    # Number of $$ before position. The session's last count is reused while the text before it can't have changed:
+    # same position (typing inside the window), or same document length (the cursor moved, only the text in between is
+    # read then). Anything else reads the text before position once.
+    def delimitersBefore(self, wordDoc, position, documentEnd, session=None):
+        counted = session.delimitersBefore if session is not None else None
+        if position == 0:
+            count = 0
+        elif counted is not None and counted[0] == position:
+            count = counted[2]
+        elif counted is not None and counted[1] == documentEnd:
+            countedPosition, _, count = counted
+            if position > countedPosition:
+                count += self.delimiterCount(wordDoc.Range(countedPosition, position).Text or '')
+            else:
+                count -= self.delimiterCount(wordDoc.Range(position, countedPosition).Text or '')
+        else:
+            count = self.delimiterCount(wordDoc.Range(0, position).Text or '')
+        if session is not None:
+            session.delimitersBefore = (position, documentEnd, count)
+        return count
+
+    # Returns the text and the document position it starts at
+    def read(self, word, wordDoc, session=None):
+        if self.mode == 'window':
+            try:
+                selection = word.Selection.Range
+                window = wordDoc.Range(selection.Start, selection.End)
+                window.MoveStart(self.wdParagraph, -self.windowParagraphs)
+                window.MoveEnd(self.wdParagraph, self.windowParagraphs)
+                text = window.Text or ''
+                start, end = window.Start, window.End
+                documentEnd = wordDoc.Content.End
+                if start == 0 and end >= documentEnd:
+                    return text, start
+                delimiters = self.delimiterCount(text)
+                if delimiters == 0:
+                    return text, start
+                before = self.delimitersBefore(wordDoc, start, documentEnd, session)
+                readStart, readEnd = start, end
+                if before % 2:
+                    readStart = self.find(wordDoc, 0, start, forward=False)
+                    if readStart is None:
+                        raise ValueError('opening $$ not found')
+                # An equation still open at the end of the window, or typed up to the end of the document
+                if (before + delimiters) % 2:
+                    closing = self.find(wordDoc, end, documentEnd)
+                    if closing is not None:
+                        readEnd = closing + 2
+                if (readStart, readEnd) != (start, end):
+                    text = wordDoc.Range(readStart, readEnd).Text or ''
+                return text, readStart
+            except Exception as e:
+                # Selection outside the main story (header, comment...) and the like, just read everything
+                print(f'Error reading word selection window: {e}')
+                if session is not None:
+                    session.delimitersBefore = None
+        return wordDoc.Range().Text, 0
+
+
+# Paces the WordHook poll loop. The interval doubles while the document sits idle, up to maxInterval, or up to the
+# much shorter editingInterval while a $$ block is open. Any keystroke wakes the loop straight away, see WordComWorker.
+class PollScheduler:
+    def __init__(self, minInterval=1 / 30, maxInterval=1.0, editingInterval=None):
+        self.minInterval = minInterval
+        self.maxInterval = max(maxInterval, minInterval)
+        self.editingInterval = min(self.maxInterval, editingInterval or minInterval * 4)
+        self.interval = minInterval
+
+    # A keystroke or an equation on screen, poll at full speed again
+    def active(self):
+        self.interval = self.minInterval
+
+    def idle(self, editing=False):
+        self.interval = min(self.interval * 2, self.editingInterval if editing else self.maxInterval)
+
+
+# TeX packages for each preamble profile. colorv2 replaces color instead of being loaded next to it, physics and
+# colorv2 are loaded with the page (they are not in the full bundle) so switching profiles never waits on the network.
+texBasePackages = ['base', 'ams', 'bbox', 'boldsymbol', 'braket', 'cancel', 'color', 'enclose', 'extpfeil', 'html',
+                   'mhchem', 'newcommand', 'noerrors', 'unicode', 'verb', 'autoload', 'require', 'configmacros',
+                   'tagformat', 'action']
+texProfileExtensions = ['[tex]/physics', '[tex]/colorv2']
+# The packages a profile switches on or off, MathJax's default set stays loaded around them
+texProfilePackages = ['physics', 'color', 'colorv2']
+
+
+def texPackages(physicsEnabled=False, colorsv2Enabled=False):
+    packages = [('colorv2' if colorsv2Enabled and pkg == 'color' else pkg) for pkg in texBasePackages]
+    if physicsEnabled:
+        packages.append('physics')
+    return packages
+
+
+# tex.packages of the page config: added to the bundle's defaults rather than replacing them, a plain list would
+# leave every other package (mathtools...) to autoload at best
+def texPackageConfig(physicsEnabled=False, colorsv2Enabled=False):
+    packages = texPackages(physicsEnabled, colorsv2Enabled)
+    return {'[+]': packages, '[-]': [pkg for pkg in texProfilePackages if pkg not in packages]}
+
+
+TexError = namedtuple('TexError', ['position', 'message'])
+
+
+# Cheap check of the TeX typed so far before it goes to MathJax: braces, \left/\middle/\right and \begin/\end must
+# pair up. One pass over the tokens with a stack, so it stays linear on long aligned blocks. validate returns None or
+# the first TexError, its position an offset into the TeX. It only reports what is certainly unbalanced: environments
+# are not checked against a list, text arguments may hold %, and equations defining macros (which can open or close
+# groups for their callers) are not checked at all, the last good preview covers whatever MathJax rejects.
+class TexValidator:
+    token = re.compile(r'\\([a-zA-Z]+|.?)|[{}]|%[^\n]*', re.DOTALL)
+    argument = re.compile(r'\s*\{([^{}]*)\}')
+    textArgument = re.compile(r'\s*\{')
+    textBrace = re.compile(r'\\.|[{}]', re.DOTALL)
+    definition = re.compile(r'\\(?:[egx]?def|let|(?:re)?newcommand|providecommand|(?:re)?newenvironment)(?![a-zA-Z])')
+    textMacros = {'text', 'mbox', 'hbox', 'textrm', 'textbf', 'textit', 'textsf', 'texttt', 'textup', 'textnormal'}
+
+    @staticmethod
+    def location(tex, position):
+        line = tex.count('\n', 0, position) + 1
+        column = position - (tex.rfind('\n', 0, position) + 1) + 1
+        return f'line {line}, column {column}' if line > 1 or '\n' in tex else f'column {column}'
+
+    def validate(self, tex):
+        if self.definition.search(tex):
+            return None
+        stack = []
+        position = 0
+        while True:
+            match = self.token.search(tex, position)
+            if match is None:
+                break
+            position = match.end()
+            text = match.group()
+            if text == '{':
+                stack.append(('{', '', match.start()))
+            elif text == '}':
+                if not stack or stack[-1][0] != '{':
+                    return self.unexpected(stack, match.start(), '}')
+                stack.pop()
+            elif text[0] == '%':
+                continue
+            else:
+                name = match.group(1)
+                if name == '':
+                    return TexError(match.start(), 'Backslash at the end')
+                if name in ('begin', 'end'):
+                    argument = self.argument.match(tex, position)
+                    if argument is None:
+                        return TexError(match.start(), f'\\{name} without an environment name')
+                    position = argument.end()
+                    environment = argument.group(1).strip()
+                    if name == 'begin':
+                        stack.append(('begin', environment, match.start()))
+                    else:
+                        if not stack or stack[-1][0] != 'begin' or stack[-1][1] != environment:
+                            return self.unexpected(stack, match.start(), f'\\end{{{environment}}}')
+                        stack.pop()
+                elif name in self.textMacros:
+                    # Text mode argument, % is a plain character there
+                    argument = self.textArgument.match(tex, position)
+                    if argument is None:
+                        continue
+                    position = self.skipText(tex, argument.end())
+                    if position is None:
+                        return TexError(argument.end() - 1, 'Missing } for this {')
+                elif name == 'left':
+                    stack.append(('left', '', match.start()))
+                elif name == 'middle':
+                    if not stack or stack[-1][0] != 'left':
+                        return self.unexpected(stack, match.start(), '\\middle')
+                elif name == 'right':
+                    if not stack or stack[-1][0] != 'left':
+                        return self.unexpected(stack, match.start(), '\\right')
+                    stack.pop()
+                elif name == 'verb':
+                    # \verb|...| takes anything up to the next copy of its delimiter
+                    if position >= len(tex):
+                        return TexError(match.start(), '\\verb without a delimiter')
+                    end = tex.find(tex[position], position + 1)
+                    if end < 0:
+                        return TexError(match.start(), f'Missing {tex[position]} to end \\verb')
+                    position = end + 1
+        if stack:
+            return self.unclosed(stack[-1])
+        return None
+
+    # Position past the } closing a text argument whose { ends at position, None when it is not closed
+    @classmethod
+    def skipText(cls, tex, position):
+        depth = 1
+        for match in cls.textBrace.finditer(tex, position):
+            text = match.group()
+            if text == '{':
+                depth += 1
+            elif text == '}':
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        return None
+
+    @staticmethod
+    def unclosed(opened):
+        kind, environment, position = opened
+        if kind == '{':
+            return TexError(position, 'Missing } for this {')
+        if kind == 'left':
+            return TexError(position, 'Missing \\right for this \\left')
+        return TexError(position, f'Missing \\end{{{environment}}}')
+
+    # A closer that does not match points at what is still open, which is usually where the typo is
+    @classmethod
+    def unexpected(cls, stack, position, text):
+        if not stack:
+            return TexError(position, f'Extra {text}')
+        error = cls.unclosed(stack[-1])
+        return TexError(error.position, f'{error.message} before {text}')
+
+
+def buildMathJaxHtml(mathjaxScript, physicsEnabled=False, colorsv2Enabled=False):
+    # Convert the package config to a string
+    packages_str = json.dumps(texPackageConfig(physicsEnabled, colorsv2Enabled))
+    profile_packages_str = json.dumps(texProfilePackages)
+
+    # Define the loader packages
+    loader_packages_str = json.dumps(texProfileExtensions)
+
+    html = """
+    <!DOCTYPE html>
+    <html>
+    <style>
+    body {{
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            height: 100vh;
+            margin: 0;
+            background-color: darkgray;
+            overflow: auto;
+        }}
+    </style>
+    <head>
+        <script type="text/javascript">
+            // Standalone SVGs need their glyphs inline, a global font cache would leave them in another element
+            window.MathJax = {{
+                loader: {{
+                    load: {loader_packages}
+                }},
+                svg: {{
+                    scale: 1,
+                    minScale: .1,
+                    fontCache: 'local'
+                }},
+                tex: {{
+                    displayMath: [['$$','$$']],
+                    packages: {packages},
+                    autoload: {{color: []}}
+                }},
+                startup: {{
+                    typeset: false
+                }}
+            }};
+
+            // Swap the TeX package profile in the live page by re-creating the input jax from the updated config.
+            // Only the packages a profile toggles change, the rest of the list MathJax built from its defaults stays.
+            var mj2gProfilePackages = {profile_packages};
+            function mj2gSetProfile(packages) {{
+                // Still the config object above until the bundle has loaded
+                if (!MathJax.config) {{
+                    MathJax.tex.packages = {{
+                        '[+]': packages,
+                        '[-]': mj2gProfilePackages.filter(function (name) {{ return packages.indexOf(name) < 0; }})
+                    }};
+                    return true;
+                }}
+                var input = MathJax.startup.input && MathJax.startup.input[0];
+                var current = input && Array.isArray(input.options.packages) ? input.options.packages
+                    : Array.isArray(MathJax.config.tex.packages) ? MathJax.config.tex.packages : [];
+                var list = current.filter(function (name) {{ return mj2gProfilePackages.indexOf(name) < 0; }});
+                packages.forEach(function (name) {{
+                    if (list.indexOf(name) < 0) {{
+                        list.push(name);
+                    }}
+                }});
+                MathJax.config.tex.packages = list;
+                if (typeof MathJax.tex2svg === 'function') {{
+                    // Already started, swap right away so the next render uses the new packages
+                    MathJax.startup.getComponents();
+                }} else {{
+                    MathJax.startup.promise.then(function () {{
+                        MathJax.startup.getComponents();
+                    }});
+                }}
+                return true;
+            }}
+
+            // Render one equation straight to a standalone SVG string, colors already normalized.
+            // The request id comes back with the result so the caller can tell which render it belongs to.
+            function mj2gRender(id, tex) {{
+                try {{
+                    var node = MathJax.tex2svg(tex).querySelector('svg');
+                    var svg = new XMLSerializer().serializeToString(node).replace(/currentColor/g, 'black');
+                }} catch (err) {{
+                    return {{id: id, svg: '', error: String(err)}};
+                }}
+                return {{id: id, svg: svg}};
+            }}
+
+            // Same for MathML, which WordHook turns into a native Word equation
+            function mj2gMathML(id, tex) {{
+                try {{
+                    return {{id: id, mml: MathJax.tex2mml(tex)}};
+                }} catch (err) {{
+                    return {{id: id, mml: '', error: String(err)}};
+                }}
+            }}
+
+            // Typeset a corpus right after loading so MathJax builds its parser tables, font data and code paths now
+            // rather than on the first real render. One equation per task, so renders asked for meanwhile run between
+            // them instead of waiting for the whole corpus. mj2gWarmUpMs is set once it is through.
+            function mj2gWarmUp(corpus) {{
+                var started = performance.now();
+                window.mj2gWarmUpMs = null;
+                function next(index) {{
+                    if (index >= corpus.length) {{
+                        window.mj2gWarmUpMs = performance.now() - started;
+                        return;
+                    }}
+                    try {{
+                        MathJax.tex2svg(corpus[index]);
+                        MathJax.tex2mml(corpus[index]);
+                    }} catch (err) {{
+                    }}
+                    setTimeout(function () {{ next(index + 1); }}, 0);
+                }}
+                next(0);
+                return true;
+            }}
+        </script>
+        {mathjax_script}
+    </head>
+    <body>
+    </body>
+    </html>
+    """.format(packages=packages_str, loader_packages=loader_packages_str, profile_packages=profile_packages_str,
+               mathjax_script=mathjaxScript)
+    return html
+
+
+# Where MathJax is loaded from: a local directory holding the es5 build (e.g. node_modules/mathjax/es5), a copy
+# cached under the app directory, or a CDN. The cached copy is fetched from the CDN in the background the first time
+# and used from then on, so starting up does not need the network and works offline.
+class MathJaxSource:
+    cdnUrl = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/'
+    bundle = 'tex-svg-full.js'
+    # The bundle plus the extensions it does not include that MJ2G loads on demand
+    cachedFiles = [bundle, 'input/tex/extensions/physics.js', 'input/tex/extensions/colorv2.js']
+    cachedDir = os.path.join(cacheDir, 'mathjax', 'es5')
+    downloadLock = threading.Lock()
+    downloadThread = None
+
+    def __init__(self, kind='cached', location=None):
+        self.kind = kind
+        self.location = location
+
+    @classmethod
+    def fromSavedValues(cls, savedValues):
+        return cls(savedValues.get('mathjaxSource', 'cached'), savedValues.get('mathjaxLocation') or None)
+
+    def save(self):
+        saveValues({'mathjaxSource': self.kind, 'mathjaxLocation': self.location or ''})
+
+    @classmethod
+    def isCached(cls):
+        return all(os.path.isfile(os.path.join(cls.cachedDir, name)) for name in cls.cachedFiles)
+
+    @classmethod
+    def downloadCache(cls):
+        if not cls.downloadLock.acquire(blocking=False):
+            return
+        try:
+            for name in cls.cachedFiles:
+                path = os.path.join(cls.cachedDir, *name.split('/'))
+                if os.path.isfile(path):
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with urllib.request.urlopen(cls.cdnUrl + name, timeout=30) as response:
+                    data = response.read()
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(f'{path}.tmp', path)
+        except Exception as e:
+            print(f'Error caching MathJax for offline use: {e}')
+        finally:
+            cls.downloadLock.release()
+
+    # One download at a time, later calls while it runs do nothing
+    @classmethod
+    def startDownload(cls):
+        if cls.downloadThread is None or not cls.downloadThread.is_alive():
+            cls.downloadThread = threading.Thread(target=cls.downloadCache, daemon=True)
+            cls.downloadThread.start()
+
+    # Directory the page loads MathJax from, None when it comes from the network
+    def localDirectory(self):
+        if self.kind == 'local' and self.location and os.path.isfile(os.path.join(self.location, self.bundle)):
+            return os.path.abspath(self.location)
+        if self.kind == 'cached':
+            if self.isCached():
+                return os.path.abspath(self.cachedDir)
+            self.startDownload()
+        return None
+
+    # (script tag, base URL) for one page load, both from the same look at the directory so a download finishing in
+    # between cannot pair a relative src with an empty base URL
+    def resolve(self):
+        directory = self.localDirectory()
+        if directory:
+            src = self.bundle
+        elif self.kind == 'cdn' and self.location:
+            src = self.location
+        else:
+            src = self.cdnUrl + self.bundle
+        script = f'<script type="text/javascript" async src = "{src}"> </script>'
+        return script, QUrl.fromLocalFile(directory + os.sep) if directory else QUrl()
+
+    def describe(self):
+        if self.kind == 'local':
+            return f'Local directory {self.location}'
+        if self.kind == 'cdn':
+            return f'CDN {self.location or self.cdnUrl + self.bundle}'
+        return 'Cached copy' if self.isCached() else 'Cached copy (downloading, using CDN meanwhile)'
+
+
+# What a MathJax page typesets as soon as it has loaded (see mj2gWarmUp): a fixed set covering common symbols, fonts,
+# delimiters and environments, physics when it is enabled, and the equations last inserted or copied. MathJax builds
+# fonts and parser state lazily and keeps none of it across page loads or launches, so each launch pays for the
+# warm-up again, only in the background instead of on the first equation typed. Keeping recent equations is opt-in
+# (maxRecent > 0): they are document content, saved to MJ2GCache/warmup.json only then and capped at maxRecent, and
+# the file is removed again once it is turned off.
+class WarmUpCorpus:
+    common = [
+        r'\alpha \beta \gamma \delta \epsilon \zeta \eta \theta \iota \kappa \lambda \mu \nu \xi \pi \rho \sigma \tau'
+        r' \upsilon \phi \chi \psi \omega \Gamma \Delta \Theta \Lambda \Xi \Pi \Sigma \Phi \Psi \Omega',
+        r'\frac{a}{b} + \dfrac{1}{2} - \sqrt{x} \cdot \sqrt[3]{y} \times \binom{n}{k} \pm \infty',
+        r'\sum_{i=1}^{n} i^2 = \prod_{k} a_k \int_0^1 f(x)\,dx \oint \iint \lim_{x \to 0} \sin x \cos x \log x',
+        r'\le \ge \ne \approx \equiv \sim \propto \in \notin \subset \subseteq \cup \cap \forall \exists \partial \nabla',
+        r'\rightarrow \Rightarrow \leftrightarrow \Leftrightarrow \mapsto \to \gets \uparrow \downarrow',
+        r'\left( \frac{a}{b} \right) \left[ x \right] \left\{ y \right\} \left| z \right| \langle u, v \rangle',
+        r'\mathbb{R} \mathcal{L} \mathfrak{g} \mathrm{d} \mathbf{v} \boldsymbol{\mu} \mathit{x} \text{text} \operatorname{tr}',
+        r'\hat{a} \bar{b} \tilde{c} \vec{v} \dot{x} \ddot{x} \overline{AB} \underbrace{a + b}_{n} \overbrace{c}^{m}',
+        r'\begin{aligned} a &= b + c \\ d &= e \end{aligned}',
+        r'\begin{cases} 1 & x > 0 \\ 0 & \text{otherwise} \end{cases}',
+        r'\begin{pmatrix} a & b \\ c & d \end{pmatrix} \begin{bmatrix} 1 \\ 2 \end{bmatrix} \begin{vmatrix} x \end{vmatrix}',
+        r'\begin{array}{lr} x & y \\ z & w \end{array}',
+        r'\ce{H2O + CO2 -> H2CO3}',
+    ]
+    physics = [
+        r'\dv{f}{x} \pdv{f}{x}{y} \abs{x} \norm{v} \bra{\psi} \ket{\phi} \braket{\psi}{\phi} \expval{A}',
+        r'\vb{F} = m \vb{a} \grad{f} \div{\vb{E}} \curl{\vb{B}} \comm{A}{B} \tr{\rho}',
+    ]
+
+    maxLength = 2000
+
+    def __init__(self, path=None, maxRecent=0):
+        self.path = path
+        self.maxRecent = maxRecent
+        self.recent = OrderedDict()
+        self.changed = False
+        if self.path and os.path.isfile(self.path) and maxRecent <= 0:
+            try:
+                os.remove(self.path)
+            except Exception as e:
+                print(f'Error removing warm-up corpus: {e}')
+        elif self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for tex in json.load(f).get('recent', [])[-maxRecent:]:
+                        self.recent[tex] = None
+            except Exception as e:
+                print(f'Error reading warm-up corpus: {e}')
+
+    def record(self, tex):
+        tex = tex.strip()
+        if not tex or self.maxRecent <= 0 or len(tex) > self.maxLength:
+            return
+        self.recent[tex] = None
+        self.recent.move_to_end(tex)
+        while len(self.recent) > self.maxRecent:
+            self.recent.popitem(last=False)
+        self.changed = True
+
+    def equations(self, physicsEnabled=False):
+        return self.common + (self.physics if physicsEnabled else []) + list(self.recent)
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'recent': list(self.recent)}, f)
+            os.replace(f'{self.path}.tmp', self.path)
+            self.changed = False
+        except Exception as e:
+            print(f'Error writing warm-up corpus: {e}')
+
+
+# Events WordComWorker posts to the GUI. Snapshot, match and progress only describe the latest state, so newer ones
+# replace those the GUI has not picked up yet instead of queueing behind them.
+SnapshotEvent = namedtuple('SnapshotEvent', ['hasEquation'])
+DocumentEvent = namedtuple('DocumentEvent', ['documentName'])
+ConnectionEvent = namedtuple('ConnectionEvent', ['connected', 'message'])
+MatchEvent = namedtuple('MatchEvent', ['equation', 'readAt', 'postedAt'])
+ReplaceRequestEvent = namedtuple('ReplaceRequestEvent', ['equation', 'position', 'documentName'])
+InsertDoneEvent = namedtuple('InsertDoneEvent', ['output', 'documentName', 'requestedAt'])
+ErrorEvent = namedtuple('ErrorEvent', ['message', 'fatal'])
+# Convert All and Re-render: the scan of a document (blocks from scanEquationBlocks, or with indexed the pictures from
+# EquationSource.index), progress while replacing, and how many equations were replaced and skipped
+ScanEvent = namedtuple('ScanEvent', ['documentName', 'items', 'indexed'])
+ProgressEvent = namedtuple('ProgressEvent', ['message'])
+DoneEvent = namedtuple('DoneEvent', ['replaced', 'skipped'])
+
+
+# Poll state of one document. WordComWorker keeps one per FullName so switching between documents picks up where
+# each one was left instead of starting over.
+class WordSession:
+    def __init__(self, documentName):
+        self.documentName = documentName
+        self.scanner = DelimiterScanner()
+        self.snapshot = None
+        self.emitted = None
+        self.editing = False
+        self.hasEquation = False
+        # (window start, document end, $$ before the window) of the last window read, see WordReader
+        self.delimitersBefore = None
+
+
+# The only thread that talks to Word, with its own COM apartment and one long-lived dispatch. It polls the active
+# document for the equation under the cursor and runs jobs (callables taking the Word application) from a bounded
+# command queue in order, so a slow Word makes the GUI wait for room instead of piling up work. Results go back as
+# events through eventsPosted, which is emitted once per batch and drained on the GUI thread with takeEvents().
+# The poll follows whichever document has focus. When Word has no active document or rejects calls (a Save dialog,
+# the backstage view, Word busy or restarting) the worker reports it, retries with a growing backoff and fetches a
+# fresh dispatch now and then, instead of unhooking.
+# SVGs go through temp files that are removed as soon as Word has embedded them, and the temp directory itself goes
+# away when the worker stops. Pending jobs are still done before it exits.
+class WordComWorker(QThread):
+    eventsPosted = Signal()
+    collapsible = (SnapshotEvent, MatchEvent, ProgressEvent)
+    wakeCommand = object()
+    replaceCommand = object()
+    minBackoff = 0.1
+    maxBackoff = 2.0
+    redispatchAfter = 5
+    maxSessions = 16
+
+    def __init__(self, savedValues=None, maxCommands=64, parent=None):
+        super().__init__(parent)
+        savedValues = loadSavedValues() if savedValues is None else savedValues
+        self.commands = queue.Queue(maxCommands)
+        # Jobs that must not be dropped, waiting for room in the queue, and the control commands already queued
+        self.overflow = deque()
+        self.queuedCommands = set()
+        self.events = []
+        self.eventsLock = threading.Lock()
+        self.reader = WordReader(mode=savedValues.get('wordReadMode', 'window'),
+                                 windowParagraphs=int(savedValues.get('wordWindowParagraphs', 3)))
+        self.sessions = OrderedDict()
+        self.session = None
+        self.replacePending = False
+        self.failures = 0
+        self.pollScheduler = PollScheduler(minInterval=int(savedValues.get('pollMinIntervalMs', 33)) / 1000,
+                                           maxInterval=int(savedValues.get('pollMaxIntervalMs', 1000)) / 1000)
+        self.polling = True
+        self.stopping = False
+        self.ident = None
+        self.tempDir = None
+        self.tempCount = 0
+
+    def stop(self):
+        self.stopping = True
+        self.wake()
+
+    # Never waits for room, the caller is the GUI thread. Returns False when the queue is full (Word is slow or hung),
+    # unless keep is set: those jobs wait in overflow, in order, and are retried from the GUI's event loop meanwhile.
+    def submit(self, job, keep=False):
+        if not self.overflow:
+            try:
+                self.commands.put_nowait(job)
+                return True
+            except queue.Full:
+                pass
+        if not keep:
+            return False
+        self.overflow.append(job)
+        if len(self.overflow) == 1:
+            self.post(ConnectionEvent(False, 'Word is busy, inserting once it catches up...'))
+            QTimer.singleShot(50, self.flushOverflow)
+        return True
+
+    def flushOverflow(self):
+        while self.overflow:
+            try:
+                self.commands.put_nowait(self.overflow[0])
+            except queue.Full:
+                if self.isFinished():
+                    print(f'Error submitting Word jobs: worker stopped, {len(self.overflow)} dropped')
+                    self.overflow.clear()
+                    return
+                QTimer.singleShot(50, self.flushOverflow)
+                return
+            self.overflow.popleft()
+        self.post(ConnectionEvent(True, ''))
+
+    # Control commands never wait for room, one of a kind queued is enough and a full queue wakes the loop anyway
+    def command(self, command):
+        if command in self.queuedCommands:
+            return
+        self.queuedCommands.add(command)
+        try:
+            self.commands.put_nowait(command)
+        except queue.Full:
+            self.queuedCommands.discard(command)
+
+    def wake(self):
+        self.command(self.wakeCommand)
+
+    # Replace the equation under the cursor on the next poll, as \done does
+    def requestReplace(self):
+        self.command(self.replaceCommand)
+
+    # Convert All pauses polling between its scan and replace jobs so the document is left alone meanwhile. Returns
+    # False when the queue is full, resuming then happens right away since nothing queued relies on the pause.
+    def setPolling(self, polling):
+        def job(word):
+            self.polling = polling
+        if self.submit(job):
+            return True
+        if polling:
+            self.polling = True
+        return False
+
+    def post(self, event):
+        with self.eventsLock:
+            if isinstance(event, self.collapsible):
+                for index in range(len(self.events) - 1, -1, -1):
+                    if not isinstance(self.events[index], self.collapsible):
+                        break
+                    if type(self.events[index]) is type(event):
+                        del self.events[index]
+                        break
+            notify = not self.events
+            self.events.append(event)
+        if notify:
+            self.eventsPosted.emit()
+
+    def takeEvents(self):
+        with self.eventsLock:
+            events, self.events = self.events, []
+        return events
+
+    def writeTemp(self, svg):
+        self.tempCount += 1
+        tempFilePath = os.path.join(self.tempDir, f'equation{self.tempCount}.svg')
+        with open(tempFilePath, 'w', encoding='utf-8') as f:
+            f.write(svg)
+        return tempFilePath
+
+    # Insert at position in the named document when given, at the cursor of the active document otherwise.
+    # description goes to the picture's AlternativeText, see EquationSource.
+    def insertSvg(self, svg, position=None, documentName=None, description=None):
+        requestedAt = time.perf_counter()
+
+        def job(word):
+            tempFilePath = self.writeTemp(svg)
+            try:
+                with tracer.span('insert.word', output='svg'):
+                    wordDoc = word.Documents(documentName) if documentName else word.ActiveDocument
+                    if position is None:
+                        shape = wordDoc.InlineShapes.AddPicture(tempFilePath)
+                    else:
+                        shape = wordDoc.InlineShapes.AddPicture(tempFilePath, False, True,
+                                                                wordDoc.Range(position, position))
+                    if description:
+                        shape.AlternativeText = description
+            finally:
+                os.unlink(tempFilePath)
+            self.post(InsertDoneEvent('svg', documentName, requestedAt))
+        # The equation text may already be gone from the document, the picture has to follow
+        self.submit(job, keep=True)
+
+    # Same as insertSvg, with a native Word equation instead of a picture
+    def insertOmml(self, omml, position=None, documentName=None):
+        requestedAt = time.perf_counter()
+
+        def job(word):
+            with tracer.span('insert.word', output='omml'):
+                wordDoc = word.Documents(documentName) if documentName else word.ActiveDocument
+                insertOmml(wordDoc, word.Selection.Range if position is None else wordDoc.Range(position, position),
+                           omml)
+            self.post(InsertDoneEvent('omml', documentName, requestedAt))
+        self.submit(job, keep=True)
+
+    def run(self):
+        self.ident = threading.get_ident()
+        pythoncom.CoInitialize()
+        self.tempDir = tempfile.mkdtemp(prefix='MJ2G')
+        keyboardListener = None
+        try:
+            word = win32.gencache.EnsureDispatch('Word.Application')
+            keyboardListener = keyboard.Listener(on_press=lambda key: self.wake())
+            keyboardListener.start()
+            while not self.stopping:
+                try:
+                    command = self.commands.get(timeout=self.interval())
+                except queue.Empty:
+                    command = None
+                self.queuedCommands.discard(command)
+                if command is self.wakeCommand:
+                    self.pollScheduler.active()
+                elif command is self.replaceCommand:
+                    self.replacePending = True
+                elif command is not None:
+                    self.runJob(command, word)
+                    # Run queued jobs back to back, polling in between would only slow them down
+                    if not self.commands.empty():
+                        continue
+                if self.polling and not self.stopping:
+                    word = self.pollOrReconnect(word)
+            # Hand the document back with every insertion asked for so far done
+            while True:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+                if callable(command):
+                    self.runJob(command, word)
+        except Exception as e:
+            self.post(ErrorEvent(f'Error in Word worker: {e}', True))
+        finally:
+            if keyboardListener is not None:
+                keyboardListener.stop()
+            shutil.rmtree(self.tempDir, ignore_errors=True)
+            pythoncom.CoUninitialize()
+
+    def runJob(self, job, word):
+        try:
+            job(word)
+        except Exception as e:
+            self.post(ErrorEvent(f'Error in Word job: {e}', False))
+
+    # Poll interval, or the backoff while Word is unreachable
+    def interval(self):
+        if self.failures:
+            return min(self.maxBackoff, self.minBackoff * 2 ** (self.failures - 1))
+        return self.pollScheduler.interval
+
+    # Returns the dispatch to keep using, a fresh one after a few failures in a row when Word can give one
+    def pollOrReconnect(self, word):
+        try:
+            self.poll(word)
+        except Exception as e:
+            self.failures += 1
+            if self.failures == 1:
+                self.post(ConnectionEvent(False, f'Waiting for Word: {e}'))
+            if self.failures % self.redispatchAfter == 0:
+                try:
+                    return win32.GetActiveObject('Word.Application')
+                except Exception:
+                    pass
+            return word
+        if self.failures:
+            self.failures = 0
+            self.post(ConnectionEvent(True, ''))
+        return word
+
+    # Session of the focused document, switching to it (and telling the GUI) when focus moved
+    def sessionFor(self, documentName):
+        if self.session is not None and self.session.documentName == documentName:
+            return self.session
+        session = self.sessions.pop(documentName, None) or WordSession(documentName)
+        self.sessions[documentName] = session
+        while len(self.sessions) > self.maxSessions:
+            self.sessions.popitem(last=False)
+        self.session = session
+        self.post(DocumentEvent(documentName))
+        self.post(SnapshotEvent(session.hasEquation))
+        return session
+
+    # One WordHook tick, raises when Word has no document to give or rejects the call
+    def poll(self, word):
+        wordDoc = word.ActiveDocument
+        session = self.sessionFor(wordDoc.FullName)
+        readStarted = time.perf_counter()
+        with tracer.span('poll.read'):
+            wordContent, contentStart = self.reader.read(word, wordDoc, session)
+        # Nothing changed since the last tick, don't re-emit and re-render the same equation
+        snapshot = hashlib.blake2b(wordContent.encode(), digest_size=16).digest()
+        if snapshot == session.snapshot and not self.replacePending:
+            self.pollScheduler.idle(session.editing)
+            return
+        session.snapshot = snapshot
+        with tracer.span('poll.scan'):
+            blocks = session.scanner.scan(wordContent)
+        # An unpaired $$ means an equation is being typed, keep polling fast
+        session.editing = len(blocks) > 0 or not WordReader.delimitersBalanced(wordContent)
+        session.hasEquation = len(blocks) > 0
+        self.post(SnapshotEvent(session.hasEquation))
+        if len(blocks) == 0:
+            self.replacePending = False
+            self.pollScheduler.idle(session.editing)
+            return
+        self.pollScheduler.active()
+        blockStart, blockEnd = blocks[0]
+        equation = DelimiterScanner.equation(wordContent, blocks[0]).replace('$$', '')
+        if equation != session.emitted:
+            session.emitted = equation
+            self.post(MatchEvent(equation, readStarted, time.perf_counter()))
+        if r'\done' in equation or self.replacePending:
+            self.replacePending = False
+            session.emitted = None
+            rangeToDelete = self.equationRange(wordDoc, contentStart + blockStart, contentStart + blockEnd,
+                                               contentStart)
+            # The $$ before the window are only tracked between ticks, count them for real before deleting anything
+            if contentStart and not WordReader.delimitersBalanced(wordDoc.Range(0, contentStart).Text or ''):
+                session.delimitersBefore = None
+                self.post(ErrorEvent('Error replacing equation: the document changed while reading it, try again',
+                                     False))
+            elif rangeToDelete is None:
+                self.post(ErrorEvent('Error replacing equation: delimiters not found in document', False))
+            else:
+                rangeToDelete.Delete()
+                self.post(ReplaceRequestEvent(equation.replace(r'\done', ''), rangeToDelete.Start,
+                                              session.documentName))
+
+    # Range of a $$ block from the scanner offsets. Text offsets can drift from document positions (fields, hidden
+    # text...), so check the delimiters are where expected and otherwise look them up with Find from searchFrom.
+    @staticmethod
+    def equationRange(wordDoc, start, end, searchFrom):
+        blockRange = wordDoc.Range(start, end)
+        text = blockRange.Text or ''
+        if text.startswith('$$') and text.endswith('$$') and len(text) >= 4:
+            return blockRange
+        rangeFind = wordDoc.Range(searchFrom, wordDoc.Range().End)
+        rangeFind.Find.ClearFormatting()
+        rangeFind.Find.Text = '$$'
+        if not rangeFind.Find.Execute():
+            return None
+        firstStartPos = rangeFind.Start
+        rangeFind = wordDoc.Range(rangeFind.End, wordDoc.Range().End)
+        rangeFind.Find.ClearFormatting()
+        rangeFind.Find.Text = '$$'
+        if not rangeFind.Find.Execute():
+            return None
+        return wordDoc.Range(firstStartPos, rangeFind.End)
+
+
+# Every $$ block of a document text as (start, end, equation), offsets including the delimiters
+def scanEquationBlocks(text):
+    return [(start, end, DelimiterScanner.equation(text, (start, end))) for start, end in DelimiterScanner().scan(text)]
+
+
+# Replace a range with a picture from an SVG file, returns the InlineShape
+def insertPicture(wordDoc, blockRange, path):
+    # A non collapsed range is replaced by the picture
+    return wordDoc.InlineShapes.AddPicture(path, False, True, blockRange)
+
+
+# Replace a range with a native Word equation from OMML. Equations have no AlternativeText, so returns None.
+def insertOmml(wordDoc, blockRange, omml):
+    blockRange.InsertXML(OmmlConverter.package(omml))
+    return None
+
+
+# WordHook pictures keep their TeX source and a hash of it with the render options in AlternativeText, so a document
+# can be re-rendered later. A picture is stale when its hash differs from what the current options give, either
+# because the options changed or because the TeX was edited in Word's alt text pane.
+class EquationSource:
+    prefix = 'MJ2G:'
+
+    @staticmethod
+    def optionsHash(tex, options, extra=''):
+        return hashlib.sha256(json.dumps([tex, list(options), extra]).encode()).hexdigest()[:16]
+
+    @classmethod
+    def describe(cls, tex, optionsHash):
+        return cls.prefix + json.dumps({'tex': tex, 'hash': optionsHash})
+
+    # (tex, hash), or None for anything not inserted by MJ2G
+    @classmethod
+    def parse(cls, text):
+        if not text or not text.startswith(cls.prefix):
+            return None
+        try:
+            data = json.loads(text[len(cls.prefix):])
+            return data['tex'], data.get('hash', '')
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    # (index, tex, hash) of every MJ2G picture in the document, index being the 1-based InlineShapes index
+    @classmethod
+    def index(cls, wordDoc):
+        entries = []
+        shapes = wordDoc.InlineShapes
+        for index in range(1, shapes.Count + 1):
+            parsed = cls.parse(shapes(index).AlternativeText)
+            if parsed is not None:
+                entries.append((index, *parsed))
+        return entries
+
+
+# Replace blocks with their pictures from the end of the document backwards so earlier offsets stay valid, as a single
+# undo step. A block whose text no longer matches (edited meanwhile, or offsets off because of fields) is skipped, as is
+# one without a picture. pictureFor maps an equation to what insert puts in its place, an SVG file path for
+# insertPicture or OMML for insertOmml, describe to its AlternativeText. Returns (replaced, skipped).
+def replaceEquationBlocks(wordDoc, blocks, pictureFor, progress=None, insert=insertPicture, describe=None):
+    undoRecord = wordDoc.Application.UndoRecord
+    undoRecord.StartCustomRecord('MJ2G Convert all')
+    replaced = skipped = 0
+    try:
+        for index, (start, end, equation) in enumerate(sorted(blocks, reverse=True)):
+            picture = pictureFor(equation)
+            blockRange = wordDoc.Range(start, end)
+            if picture is None or blockRange.Text != f'$${equation}$$':
+                skipped += 1
+            else:
+                inserted = insert(wordDoc, blockRange, picture)
+                if describe is not None and inserted is not None:
+                    inserted.AlternativeText = describe(equation)
+                replaced += 1
+            if progress is not None:
+                progress(index + 1, len(blocks))
+    finally:
+        undoRecord.EndCustomRecord()
+    return replaced, skipped
+
+
+# Swap indexed pictures (EquationSource.index entries) for new renders in place, last first, as a single undo step.
+# A picture whose source changed since it was indexed is skipped. Same arguments and result as replaceEquationBlocks.
+def reRenderEquations(wordDoc, entries, pictureFor, progress=None, insert=insertPicture, describe=None):
+    undoRecord = wordDoc.Application.UndoRecord
+    undoRecord.StartCustomRecord('MJ2G Re-render')
+    replaced = skipped = 0
+    try:
+        for count, (index, tex, _) in enumerate(sorted(entries, reverse=True)):
+            picture = pictureFor(tex)
+            shape = wordDoc.InlineShapes(index) if index <= wordDoc.InlineShapes.Count else None
+            source = EquationSource.parse(shape.AlternativeText) if shape is not None else None
+            if picture is None or source is None or source[0] != tex:
+                skipped += 1
+            else:
+                inserted = insert(wordDoc, shape.Range, picture)
+                if describe is not None and inserted is not None:
+                    inserted.AlternativeText = describe(tex)
+                replaced += 1
+            if progress is not None:
+                progress(count + 1, len(entries))
+    finally:
+        undoRecord.EndCustomRecord()
+    return replaced, skipped
+
+
+# MathML (as MathJax's tex2mml produces it) to OMML, Word's native equation format. Covers what TeX input produces:
+# tokens, scripts, fractions, radicals, big operators, accents, fences, matrices and enclosures; anything else has its
+# children converted in order. Stands in for Office's MML2OMML.XSL, which cannot be shipped and needs an XSLT engine.
+class OmmlConverter:
+    mathmlNamespace = 'http://www.w3.org/1998/Math/MathML'
+    ommlNamespace = 'http://schemas.openxmlformats.org/officeDocument/2006/math'
+    wordNamespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    largeOperators = set('\u2211\u220f\u2210\u222b\u222c\u222d\u222e\u222f\u2230\u22c0\u22c1\u22c2\u22c3\u2a00\u2a01\u2a02\u2a04\u2a06')
+    accents = {'^': '\u0302', '\u02c6': '\u0302', '~': '\u0303', '\u02dc': '\u0303', '\u00af': '\u0305', '\u2015': '\u0305',
+               '\u203e': '\u0305', '\u2192': '\u20d7', '\u02d9': '\u0307', '\u00a8': '\u0308', '\u02c7': '\u030c', '\u02d8': '\u0306',
+               '\u00b4': '\u0301', '\u02ca': '\u0301', '`': '\u0300', '\u02cb': '\u0300', '\u02da': '\u030a'}
+    styles = {'normal': 'p', 'bold': 'b', 'italic': 'i', 'bold-italic': 'bi'}
+    scripts = {'double-struck': 'double-struck', 'fraktur': 'fraktur', 'bold-fraktur': 'fraktur', 'script': 'script',
+               'bold-script': 'script', 'sans-serif': 'sans-serif', 'bold-sans-serif': 'sans-serif',
+               'monospace': 'monospace'}
+    transparent = ('math', 'mrow', 'mstyle', 'mpadded', 'semantics', 'mlabeledtr', 'mtd', 'TeXAtom')
+    # Flat OPC package with one paragraph, the form Range.InsertXML takes
+    packageTemplate = (
+        '<?xml version="1.0" standalone="yes"?><?mso-application progid="Word.Document"?>'
+        '<pkg:package xmlns:pkg="http://schemas.microsoft.com/office/2006/xmlPackage">'
+        '<pkg:part pkg:name="/_rels/.rels" pkg:contentType="application/vnd.openxmlformats-package.relationships+xml">'
+        '<pkg:xmlData><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="word/document.xml"/></Relationships></pkg:xmlData></pkg:part>'
+        '<pkg:part pkg:name="/word/document.xml" pkg:contentType="application/vnd.openxmlformats-officedocument.'
+        'wordprocessingml.document.main+xml"><pkg:xmlData><w:document xmlns:w="{word}" xmlns:m="{math}"><w:body>'
+        '<w:p>{omml}</w:p></w:body></w:document></pkg:xmlData></pkg:part></pkg:package>')
+
+    def __init__(self):
+        ET.register_namespace('m', self.ommlNamespace)
+
+    @staticmethod
+    def localName(tag):
+        return tag.rpartition('}')[2] if isinstance(tag, str) else ''
+
+    def m(self, tag, parent=None, **attributes):
+        element = ET.Element(f'{{{self.ommlNamespace}}}{tag}') if parent is None \
+            else ET.SubElement(parent, f'{{{self.ommlNamespace}}}{tag}')
+        for name, value in attributes.items():
+            element.set(f'{{{self.ommlNamespace}}}{name}', value)
+        return element
+
+    # Convert to <m:oMath>, wrapped in <m:oMathPara> for a display equation
+    def convert(self, mathml, display=True):
+        root = ET.fromstring(mathml)
+        oMath = self.m('oMath')
+        self.sequence(list(root), oMath)
+        if not display:
+            return ET.tostring(oMath, encoding='unicode')
+        oMathPara = self.m('oMathPara')
+        oMathPara.append(oMath)
+        return ET.tostring(oMathPara, encoding='unicode')
+
+    @classmethod
+    def package(cls, omml):
+        return cls.packageTemplate.format(word=cls.wordNamespace, math=cls.ommlNamespace, omml=omml)
+
+    def text(self, element):
+        return ''.join(element.itertext()).strip() if self.localName(element.tag) != 'mtext' \
+            else ''.join(element.itertext())
+
+    def isOperator(self, element, characters=None):
+        if self.localName(element.tag) in ('mrow', 'TeXAtom') and len(element) == 1:
+            return self.isOperator(element[0], characters)
+        return self.localName(element.tag) == 'mo' and (characters is None or self.text(element) in characters)
+
+    # Children in order into parent. A big operator takes the element after it as its operand, and a fence pair
+    # with the elements between becomes a delimiter.
+    def sequence(self, children, parent):
+        index = 0
+        while index < len(children):
+            child = children[index]
+            name = self.localName(child.tag)
+            if name in ('munderover', 'munder', 'mover', 'msubsup', 'msub', 'msup') and len(child) \
+                    and self.isOperator(child[0], self.largeOperators):
+                operand = children[index + 1] if index + 1 < len(children) else None
+                self.nary(child, operand, parent)
+                index += 2
+                continue
+            if self.isFence(child, 'OPEN'):
+                close = self.matchingFence(children, index)
+                if close is not None:
+                    self.delimiter(self.text(child), self.text(children[close]), children[index + 1:close], parent)
+                    index = close + 1
+                    continue
+            self.element(child, parent)
+            index += 1
+
+    def matchingFence(self, children, index):
+        depth = 0
+        for position in range(index, len(children)):
+            if self.isFence(children[position], 'OPEN'):
+                depth += 1
+            elif self.isFence(children[position], 'CLOSE'):
+                depth -= 1
+                if depth == 0:
+                    return position
+        return None
+
+    def isFence(self, element, texClass):
+        return self.localName(element.tag) == 'mo' and (element.get('data-mjx-texclass') == texClass or (
+            element.get('fence') == 'true' and element.get('form') == ('prefix' if texClass == 'OPEN' else 'postfix')))
+
+    def argument(self, tag, element, parent):
+        container = self.m(tag, parent)
+        if element is not None:
+            self.element(element, container)
+        return container
+
+    def element(self, element, parent):
+        name = self.localName(element.tag)
+        children = list(element)
+        if name in ('mi', 'mn', 'mo', 'mtext', 'ms'):
+            self.run(element, parent)
+        elif name in self.transparent:
+            self.sequence(children, parent)
+        elif name in ('mspace', 'none', 'mprescripts', 'annotation', 'annotation-xml'):
+            pass
+        elif name == 'mfrac' and len(children) == 2:
+            fraction = self.m('f', parent)
+            if element.get('linethickness') in ('0', '0px', '0em'):
+                self.m('type', self.m('fPr', fraction), val='noBar')
+            self.argument('num', children[0], fraction)
+            self.argument('den', children[1], fraction)
+        elif name == 'msqrt':
+            radical = self.m('rad', parent)
+            self.m('degHide', self.m('radPr', radical), val='1')
+            self.m('deg', radical)
+            self.sequence(children, self.m('e', radical))
+        elif name == 'mroot' and len(children) == 2:
+            radical = self.m('rad', parent)
+            self.argument('deg', children[1], radical)
+            self.argument('e', children[0], radical)
+        elif name in ('msup', 'msub') and len(children) == 2:
+            script = self.m('sSup' if name == 'msup' else 'sSub', parent)
+            self.argument('e', children[0], script)
+            self.argument('sup' if name == 'msup' else 'sub', children[1], script)
+        elif name == 'msubsup' and len(children) == 3:
+            script = self.m('sSubSup', parent)
+            self.argument('e', children[0], script)
+            self.argument('sub', children[1], script)
+            self.argument('sup', children[2], script)
+        elif name == 'mover' and len(children) == 2:
+            if self.isOperator(children[1]) and self.text(children[1]) in self.accents:
+                accent = self.m('acc', parent)
+                self.m('chr', self.m('accPr', accent), val=self.accents[self.text(children[1])])
+                self.argument('e', children[0], accent)
+            else:
+                limit = self.m('limUpp', parent)
+                self.argument('e', children[0], limit)
+                self.argument('lim', children[1], limit)
+        elif name == 'munder' and len(children) == 2:
+            limit = self.m('limLow', parent)
+            self.argument('e', children[0], limit)
+            self.argument('lim', children[1], limit)
+        elif name == 'munderover' and len(children) == 3:
+            upper = self.m('limUpp', parent)
+            lower = self.m('limLow', self.m('e', upper))
+            self.argument('e', children[0], lower)
+            self.argument('lim', children[1], lower)
+            self.argument('lim', children[2], upper)
+        elif name == 'mfenced':
+            self.delimiter(element.get('open', '('), element.get('close', ')'), children, parent)
+        elif name == 'mtable':
+            matrix = self.m('m', parent)
+            for row in children:
+                matrixRow = self.m('mr', matrix)
+                for cell in row:
+                    self.sequence([cell], self.m('e', matrixRow))
+        elif name == 'mphantom':
+            self.sequence(children, self.m('e', self.m('phant', parent)))
+        elif name == 'menclose':
+            self.sequence(children, self.m('e', self.m('borderBox', parent)))
+        else:
+            self.sequence(children, parent)
+
+    def run(self, element, parent):
+        # Invisible function application and separators only matter to screen readers
+        text = re.sub('[\u2061-\u2064]', '', self.text(element))
+        if not text:
+            return
+        run = self.m('r', parent)
+        name = self.localName(element.tag)
+        variant = element.get('mathvariant')
+        if name == 'mtext':
+            self.m('nor', self.m('rPr', run))
+        elif variant in self.scripts:
+            properties = self.m('rPr', run)
+            self.m('scr', properties, val=self.scripts[variant])
+            if variant.startswith('bold'):
+                self.m('sty', properties, val='b')
+        elif variant in self.styles:
+            self.m('sty', self.m('rPr', run), val=self.styles[variant])
+        elif name != 'mi' or len(text) > 1:
+            # Numbers, operators and function names are upright
+            self.m('sty', self.m('rPr', run), val='p')
+        textElement = self.m('t', run)
+        textElement.text = text
+        if text != text.strip():
+            textElement.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+
+    def delimiter(self, opening, closing, children, parent):
+        delimiter = self.m('d', parent)
+        properties = self.m('dPr', delimiter)
+        self.m('begChr', properties, val=opening)
+        self.m('endChr', properties, val=closing)
+        self.sequence(children, self.m('e', delimiter))
+
+    def nary(self, element, operand, parent):
+        base, limits = element[0], list(element)[1:]
+        name = self.localName(element.tag)
+        nary = self.m('nary', parent)
+        properties = self.m('naryPr', nary)
+        self.m('chr', properties, val=self.text(base))
+        self.m('limLoc', properties, val='undOvr' if name.startswith('mu') else 'subSup')
+        lower = limits[0] if name in ('munderover', 'munder', 'msubsup', 'msub') else None
+        upper = limits[-1] if name in ('munderover', 'mover', 'msubsup', 'msup') else None
+        if lower is None:
+            self.m('subHide', properties, val='1')
+        if upper is None:
+            self.m('supHide', properties, val='1')
+        self.argument('sub', lower, nary)
+        self.argument('sup', upper, nary)
+        self.argument('e', operand, nary)
+
+
+# Post-processing between rendering and copy/save/insert. MathJax SVG carries data-* attributes on every node, ids,
+# wrapper groups and more coordinate digits than needed (coordinates are in thousandths of an em), which adds up to
+# megabytes in a document with hundreds of equations.
+class SvgOptimizer:
+    svgNamespace = 'http://www.w3.org/2000/svg'
+    xlinkNamespace = 'http://www.w3.org/1999/xlink'
+    hrefAttributes = ('href', '{http://www.w3.org/1999/xlink}href')
+    droppedTags = ('title', 'desc', 'metadata')
+    droppedAttributes = ('role', 'focusable')
+    numberPattern = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+    translatePattern = re.compile(r'translate\(([^)]*)\)')
+    urlPattern = re.compile(r'url\(#([^)]+)\)')
+
+    def __init__(self, precision=1, enabled=True):
+        self.precision = max(0, int(precision))
+        self.enabled = enabled
+        ET.register_namespace('', self.svgNamespace)
+        ET.register_namespace('xlink', self.xlinkNamespace)
+
+    # Part of render cache keys, so changing the settings does not serve SVG optimized differently
+    def identity(self):
+        return f'optimize:{self.precision}' if self.enabled else 'optimize:off'
+
+    @staticmethod
+    def localName(tag):
+        return tag.rpartition('}')[2] if isinstance(tag, str) else ''
+
+    def formatNumber(self, match):
+        value = round(float(match.group()), self.precision)
+        text = f'{value:.{self.precision}f}'
+        if '.' in text:
+            text = text.rstrip('0').rstrip('.')
+        if text in ('-0', ''):
+            text = '0'
+        # 0.5 -> .5, -0.5 -> -.5
+        return re.sub(r'^(-?)0\.', r'\1.', text)
+
+    def roundNumbers(self, text):
+        return self.numberPattern.sub(self.formatNumber, text)
+
+    def minifyPath(self, d):
+        d = self.roundNumbers(d)
+        d = re.sub(r'\s*([A-Za-z])\s*', r'\1', d)
+        d = re.sub(r'[\s,]+-', '-', d)
+        return re.sub(r'[\s,]+', ' ', d).strip()
+
+    def references(self, root):
+        referenced = set()
+        for element in root.iter():
+            for name, value in element.attrib.items():
+                if name in self.hrefAttributes and value.startswith('#'):
+                    referenced.add(value[1:])
+                else:
+                    referenced.update(self.urlPattern.findall(value))
+        return referenced
+
+    def clean(self, element):
+        for child in list(element):
+            if self.localName(child.tag) in self.droppedTags or not isinstance(child.tag, str):
+                element.remove(child)
+                continue
+            self.clean(child)
+        for name in list(element.attrib):
+            if name.startswith('data-') or name.startswith('aria-') or name in self.droppedAttributes:
+                del element.attrib[name]
+        attributes = element.attrib
+        if 'd' in attributes:
+            attributes['d'] = self.minifyPath(attributes['d'])
+        for name in ('viewBox', 'x', 'y', 'x1', 'y1', 'x2', 'y2', 'width', 'height', 'rx', 'ry'):
+            if name in attributes and not attributes[name].endswith(('ex', 'em', '%')):
+                attributes[name] = self.roundNumbers(attributes[name])
+        if 'transform' in attributes:
+            # Only offsets are rounded, scale factors need their digits
+            attributes['transform'] = self.translatePattern.sub(
+                lambda match: 'translate({})'.format(self.roundNumbers(match.group(1))), attributes['transform'])
+        if 'style' in attributes:
+            attributes['style'] = re.sub(r'\s*([:;])\s*', r'\1', attributes['style']).strip().rstrip(';')
+
+    # Groups left without attributes only wrap their children
+    def unwrapGroups(self, element):
+        index = 0
+        while index < len(element):
+            child = element[index]
+            self.unwrapGroups(child)
+            if self.localName(child.tag) == 'g' and not child.attrib:
+                element.remove(child)
+                for offset, grandchild in enumerate(list(child)):
+                    element.insert(index + offset, grandchild)
+                index += len(child)
+            else:
+                index += 1
+
+    def dropUnusedIds(self, root):
+        referenced = self.references(root)
+        for parent in list(root.iter()):
+            for child in list(parent):
+                identifier = child.get('id')
+                if identifier is None or identifier in referenced:
+                    continue
+                if self.localName(parent.tag) == 'defs':
+                    parent.remove(child)
+                else:
+                    del child.attrib['id']
+        for parent in list(root.iter()):
+            for child in list(parent):
+                if self.localName(child.tag) == 'defs' and len(child) == 0:
+                    parent.remove(child)
+
+    @staticmethod
+    def serialize(root):
+        return ET.tostring(root, encoding='unicode').replace(' />', '/>')
+
+    def optimize(self, svg):
+        if not self.enabled or not svg:
+            return svg
+        try:
+            root = ET.fromstring(svg)
+        except ET.ParseError as e:
+            print(f'Error optimizing SVG: {e}')
+            return svg
+        self.clean(root)
+        self.unwrapGroups(root)
+        self.dropUnusedIds(root)
+        return self.serialize(root)
+
+    # Move the glyph definitions of many optimized SVGs into one shared defs file, which the SVGs then reference as
+    # href#glyph. Identical glyphs are stored once. Returns (sprite svg, rewritten svgs).
+    def sprite(self, svgs, href):
+        glyphs = OrderedDict()
+        rewritten = []
+        for svg in svgs:
+            root = ET.fromstring(svg)
+            renamed = {}
+            for defs in [element for element in root.iter() if self.localName(element.tag) == 'defs']:
+                for glyph in list(defs):
+                    identifier = glyph.attrib.pop('id', None)
+                    content = ET.tostring(glyph, encoding='unicode')
+                    name = 'g' + hashlib.sha1(content.encode()).hexdigest()[:10]
+                    glyph.set('id', name)
+                    glyphs.setdefault(name, glyph)
+                    if identifier is not None:
+                        renamed[identifier] = name
+            for parent in list(root.iter()):
+                for child in list(parent):
+                    if self.localName(child.tag) == 'defs':
+                        parent.remove(child)
+            for element in root.iter():
+                for name in self.hrefAttributes:
+                    value = element.get(name)
+                    if value and value.startswith('#') and value[1:] in renamed:
+                        element.set(name, f'{href}#{renamed[value[1:]]}')
+            rewritten.append(self.serialize(root))
+        sprite = ET.Element(f'{{{self.svgNamespace}}}svg')
+        defs = ET.SubElement(sprite, f'{{{self.svgNamespace}}}defs')
+        defs.extend(glyphs.values())
+        return self.serialize(sprite), rewritten
+
+
+RenderOptions = namedtuple('RenderOptions', ['displayStyle', 'physicsEnabled', 'colorsv2Enabled'],
+                           defaults=[True, False, False])
+
+
+# ABCMeta first so it collects the abstract methods before QObject's metaclass builds the class. Qt objects are
+# created without object.__new__, which is where the abstract method check usually happens, so Renderer makes it itself.
+class RendererMeta(ABCMeta, type(QObject)):
+    pass
+
+
+# TeX to SVG engines. render(tex, options, callback) is asynchronous and calls callback(svg, error) from the Qt event
+# loop once done, svg being '' and error set when the equation could not be rendered. identity() tells renders of
+# different engines or MathJax builds apart, e.g. for cache keys. A backend missing any of the abstract methods fails
+# when it is created.
+class Renderer(QObject, ABC, metaclass=RendererMeta):
+    def __init__(self, parent=None):
+        if self.__abstractmethods__:
+            raise TypeError(f"Can't instantiate {type(self).__name__} without "
+                            f"{', '.join(sorted(self.__abstractmethods__))}")
+        super(Renderer, self).__init__(parent)
+
+    @staticmethod
+    def texFor(tex, options):
+        return (r"\displaystyle " if options.displayStyle else "") + tex
+
+    @abstractmethod
+    def identity(self):
+        pass
+
+    @abstractmethod
+    def render(self, tex, options, callback):
+        pass
+
+    # Like render, with MathML instead of SVG
+    @abstractmethod
+    def renderMathML(self, tex, options, callback):
+        pass
+
+    # TeX to typeset in the background once MathJax is up, so the first real render does not pay for its lazy setup
+    def warmUp(self, equations, options):
+        pass
+
+    # Load MathJax anew, e.g. after switching its source
+    def reload(self, source, physicsEnabled=False, colorsv2Enabled=False):
+        pass
+
+    def close(self):
+        pass
+
+
+# A page hosting MathJax, rendering without any view. Renders are queued by the
+# renderer until MathJax has loaded and run one at a time; idleSignal fires whenever the page can take the next one.
+class MathJaxPage(QWebEnginePage):
+    idleSignal = Signal()
+
+    def __init__(self, source=None, physicsEnabled=False, colorsv2Enabled=False, resolved=None, parent=None):
+        super(MathJaxPage, self).__init__(parent)
+        self.ready = False
+        self.requestId = 0
+        self.inFlight = None
+        self.script = None
+        self.profile = None
+        # TeX typeset every time MathJax has loaded, see WarmUpCorpus
+        self.warmUpCorpus = []
+        self.loadFinished.connect(self.checkReady)
+        if source is not None:
+            self.loadMathJax(source, physicsEnabled, colorsv2Enabled, resolved)
+
+    # resolved is source.resolve() when the caller already has it, e.g. for all pages of a renderer
+    def loadMathJax(self, source, physicsEnabled=False, colorsv2Enabled=False, resolved=None):
+        # A render cut short by the reload would never call back
+        if self.inFlight is not None:
+            callback, self.inFlight = self.inFlight[1], None
+            callback('', 'page reloaded')
+        self.ready = False
+        self.script, baseUrl = resolved or source.resolve()
+        self.profile = texPackages(physicsEnabled, colorsv2Enabled)
+        self.setHtml(buildMathJaxHtml(self.script, physicsEnabled, colorsv2Enabled), baseUrl)
+
+    def checkReady(self, ok=True):
+        self.runJavaScript("typeof MathJax !== 'undefined' && typeof MathJax.tex2svg === 'function'", 0,
+                           self.readyChecked)
+
+    def readyChecked(self, ready):
+        if self.ready:
+            return
+        if ready:
+            self.ready = True
+            self.warmUp()
+            self.idleSignal.emit()
+        else:
+            QTimer.singleShot(20, self.checkReady)
+
+    def warmUp(self):
+        if self.ready and self.warmUpCorpus:
+            self.runJavaScript(f'mj2gWarmUp({json.dumps(self.warmUpCorpus)});', 0)
+
+    def isIdle(self):
+        return self.ready and self.inFlight is None
+
+    # Render with the given package profile, switching the page to it first when needed. output is svg or mml.
+    def render(self, tex, packages, callback, output='svg'):
+        self.requestId += 1
+        requestId = self.requestId
+        self.inFlight = (requestId, callback)
+        function = 'mj2gMathML' if output == 'mml' else 'mj2gRender'
+        script = "{}({}, {});".format(function, requestId, json.dumps(tex))
+        if packages != self.profile:
+            self.profile = packages
+            script = "mj2gSetProfile({}); {}".format(json.dumps(packages), script)
+
+        def rendered(result):
+            if self.inFlight is None or self.inFlight[0] != requestId:
+                return
+            self.inFlight = None
+            if isinstance(result, dict) and result.get(output):
+                callback(result[output], '')
+            else:
+                callback('', result.get('error', 'no result') if isinstance(result, dict) else 'no result')
+            self.idleSignal.emit()
+
+        self.runJavaScript(script, 0, rendered)
+
+
+# MathJax in QtWebEngine pages. Several pages (each its own renderer process) render concurrently.
+class WebEngineRenderer(Renderer):
+    # Pages, and with the first one the WebEngine profile, are only created once something is loaded or rendered
+    def __init__(self, pages=None, size=1, source=None, parent=None):
+        super(WebEngineRenderer, self).__init__(parent)
+        self.queue = deque()
+        self.size = max(1, size)
+        self.source = source
+        self.script = source.resolve()[0] if source is not None else None
+        self.warmUpCorpus = []
+        self.pages = []
+        for page in pages or []:
+            self.addPage(page)
+
+    def addPage(self, page):
+        page.warmUpCorpus = self.warmUpCorpus
+        page.idleSignal.connect(self.dispatch)
+        self.pages.append(page)
+        if page.script is not None:
+            self.script = page.script
+
+    # Returns whether pages were created, and with a source loaded in them
+    def createPages(self, physicsEnabled=False, colorsv2Enabled=False):
+        if self.pages:
+            return False
+        resolved = self.source.resolve() if self.source is not None else None
+        for _ in range(self.size):
+            self.addPage(MathJaxPage(self.source, physicsEnabled, colorsv2Enabled, resolved, parent=self))
+        return True
+
+    def identity(self):
+        return self.script
+
+    def render(self, tex, options, callback, output='svg'):
+        self.queue.append((self.texFor(tex, options), texPackages(options.physicsEnabled, options.colorsv2Enabled),
+                           callback, output))
+        self.createPages()
+        self.dispatch()
+
+    def renderMathML(self, tex, options, callback):
+        self.render(tex, options, callback, 'mml')
+
+    # Pages typeset the corpus whenever MathJax has (re)loaded in them, right away for those already up
+    def warmUp(self, equations, options):
+        self.warmUpCorpus = [self.texFor(tex, options) for tex in equations]
+        for page in self.pages:
+            page.warmUpCorpus = self.warmUpCorpus
+            page.warmUp()
+
+    def dispatch(self):
+        for page in self.pages:
+            if not self.queue:
+                return
+            if page.isIdle():
+                page.render(*self.queue.popleft())
+
+    def reload(self, source, physicsEnabled=False, colorsv2Enabled=False):
+        self.source = source
+        if self.createPages(physicsEnabled, colorsv2Enabled):
+            return
+        resolved = source.resolve()
+        self.script = resolved[0]
+        for page in self.pages:
+            page.loadMathJax(source, physicsEnabled, colorsv2Enabled, resolved)
+
+    def close(self):
+        self.queue.clear()
+        for page in self.pages:
+            page.deleteLater()
+
+
+# Node side of NodeRenderer: mathjax-full without a browser. Reads one JSON array of requests per line, answers one
+# JSON object per request and line. Documents are kept per package profile so TeX setup is paid once.
+nodeRenderScript = r"""
+const {mathjax} = require('mathjax-full/js/mathjax.js');
+const {TeX} = require('mathjax-full/js/input/tex.js');
+const {SVG} = require('mathjax-full/js/output/svg.js');
+const {liteAdaptor} = require('mathjax-full/js/adaptors/liteAdaptor.js');
+const {RegisterHTMLHandler} = require('mathjax-full/js/handlers/html.js');
+const {SerializedMmlVisitor} = require('mathjax-full/js/core/MmlTree/SerializedMmlVisitor.js');
+const {STATE} = require('mathjax-full/js/core/MathItem.js');
+const {AllPackages} = require('mathjax-full/js/input/tex/AllPackages.js');
+const readline = require('readline');
+
+const adaptor = liteAdaptor();
+RegisterHTMLHandler(adaptor);
+const documents = {};
+const mmlVisitor = new SerializedMmlVisitor();
+
+const profilePackages = %s;
+
+function documentFor(packages) {
+    // All of mathjax-full's packages, with the profile's choice of physics and color on top like the page's defaults.
+    // autoload and require need the browser component loader, everything is loaded up front here anyway
+    packages = AllPackages.filter(name => !profilePackages.includes(name))
+        .concat(packages.filter(name => AllPackages.includes(name)))
+        .filter((name, index, list) => list.indexOf(name) === index && name !== 'autoload' && name !== 'require');
+    const key = packages.join(',');
+    if (!documents[key]) {
+        documents[key] = mathjax.document('', {
+            InputJax: new TeX({packages: packages}),
+            OutputJax: new SVG({fontCache: 'local'})
+        });
+    }
+    return documents[key];
+}
+
+readline.createInterface({input: process.stdin}).on('line', line => {
+    const results = JSON.parse(line).map(request => {
+        try {
+            const document = documentFor(request.packages);
+            if (request.output === 'mml') {
+                const tree = document.convert(request.tex, {display: true, end: STATE.CONVERT});
+                return {id: request.id, mml: mmlVisitor.visitTree(tree)};
+            }
+            const node = document.convert(request.tex, {display: true});
+            return {id: request.id, svg: adaptor.innerHTML(node).replace(/currentColor/g, 'black')};
+        } catch (err) {
+            return {id: request.id, svg: '', error: String(err.message || err)};
+        }
+    });
+    process.stdout.write(results.map(result => JSON.stringify(result)).join('\n') + '\n');
+});
+""" % json.dumps(texProfilePackages)
+
+
+# mathjax-full in a persistent node process, talked to over stdin/stdout. Requests made in the same event loop turn
+# go out as one batch. mathjaxDir is the directory whose node_modules holds mathjax-full.
+class NodeRenderer(Renderer):
+    def __init__(self, mathjaxDir='.', nodePath='node', parent=None):
+        super(NodeRenderer, self).__init__(parent)
+        self.mathjaxDir = os.path.abspath(mathjaxDir)
+        self.warmedUp = False
+        self.requestId = 0
+        self.pending = {}
+        self.batch = []
+        self.buffer = b''
+        self.batchTimer = QTimer(self)
+        self.batchTimer.setSingleShot(True)
+        self.batchTimer.timeout.connect(self.flush)
+        self.process = QProcess(self)
+        environment = QProcessEnvironment.systemEnvironment()
+        environment.insert('NODE_PATH', os.path.join(self.mathjaxDir, 'node_modules'))
+        self.process.setProcessEnvironment(environment)
+        self.process.readyReadStandardOutput.connect(self.readResults)
+        self.process.readyReadStandardError.connect(
+            lambda: print(f'Node renderer: {bytes(self.process.readAllStandardError()).decode(errors="replace").strip()}'))
+        self.process.finished.connect(self.failPending)
+        self.process.start(nodePath, ['-e', nodeRenderScript])
+
+    def identity(self):
+        return f'node:{self.mathjaxDir}'
+
+    def render(self, tex, options, callback, output='svg'):
+        self.requestId += 1
+        self.pending[self.requestId] = callback
+        self.batch.append({'id': self.requestId, 'tex': self.texFor(tex, options), 'output': output,
+                           'packages': texPackages(options.physicsEnabled, options.colorsv2Enabled)})
+        if not self.batchTimer.isActive():
+            self.batchTimer.start(0)
+
+    def renderMathML(self, tex, options, callback):
+        self.render(tex, options, callback, 'mml')
+
+    # The node process lives as long as the renderer, warming it once is enough
+    def warmUp(self, equations, options):
+        if self.warmedUp:
+            return
+        self.warmedUp = True
+        for tex in equations:
+            self.render(tex, options, lambda svg, error: None)
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.process.state() == QProcess.NotRunning:
+            self.failPending()
+            return
+        self.process.write((json.dumps(self.batch) + '\n').encode())
+        self.batch = []
+
+    def readResults(self):
+        self.buffer += bytes(self.process.readAllStandardOutput())
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+                callback = self.pending.pop(result['id'])
+            except Exception as e:
+                print(f'Node renderer: bad response {e}')
+                continue
+            callback(result.get('svg') or result.get('mml', ''), result.get('error', ''))
+
+    def failPending(self, *args):
+        pending, self.pending, self.batch = self.pending, {}, []
+        for callback in pending.values():
+            callback('', 'node renderer is not running')
+
+    def close(self):
+        self.process.finished.disconnect(self.failPending)
+        self.process.kill()
+        self.process.waitForFinished(1000)
+
+
+def createRenderer(engine, source=None, size=1, nodeMathJaxDir='.', parent=None):
+    if engine == 'node':
+        return NodeRenderer(nodeMathJaxDir, parent=parent)
+    return WebEngineRenderer(size=size, source=source, parent=parent)
+
+
+# Display math blocks of a .tex/.md text, $$...$$ and \[...\], as (start, end, tex) in document order
+def extractTexBlocks(text):
+    blocks = scanEquationBlocks(text)
+    blocks += [(match.start(), match.end(), match.group(1)) for match in re.finditer(r'\\\[(.*?)\\\]', text, re.DOTALL)]
+    blocks.sort()
+    result = []
+    for block in blocks:
+        # \[ inside a $$ block or the other way around belongs to the outer one
+        if result and block[0] < result[-1][1]:
+            continue
+        result.append(block)
+    return result
+
+
+# Headless batch mode: render every display equation of a file (or stdin) to numbered SVGs plus a JSON manifest
+def runBatch(arguments):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication(sys.argv[:1])
+    if arguments.batch == '-':
+        text = sys.stdin.read()
+    else:
+        with open(arguments.batch, 'r', encoding='utf-8') as f:
+            text = f.read()
+    blocks = extractTexBlocks(text)
+    os.makedirs(arguments.output, exist_ok=True)
+    entries = [{'index': index + 1,
+                'tex': tex,
+                'line': text.count('\n', 0, start) + 1,
+                'start': start,
+                'end': end,
+                'file': None,
+                'error': None} for index, (start, end, tex) in enumerate(blocks)]
+
+    # Identical equations are rendered once and written for every occurrence
+    occurrences = OrderedDict()
+    for entry in entries:
+        occurrences.setdefault(entry['tex'].strip(), []).append(entry)
+    remaining = [len(occurrences)]
+    results = {}
+    optimizer = SvgOptimizer(arguments.precision, not arguments.no_optimize)
+    converter = OmmlConverter()
+    extension = 'xml' if arguments.format == 'omml' else 'svg'
+    started = time.perf_counter()
+
+    def rendered(tex, svg, error):
+        if svg and arguments.format == 'omml':
+            try:
+                results[tex] = converter.convert(svg, display=not arguments.no_display_style)
+            except Exception as e:
+                error = f'OMML conversion failed: {e}'
+        elif svg:
+            results[tex] = optimizer.optimize(svg)
+        if tex not in results:
+            for entry in occurrences[tex]:
+                entry['error'] = error
+        remaining[0] -= 1
+        print(f'Rendered {len(occurrences) - remaining[0]}/{len(occurrences)}', file=sys.stderr)
+        if remaining[0] == 0:
+            app.quit()
+
+    renderer = None
+    if occurrences:
+        renderer = createRenderer(arguments.engine, MathJaxSource.fromSavedValues(loadSavedValues()), arguments.jobs,
+                                  arguments.node_mathjax)
+        options = RenderOptions(not arguments.no_display_style, arguments.physics, arguments.colorsv2)
+        render = renderer.renderMathML if arguments.format == 'omml' else renderer.render
+        for tex in occurrences:
+            render(tex, options, lambda svg, error, tex=tex: rendered(tex, svg, error))
+        QTimer.singleShot(int(arguments.timeout * 1000), app.quit)
+        app.exec()
+
+    sprite = None
+    if arguments.sprite and results and arguments.format == 'svg':
+        sprite, svgs = optimizer.sprite(list(results.values()), 'glyphs.svg')
+        results = dict(zip(results, svgs))
+        with open(os.path.join(arguments.output, 'glyphs.svg'), 'w', encoding='utf-8') as f:
+            f.write(sprite)
+    for tex, svg in results.items():
+        for entry in occurrences[tex]:
+            entry['file'] = f'equation{entry["index"]:03d}.{extension}'
+            with open(os.path.join(arguments.output, entry['file']), 'w', encoding='utf-8') as f:
+                f.write(svg)
+    for entry in entries:
+        if entry['file'] is None and entry['error'] is None:
+            entry['error'] = 'timed out'
+    manifest = {'source': arguments.batch,
+                'options': {'displayStyle': not arguments.no_display_style, 'physics': arguments.physics,
+                            'colorsv2': arguments.colorsv2, 'engine': arguments.engine, 'format': arguments.format,
+                            'optimize': optimizer.identity(), 'sprite': 'glyphs.svg' if sprite else None},
+                'seconds': round(time.perf_counter() - started, 3),
+                'equations': entries}
+    with open(os.path.join(arguments.output, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    failed = sum(1 for entry in entries if entry['error'])
+    print(f'{len(entries) - failed}/{len(entries)} equations written to {arguments.output} '
+          f'in {manifest["seconds"]} s', file=sys.stderr)
+    if renderer is not None:
+        renderer.close()
+    return 1 if failed else 0
+
+
+# Render service: requests come in on the HTTP server's threads and are handed to the Qt thread, which owns the
+# renderer, as (tex, options, future) lists. Identical requests in flight share one render and results are kept in
+# an LRU RenderCache keyed like the window's renders.
+class RenderService(QObject):
+    requested = Signal(object)
+
+    def __init__(self, renderer, optimizer, cacheSize=1024, parent=None):
+        super(RenderService, self).__init__(parent)
+        self.renderer = renderer
+        self.optimizer = optimizer
+        self.cache = RenderCache(maxEntries=cacheSize)
+        self.pending = {}
+        self.stats = {'requests': 0, 'rendered': 0, 'cached': 0, 'deduplicated': 0, 'errors': 0}
+        self.statsLock = threading.Lock()
+        self.requested.connect(self.handle)
+
+    # Any thread, returns one Future per request resolving to {'svg', 'error', 'cached'}
+    def submit(self, requests):
+        items = [(tex, options, Future()) for tex, options in requests]
+        with self.statsLock:
+            self.stats['requests'] += len(items)
+        self.requested.emit(items)
+        return [future for _, _, future in items]
+
+    def snapshot(self):
+        with self.statsLock:
+            stats = dict(self.stats)
+        stats['pending'] = len(self.pending)
+        stats['cacheEntries'] = len(self.cache.entries)
+        return stats
+
+    def count(self, name):
+        with self.statsLock:
+            self.stats[name] += 1
+
+    def handle(self, items):
+        for tex, options, future in items:
+            key = RenderCache.key(tex, options.displayStyle, options.physicsEnabled, options.colorsv2Enabled,
+                                  f'{self.renderer.identity()}|{self.optimizer.identity()}')
+            svg = self.cache.get(key)
+            if svg is not None:
+                self.count('cached')
+                future.set_result({'svg': svg, 'error': None, 'cached': True})
+            elif key in self.pending:
+                self.count('deduplicated')
+                self.pending[key].append(future)
+            else:
+                self.pending[key] = [future]
+                self.renderer.render(tex, options, lambda svg, error, key=key: self.rendered(key, svg, error))
+
+    def rendered(self, key, svg, error):
+        if svg:
+            svg = self.optimizer.optimize(svg)
+            self.cache.put(key, svg)
+            self.count('rendered')
+        else:
+            self.count('errors')
+        for future in self.pending.pop(key, []):
+            future.set_result({'svg': svg or None, 'error': None if svg else (error or 'no result'), 'cached': False})
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MJ2G'
+    # Headers and body go out in separate writes, which Nagle would hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def reply(self, status, body, contentType='application/json'):
+        data = (json.dumps(body) if contentType == 'application/json' else body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def options(request):
+        return RenderOptions(bool(request.get('display', True)), bool(request.get('physics', False)),
+                             bool(request.get('colorsv2', False)))
+
+    def results(self, requests):
+        futures = self.server.service.submit([(request['tex'], self.options(request)) for request in requests])
+        deadline = time.perf_counter() + self.server.renderTimeout
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(max(0.0, deadline - time.perf_counter())))
+            except FutureTimeoutError:
+                results.append({'svg': None, 'error': 'timed out', 'cached': False})
+        return results
+
+    # GET /render?tex=...&display=0 answers the SVG itself, GET /stats the service counters
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.reply(200, self.server.service.snapshot())
+            return
+        if url.path != '/render':
+            self.reply(404, {'error': 'not found'})
+            return
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if 'tex' not in query:
+            self.reply(400, {'error': 'missing tex'})
+            return
+        request = {'tex': query['tex']}
+        for name in ('display', 'physics', 'colorsv2'):
+            if name in query:
+                request[name] = query[name] not in ('0', 'false', '')
+        result = self.results([request])[0]
+        if result['svg']:
+            self.reply(200, result['svg'], 'image/svg+xml')
+        else:
+            self.reply(504 if result['error'] == 'timed out' else 422, {'error': result['error']})
+
+    # POST /render with {"tex": ..., "display", "physics", "colorsv2"} answers {"svg", "error", "cached"}, with a
+    # list of those, or {"requests": [...]}, it answers {"results": [...]} in the same order
+    def do_POST(self):
+        if urlparse(self.path).path != '/render':
+            self.reply(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+            batch = isinstance(body, list) or (isinstance(body, dict) and 'requests' in body)
+            requests = (body if isinstance(body, list) else body['requests']) if batch else [body]
+            if not all(isinstance(request, dict) and isinstance(request.get('tex'), str) for request in requests):
+                raise ValueError('every request needs a tex string')
+        except Exception as e:
+            self.reply(400, {'error': f'bad request: {e}'})
+            return
+        results = self.results(requests)
+        if batch:
+            self.reply(200, {'results': results})
+        elif results[0]['svg']:
+            self.reply(200, results[0])
+        else:
+            self.reply(504 if results[0]['error'] == 'timed out' else 422, results[0])
+
+
+def runService(arguments):
+    import signal
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication(sys.argv[:1])
+    source = MathJaxSource.fromSavedValues(loadSavedValues())
+    renderer = createRenderer(arguments.engine, source, arguments.jobs, arguments.node_mathjax)
+    # Load MathJax and warm it up now rather than on the first request
+    renderer.reload(source)
+    renderer.warmUp(WarmUpCorpus().equations(), RenderOptions())
+    service = RenderService(renderer, SvgOptimizer(arguments.precision, not arguments.no_optimize),
+                            arguments.cache_size)
+    try:
+        server = ThreadingHTTPServer((arguments.host, arguments.serve), RenderRequestHandler)
+    except OSError as e:
+        print(f'Error starting render service: {e}', file=sys.stderr)
+        return 1
+    server.daemon_threads = True
+    server.service = service
+    server.renderTimeout = arguments.timeout
+    server.verbose = arguments.verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Rendering on http://{arguments.host}:{server.server_address[1]}/render, Ctrl+C to stop', file=sys.stderr)
+    # Let Python see Ctrl+C while Qt's loop runs
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    interrupts = QTimer()
+    interrupts.timeout.connect(lambda: None)
+    interrupts.start(200)
+    app.exec()
+    server.shutdown()
+    renderer.close()
+    return 0
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description=f'MathJax To Go - {ver}')
+    parser.add_argument('--batch', metavar='FILE', help='render the $$...$$ and \\[...\\] equations of FILE (- for stdin) '
+                                                        'to SVG files without opening the window')
+    parser.add_argument('-o', '--output', default='mj2g_svgs', help='output directory for --batch')
+    parser.add_argument('-j', '--jobs', type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help='MathJax pages rendering in parallel')
+    parser.add_argument('--format', choices=['svg', 'omml'], default='svg',
+                        help='write SVG pictures, or Word equations (OMML) as equationNNN.xml')
+    parser.add_argument('--precision', type=int, default=1,
+                        help='decimals kept in SVG coordinates, which are in thousandths of an em')
+    parser.add_argument('--no-optimize', action='store_true', help='write SVG exactly as MathJax produced it')
+    parser.add_argument('--sprite', action='store_true',
+                        help='move glyph shapes shared by all equations into glyphs.svg, referenced by each SVG')
+    parser.add_argument('--engine', choices=['webengine', 'node'], default='webengine',
+                        help='render with QtWebEngine pages or a node process running mathjax-full')
+    parser.add_argument('--node-mathjax', default='.', metavar='DIR',
+                        help='directory whose node_modules holds mathjax-full, for --engine node')
+    parser.add_argument('--physics', action='store_true', help='enable the physics package')
+    parser.add_argument('--colorsv2', action='store_true', help='use colorv2 instead of color')
+    parser.add_argument('--no-display-style', action='store_true', help='do not prefix equations with \\displaystyle')
+    parser.add_argument('--timeout', type=float, default=120, help='give up after this many seconds')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve TeX to SVG rendering over HTTP on PORT '
+                                                                  '(0 picks a free one) without opening the window')
+    parser.add_argument('--host', default='127.0.0.1', help='address --serve listens on')
+    parser.add_argument('--cache-size', type=int, default=1024, help='rendered equations --serve keeps in memory')
+    parser.add_argument('--verbose', action='store_true', help='log every --serve request')
+    return parser.parse_args(argv)
+
+
 class DraggableWidget(QWidget):
     def __init__(self, parent=None):
         super(DraggableWidget, self).__init__(parent)
@@ -36,14 +2382,108 @@ class DraggableWidget(QWidget):
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.moving = False
+
+# Rasterize MathJax SVG as it would look in pointSize text at dpi, on a transparent background
+def rasterizeSvg(svg, dpi, pointSize=12):
+    renderer = QSvgRenderer(QByteArray(svg.encode()))
+    if not renderer.isValid():
+        return QImage()
+    # MathJax SVG is laid out in thousandths of an em
+    size = renderer.viewBoxF().size() * (dpi * pointSize / 72 / 1000)
+    image = QImage(max(1, round(size.width())), max(1, round(size.height())), QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    renderer.render(painter)
+    painter.end()
+    return image
+
+
+# Shows rendered SVG without a browser. Ctrl+Scroll zooms, dragging moves the equation and a double click resets both.
+class SvgPreview(QWidget):
+    # MathJax SVG is laid out in thousandths of an em
+    emPixels = 24
+
+    def __init__(self, parent=None):
+        super(SvgPreview, self).__init__(parent)
+        self.renderer = QSvgRenderer(self)
+        self.zoom = 1.0
+        self.offset = None
+        self.pan = None
+        self.message = ''
+        self.resetView()
+        self.setMinimumSize(100, 50)
+
+    def setSvg(self, svg):
+        self.renderer.load(QByteArray(svg.encode()))
+        self.message = ''
+        self.update()
+
+    # Shown along the bottom edge over whatever SVG is loaded, until the next setSvg
+    def setMessage(self, message):
+        self.message = message
+        self.update()
+
+    def resetView(self):
+        self.zoom = 1.0
+        self.pan = self.rect().topLeft()
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('white'))
+        if self.renderer.isValid():
+            size = self.renderer.viewBoxF().size() * (self.emPixels * self.zoom / 1000)
+            # Centered, shrunk to fit if the equation is wider than the preview
+            fit = min(1.0, self.width() / size.width()) if size.width() else 1.0
+            size = size * fit
+            x = (self.width() - size.width()) / 2 + self.pan.x()
+            y = (self.height() - size.height()) / 2 + self.pan.y()
+            self.renderer.render(painter, QRectF(x, y, size.width(), size.height()))
+        if self.message:
+            painter.setPen(QColor('darkred'))
+            painter.drawText(self.rect().adjusted(4, 0, -4, -2), Qt.AlignBottom | Qt.AlignLeft | Qt.TextWordWrap,
+                             self.message)
+
+    def wheelEvent(self, event):
+        if event.modifiers() & Qt.ControlModifier:
+            self.zoom = min(10.0, max(0.2, self.zoom * (1.1 if event.angleDelta().y() > 0 else 1 / 1.1)))
+            self.update()
+        else:
+            event.ignore()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.offset = event.position().toPoint() - self.pan
+
+    def mouseMoveEvent(self, event):
+        if self.offset is not None:
+            self.pan = event.position().toPoint() - self.offset
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.offset = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.resetView()
+
+
 class MainWindow(QMainWindow):
-    update_equation_edit_signal = Signal(str)
     copy_svg_thread_safe_signal = Signal(str)
-    thread_safe_svg_paste_signal = Signal(str)
-    doneWidgetAutoShowSignal = Signal(bool)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.mathjaxStarted:
+            QTimer.singleShot(0, self.update_mathjax)
 
     def closeEvent(self, event):
-        self.doneWidget.close()
+        if self.warmUpCorpus is not None:
+            self.warmUpCorpus.save()
+        if self.comWorker is not None:
+            self.comWorker.stop()
+            self.comWorker.wait(2000)
+        if self.doneWidget is not None:
+            self.doneWidget.close()
         super().closeEvent(event)
 
     def infoDialog(self, message):
@@ -61,9 +2501,7 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
         self.setWindowTitle(f"MathJax To Go - {ver}")
-        self.update_equation_edit_signal.connect(self.update_equation_edit)
         self.clipboard = QApplication.clipboard()
-        self.doneWidgetAutoShowSignal.connect(self.toggleShow)
 
         # Properties and equation init
         self.svgData = ""
@@ -75,12 +2513,39 @@ class MainWindow(QMainWindow):
         self.equation_edit = QTextEdit()
         self.equation_edit.setPlaceholderText("Type Equation Here")
         self.equation_edit.setAcceptRichText(False)
-        self.customCDN = False
         self.wordHookStatus = False
-        self.replaceFlag = False
         self.copy_svg_thread_safe_signal.connect(self.copySvg)
-        self.thread_safe_svg_paste_signal.connect(self.experimentalSvgFileInsertion)
-        self.DoneMarker = False
+        self.comWorker = None
+        self.convertAllRunning = False
+
+        # Render cache, the disk tier is opt-in through !renderDiskCache:1 in the saved values
+        savedValues = loadSavedValues()
+        self.renderCache = RenderCache(
+            maxEntries=int(savedValues.get('renderCacheSize', 256)),
+            diskDir=os.path.join(cacheDir, 'svg') if savedValues.get('renderDiskCache') == '1' else None)
+        self.currentRenderKey = None
+        # Trace timestamps: first render request since the last dispatch, and the WordHook read of the equation
+        # currently on its way to the preview
+        self.renderRequestedAt = None
+        self.equationReadAt = None
+        # WordHook's view of each document: the equation it last showed and a render cache of its own, so switching
+        # back to a document shows its equation straight away even after another one churned the shared cache
+        self.documentSessions = OrderedDict()
+        self.documentName = None
+        self.documentCacheSize = int(savedValues.get('documentCacheSize', 64))
+        self.renderScheduler = RenderScheduler(debounceMs=int(savedValues.get('renderDebounceMs', 30)),
+                                               maxLatencyMs=int(savedValues.get('renderMaxLatencyMs', 150)),
+                                               parent=self)
+        self.renderScheduler.renderFinished.connect(self.renderFinished)
+
+        # Auto-copy publishes the last render only once renders stop arriving for clipboardCoalesceMs
+        self.clipboardPngDpi = int(savedValues.get('clipboardPngDpi', 0))
+        self.clipboardSvg = None
+        self.clipboardImage = (None, None)
+        self.clipboardTimer = QTimer(self)
+        self.clipboardTimer.setSingleShot(True)
+        self.clipboardTimer.setInterval(int(savedValues.get('clipboardCoalesceMs', 50)))
+        self.clipboardTimer.timeout.connect(lambda: self.publishClipboard(self.clipboardSvg))
 
         # Create layout
         self.layout = QVBoxLayout()
@@ -91,13 +2556,32 @@ class MainWindow(QMainWindow):
         self.interactiveWindowLayout.addLayout(self.optionInsertionLayout)
         self.optionLowerLayout = QHBoxLayout()
 
-        # Load webengine
-        self.mathjax_script = r'<script type="text/javascript" async src = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg-full.js"> </script>'
-        self.view = QWebEngineView()
-        self.load_mathjax()
-        self.view.loadFinished.connect(self.update_mathjax)
+        # One headless MathJax engine renders for both previews, which only display the finished SVG
+        self.mathjaxSource = MathJaxSource.fromSavedValues(savedValues)
+        self.renderEngine = savedValues.get('renderEngine', 'webengine')
+        # WordHook inserts pictures (svg) or native Word equations (omml)
+        self.wordOutput = savedValues.get('wordOutput', 'svg')
+        self.ommlConverter = OmmlConverter()
+        self.svgOptimizer = SvgOptimizer(precision=int(savedValues.get('svgPrecision', 1)),
+                                         enabled=savedValues.get('svgOptimize', '1') == '1')
+        # Incomplete TeX keeps the last good render on screen instead of going to MathJax
+        self.texValidator = TexValidator() if savedValues.get('texValidate', '1') == '1' else None
+        self.renderer = createRenderer(self.renderEngine, nodeMathJaxDir=savedValues.get('nodeMathJaxDir', '.'),
+                                       parent=self)
+        # Typeset by MathJax as soon as it has loaded, so the first equation renders at full speed
+        self.warmUpCorpus = WarmUpCorpus(os.path.join(cacheDir, 'warmup.json'),
+                                         maxRecent=int(savedValues.get('warmUpRecent', 0))) \
+            if savedValues.get('mathjaxWarmUp', '1') == '1' else None
+        self.view = SvgPreview()
+        # MathJax, and with it the WebEngine profile, starts once the window has painted or something wants a render
+        self.mathjaxStarted = False
         self.interactiveWindowLayout.addWidget(self.view)
 
+        # WordHook widgets, see createWordHookWidgets
+        self.doneWidget = None
+        self.smallView = None
+        self.doneWidgetAutoShow = False
+
         # Wordhook Preliminaries
         try:
             if win32comsupport:
@@ -109,126 +2593,21 @@ class MainWindow(QMainWindow):
                 self.wordHookButton.clicked.connect(self.wordHook)
                 self.wordHookPlaceButton = QPushButton("Done")
                 self.wordHookPlaceButton.setStyleSheet("background-color: #222288")
-                self.wordHookPlaceButton.clicked.connect(lambda: setattr(self, 'replaceFlag', True))
+                self.wordHookPlaceButton.clicked.connect(self.requestReplace)
                 self.topLayout.addWidget(self.wordHookPlaceButton)
                 self.wordHookPlaceButton.hide()
                 self.topLayout.addWidget(self.wordHookButton)
-                self.doneWidget = DraggableWidget()
-                self.doneWidget.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
-                screen = QGuiApplication.primaryScreen().geometry()
-                x = 0
-                y = (screen.height() / 2) - 150
-                self.doneWidget.move(x, y)
-                self.doneWidgetButton = QPushButton("Done", self.doneWidget)
-                self.doneWidgetButton.setStyleSheet("background-color: #222288")
-                self.doneWidgetButton.clicked.connect(lambda: setattr(self, 'replaceFlag', True))
-                self.doneWidgetCloseButton = QPushButton("Close", self.doneWidget)
-                self.doneWidgetCloseButton.setStyleSheet("background-color: darkred")
-                self.doneWidgetCloseButton.clicked.connect(self.stop_word_hook)
-                self.doneWidgetControlHelpButton = QPushButton("ⓘ Help") # ⓘ
-                self.doneWidgetControlHelpButton.setStyleSheet("background-color: darkgreen")
-                self.doneWidgetControlHelpButton.clicked.connect(lambda: self.infoDialog("- Click and drag in any empty space to move the widget."
-                                                                                         "\n- You can use Ctrl+Scroll to zoom in/out in the SVG view."
-                                                                                         "\n- Click the Done button to replace the typed equation with the rendered SVG."
-                                                                                         "\n - You can also type \\done anywhere within the equation to trigger the replacement."
-                                                                                         "\n- Click the Close button to exit WordHook"
-                                                                                         "\n- Use the provided window size controls to adjust the view to your preference."
-                                                                                         "\n- Click the Set Default button to save the current window size and position as default."
-                                                                                         "\n- This way, WordHook will always start at the same position and size you saved."))
-                self.smallView = QWebEngineView()
-                def smallViewSizeChange(dir, val):
-                    if dir == 'x':
-                        self.smallView.setFixedSize(self.smallView.width() + val, self.smallView.height())
-                        self.doneWidget.setFixedSize(self.doneWidget.width() + val, self.doneWidget.height())
-                    elif dir == 'y':
-                        self.smallView.setFixedSize(self.smallView.width(), self.smallView.height() + val)
-                        self.doneWidget.setFixedSize(self.doneWidget.width(), self.doneWidget.height() + val)
-                self.doneWidgetSizeUpButton = QPushButton("⇧", self.doneWidget)
-                self.doneWidgetSizeUpButton.setStyleSheet("background-color: darkgray")
-                self.doneWidgetSizeUpButton.setMaximumWidth(40)
-                self.doneWidgetSizeUpButton.clicked.connect(lambda: smallViewSizeChange('y', -20))
-                self.doneWidgetSizeDownButton = QPushButton("⇩", self.doneWidget)
-                self.doneWidgetSizeDownButton.setStyleSheet("background-color: darkgray")
-                self.doneWidgetSizeDownButton.setMaximumWidth(40)
-                self.doneWidgetSizeDownButton.clicked.connect(lambda: smallViewSizeChange('y', 20))
-                self.doneWidgetSizeLeftButton = QPushButton("⇦", self.doneWidget)
-                self.doneWidgetSizeLeftButton.setStyleSheet("background-color: darkgray")
-                self.doneWidgetSizeLeftButton.setMaximumWidth(40)
-                self.doneWidgetSizeLeftButton.clicked.connect(lambda: smallViewSizeChange('x', -20))
-                self.doneWidgetSizeRightButton = QPushButton("⇨", self.doneWidget)
-                self.doneWidgetSizeRightButton.setStyleSheet("background-color: darkgray")
-                self.doneWidgetSizeRightButton.setMaximumWidth(40)
-                self.doneWidgetSizeRightButton.clicked.connect(lambda: smallViewSizeChange('x', 20))
-                self.doneWidgetSizeLabel = QLabel("Click and drag here to move view")
-                def doneWidgetSetDefault():
-                    with open('./MJ2GSavedValues.ini', 'w') as f:
-                        f.write(f'!doneWidgetWidth:{self.doneWidget.width()}')
-                        f.write(f'\n!doneWidgetHeight:{self.doneWidget.height()}')
-                        f.write(f'\n!doneWidgetX:{self.doneWidget.x()}')
-                        f.write(f'\n!doneWidgetY:{self.doneWidget.y()}')
-                try:
-                    with open('./MJ2GSavedValues.ini', 'r') as f:
-                        for line in f:
-                            if line.startswith('!doneWidgetWidth:'):
-                                self.doneWidget.setFixedWidth(int(line.split(':')[1]))
-                            elif line.startswith('!doneWidgetHeight:'):
-                                self.doneWidget.setFixedHeight(int(line.split(':')[1]))
-                            elif line.startswith('!doneWidgetX:'):
-                                self.doneWidget.move(int(line.split(':')[1]), self.doneWidget.y())
-                            elif line.startswith('!doneWidgetY:'):
-                                self.doneWidget.move(self.doneWidget.x(), int(line.split(':')[1]))
-                except FileNotFoundError:
-                    pass
-                except Exception as e:
-                    print(f'Error loading saved values: {e}')
-                self.doneWidgetSetDefaultButton = QPushButton("Set Default", self.doneWidget)
-                self.doneWidgetSetDefaultButton.setStyleSheet("background-color: #222288")
-                self.doneWidgetSetDefaultButton.clicked.connect(doneWidgetSetDefault)
-                def toggleWidgetAutoShow():
-                    self.doneWidgetAutoShow = not self.doneWidgetAutoShow
-                    if self.doneWidgetAutoShow:
-                        self.doneWidget.setWindowOpacity(0)
-                    self.doneWidgetAutoShowButton.setStyleSheet("background-color: darkgreen" if self.doneWidgetAutoShow else "background-color: darkred")
-                self.doneWidgetAutoShowButton = QPushButton("Auto-Show", self.doneWidget)
-                self.doneWidgetAutoShowButton.setStyleSheet("background-color: darkred")
-                self.doneWidgetAutoShow = False
-                self.doneWidgetAutoShowButton.clicked.connect(toggleWidgetAutoShow)
-                doneWidgetLayout = QHBoxLayout()
-                doneWidgetViewPortLayout = QVBoxLayout()
-                doneWidgetViewPortLayout.addStretch()
-                doneWidgetViewPortLayout.addWidget(self.doneWidgetButton)
-                doneWidgetViewPortLayout.addWidget(self.smallView)
-                doneWidgetViewPortLayout.addWidget(self.doneWidgetControlHelpButton)
-                doneWidgetViewPortLayout.addStretch()
-                doneWidgetHorizontalControlLayout = QHBoxLayout()
-                doneWidgetHorizontalControlLayout.addWidget(self.doneWidgetSizeLeftButton)
-                doneWidgetHorizontalControlLayout.addWidget(self.doneWidgetSizeRightButton)
-                doneWidgetHorizontalControlLayout.addStretch()
-                doneWidgetControlLayout = QVBoxLayout()
-                doneWidgetControlLayout.addWidget(self.doneWidgetCloseButton)
-                doneWidgetUpButtonPadLayout = QHBoxLayout()
-                doneWidgetUpButtonPadLayout.addStretch()
-                doneWidgetUpButtonPadLayout.addWidget(self.doneWidgetSizeUpButton)
-                doneWidgetUpButtonPadLayout.addStretch()
-                doneWidgetDownButtonPadLayout = QHBoxLayout()
-                doneWidgetDownButtonPadLayout.addStretch()
-                doneWidgetDownButtonPadLayout.addWidget(self.doneWidgetSizeDownButton)
-                doneWidgetDownButtonPadLayout.addStretch()
-                doneWidgetControlLayout.addLayout(doneWidgetUpButtonPadLayout)
-                doneWidgetControlLayout.addLayout(doneWidgetHorizontalControlLayout)
-                doneWidgetControlLayout.addLayout(doneWidgetDownButtonPadLayout)
-                doneWidgetControlLayout.addWidget(self.doneWidgetSetDefaultButton)
-                doneWidgetControlLayout.addWidget(self.doneWidgetAutoShowButton)
-                doneWidgetControlLayout.addStretch()
-                doneWidgetLayout.addLayout(doneWidgetControlLayout)
-                doneWidgetLayout.addLayout(doneWidgetViewPortLayout)
-                self.doneWidget.setLayout(doneWidgetLayout)
-
+                self.wordOutputButton = QPushButton()
+                self.wordOutputButton.setToolTip('What WordHook and Convert All put in the document: SVG pictures, or '
+                                                 'native Word equations that stay editable in Word')
+                self.wordOutputButton.clicked.connect(self.toggleWordOutput)
+                self.updateWordOutputButton()
+                self.topLayout.addWidget(self.wordOutputButton)
         except Exception as err:
             print(f'Win32com has failed or is not supported: {err} \nWordHook disabled.')
 
         # Controls label
-        self.controlsLabel = QLabel("ⓘ WebEngine: Click and drag to pan, control-scroll to zoom")
+        self.controlsLabel = QLabel("ⓘ Preview: Drag to move, Ctrl+Scroll to zoom, double-click to reset")
         self.topLayout.addStretch()
         self.topLayout.addWidget(self.controlsLabel)
 
@@ -284,10 +2663,11 @@ class MainWindow(QMainWindow):
         self.alwaysOnTopButton.clicked.connect(self.toggleAlwaysOnTop)
         self.optionInsertionLayout.addWidget(self.alwaysOnTopButton)
 
-        # Add option to switch CDN
-        self.cdnButton = QPushButton("Switch CDN")
-        self.cdnButton.setStyleSheet("background-color: #222288")
-        self.cdnButton.clicked.connect(self.switchCDN)
+        # Add option to switch where MathJax is loaded from
+        self.cdnButton = QPushButton("MathJax Source")
+        self.cdnButton.setToolTip(self.mathjaxSource.describe())
+        self.cdnButton.setStyleSheet("background-color: #222288" if self.mathjaxSource.kind == 'cached' else "background-color: darkred")
+        self.cdnButton.clicked.connect(self.switchMathJaxSource)
         self.optionInsertionLayout.addWidget(self.cdnButton)
 
         # Display style toggle
@@ -379,13 +2759,32 @@ class MainWindow(QMainWindow):
         central_widget = QWidget()
         central_widget.setLayout(self.layout)
         self.setCentralWidget(central_widget)
-        self.update_mathjax()
+        # The placeholder is rendered after the first paint, see paintEvent
         self.equation_edit.textChanged.connect(self.update_mathjax)
     def toggleDisplayStyle(self):
         self.displayStyle = not self.displayStyle
         self.displayStyleButton.setStyleSheet("background-color: darkgreen" if self.displayStyle else "background-color: darkred")
         self.update_mathjax()
 
+    def toggleStatsOverlay(self):
+        shown = not self.doneWidgetStatsLabel.isVisible()
+        self.doneWidgetStatsLabel.setText(tracer.summary() or 'No spans yet')
+        self.doneWidgetStatsLabel.setVisible(shown)
+        if shown:
+            self.doneWidgetStatsTimer.start()
+        else:
+            self.doneWidgetStatsTimer.stop()
+        self.doneWidgetStatsButton.setStyleSheet("background-color: darkgreen" if shown else "background-color: darkred")
+
+    def toggleWordOutput(self):
+        self.wordOutput = 'svg' if self.wordOutput == 'omml' else 'omml'
+        saveValues({'wordOutput': self.wordOutput})
+        self.updateWordOutputButton()
+
+    def updateWordOutputButton(self):
+        self.wordOutputButton.setText("Word: Equation" if self.wordOutput == 'omml' else "Word: SVG")
+        self.wordOutputButton.setStyleSheet("background-color: #222288" if self.wordOutput == 'omml' else "background-color: darkgreen")
+
     def toggleAlwaysOnTop(self):
         wasMaximized = self.isMaximized()
         if self.windowFlags() & Qt.WindowStaysOnTopHint:
@@ -398,97 +2797,143 @@ class MainWindow(QMainWindow):
         if wasMaximized:
             self.showMaximized()
 
-    def switchCDN(self):
-        default = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg-full.js"
-        if not self.customCDN:
-            cdn, confirm = QInputDialog.getText(self, "Switch CDN", "Enter CDN URL:", text=default)
-            if confirm:
-                self.customCDN = True
-                self.mathjax_script = f'<script type="text/javascript" async src = "{cdn}"> </script>'
-                self.cdnButton.setText("Reset CDN")
-                self.load_mathjax()
-        else:
-            self.customCDN = False
-            self.mathjax_script = f'<script type="text/javascript" async src = "{default}"> </script>'
-            self.cdnButton.setText("Switch CDN")
-            self.load_mathjax()
-        self.cdnButton.setStyleSheet("background-color: darkred" if self.customCDN else "background-color: #222288")
+    def switchMathJaxSource(self):
+        sources = ['Cached copy (offline)', 'Local directory', 'CDN']
+        kinds = ['cached', 'local', 'cdn']
+        choice, confirm = QInputDialog.getItem(self, "MathJax Source", "Load MathJax from:", sources,
+                                               kinds.index(self.mathjaxSource.kind), False)
+        if not confirm:
+            return
+        kind = kinds[sources.index(choice)]
+        location = None
+        if kind == 'local':
+            location = QFileDialog.getExistingDirectory(self, 'MathJax es5 directory (containing tex-svg-full.js)')
+            if not location:
+                return
+            if not os.path.isfile(os.path.join(location, MathJaxSource.bundle)):
+                self.infoDialog(f"{MathJaxSource.bundle} was not found in that directory.")
+                return
+        elif kind == 'cdn':
+            default = self.mathjaxSource.location if self.mathjaxSource.kind == 'cdn' and self.mathjaxSource.location \
+                else MathJaxSource.cdnUrl + MathJaxSource.bundle
+            location, confirm = QInputDialog.getText(self, "Switch CDN", "Enter CDN URL:", text=default)
+            if not confirm:
+                return
+        self.mathjaxSource = MathJaxSource(kind, location)
+        self.mathjaxSource.save()
+        self.cdnButton.setToolTip(self.mathjaxSource.describe())
+        self.cdnButton.setStyleSheet("background-color: #222288" if kind == 'cached' else "background-color: darkred")
+        self.load_mathjax()
 
 
     def togglePhysics(self):
         self.physicsEnabled = not self.physicsEnabled
         self.usePhysicsButton.setStyleSheet(
             "background-color: darkgreen" if self.physicsEnabled else "background-color: darkred")
-        self.load_mathjax()
+        self.applyTexProfile()
 
     def toggleColorsv2(self):
         self.colorsv2Enabled = not self.colorsv2Enabled
         self.useColorsv2Button.setStyleSheet(
             "background-color: darkgreen" if self.colorsv2Enabled else "background-color: darkred")
-        self.load_mathjax()
+        self.applyTexProfile()
+
+    # Renders carry the packages they need and the page switches in place, so this just re-typesets, no page reload
+    def applyTexProfile(self):
+        self.update_mathjax()
+
+    # Hand the SVG of the equation being edited to callback. It comes from the render cache, or is rendered in turn
+    # with the other jobs of the view, never by serializing the whole page.
+    def withSvg(self, callback):
+        plainTextEquation = self.withPlaceholder(self.equation_edit.toPlainText())
+        started = time.perf_counter()
 
-    def getSvg(self, callback):
-        if self.wordHookStatus:
-            self.smallView.page().toHtml(callback)
+        def finished(svg):
+            tracer.since('svg.get', started)
+            if not svg:
+                print('Error getting SVG: equation did not render')
+                return
+            self.svgData = svg
+            callback(svg)
+
+        self.renderScheduler.submit(self.renderTarget(),
+                                    lambda done: self.renderSvg(self.renderTarget(), plainTextEquation, done, display=False),
+                                    finished)
+
+    # Position -1 means at the cursor, documentName '' the active document
+    def insertEquation(self, equation, position=-1, documentName=''):
+        self.recordEquation(equation)
+        if self.wordOutput == 'omml':
+            self.ommlInsertion(equation, position, documentName)
         else:
-            self.view.page().toHtml(callback)
-    def extractSvgFromHTML(self, html):
-        start = html.find('<svg')
-        end = html.rfind('</svg>')
-        self.svgData = html[start:end + 6].replace('currentColor', 'black')
-
-    def experimentalSvgFileInsertion(self):
-        def callback(html):
-            pythoncom.CoInitialize()
-            temp_file_path = None
-            try:
-                self.extractSvgFromHTML(html)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".svg") as exptemp:
-                    exptemp.write(self.svgData.encode())
-                    temp_file_path = os.path.abspath(exptemp.name)
-            except Exception as e:
-                print(f'Error copying SVG data: {e}')
-            if temp_file_path:
-                word = win32.gencache.EnsureDispatch('Word.Application')
-                try:
-                    word.ActiveDocument.InlineShapes.AddPicture(temp_file_path)
-                    time.sleep(1)
-                except Exception as e:
-                    print(f'Error inserting SVG file: {e}')
-            os.unlink(temp_file_path)
-            pythoncom.CoUninitialize()
-        self.getSvg(callback)
+            self.experimentalSvgFileInsertion(equation, position, documentName)
 
+    def ommlInsertion(self, equation, position=-1, documentName=''):
+        started = time.perf_counter()
 
+        def callback(omml):
+            tracer.since('insert.render', started, output='omml')
+            if not omml:
+                print('Error inserting equation: equation did not render')
+                return
+            if self.comWorker is None:
+                print('Error inserting equation: not hooked to MS Word')
+                return
+            self.comWorker.insertOmml(omml, None if position < 0 else position, documentName or None)
+        self.renderScheduler.submit(self.renderTarget(), lambda done: self.renderOmml(equation, done), callback)
 
+    def experimentalSvgFileInsertion(self, equation, position=-1, documentName=''):
+        started = time.perf_counter()
 
-    def copySvg(self):
-        def callback(html):
-            try:
-                self.extractSvgFromHTML(html)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".svg") as temp:
-                    temp.write(self.svgData.encode())
-                    temp_file_path = temp.name
-                pyperclip.copy(temp_file_path)
-                with open(temp_file_path, 'r') as f:
-                    mimedata = QMimeData()
-                    mimedata.setData('image/svg+xml', QByteArray(f.read().encode()))
-                    self.clipboard.setMimeData(mimedata)
-                threading.Timer(1, os.remove, args=[temp_file_path]).start()
-            except Exception as e:
-                print(f'Error copying SVG data: {e}')
+        def callback(svg):
+            tracer.since('insert.render', started, output='svg')
+            if not svg:
+                print('Error inserting SVG file: equation did not render')
+                return
+            if self.comWorker is None:
+                print('Error inserting SVG file: not hooked to MS Word')
+                return
+            self.comWorker.insertSvg(svg, None if position < 0 else position, documentName or None,
+                                     self.describeEquation(equation))
+        # Queued behind whatever is rendering so the inserted SVG is the one for this exact equation
+        self.renderScheduler.submit(self.renderTarget(),
+                                    lambda done: self.renderSvg(self.renderTarget(), equation, done, display=False),
+                                    callback)
 
-        self.getSvg(callback)
+    def copySvg(self):
+        self.recordEquation(self.equation_edit.toPlainText())
+        self.withSvg(self.publishClipboard)
+
+    # Equations the user finished with, warmed up first on the next launch
+    def recordEquation(self, equation):
+        if self.warmUpCorpus is not None:
+            self.warmUpCorpus.record(equation)
+
+    # SVG in memory, plus a PNG when clipboardPngDpi is set, for apps that do not paste SVG
+    def publishClipboard(self, svg):
+        if not svg:
+            return
+        try:
+            mimedata = QMimeData()
+            mimedata.setData('image/svg+xml', QByteArray(svg.encode()))
+            if self.clipboardPngDpi > 0:
+                # Rasterized once per SVG, copying the same equation again reuses it
+                if self.clipboardImage[0] != svg:
+                    self.clipboardImage = (svg, rasterizeSvg(svg, self.clipboardPngDpi))
+                if not self.clipboardImage[1].isNull():
+                    mimedata.setImageData(self.clipboardImage[1])
+            self.clipboard.setMimeData(mimedata)
+        except Exception as e:
+            print(f'Error copying SVG data: {e}')
 
     def saveSvg(self):
-        def callback(html):
-            self.extractSvgFromHTML(html)
+        def callback(svg):
             # File dialog
             savefile, _ = QFileDialog.getSaveFileName(self, 'Save SVG', '', 'SVG files (*.svg)')
             if savefile and not len(self.equation)==0:
                 with open(savefile, 'w') as f:
                     f.write(self.svgData)
-        self.getSvg(callback)
+        self.withSvg(callback)
 
     def toggleAutoCopy(self):
         self.autoCopy = not self.autoCopy
@@ -510,139 +2955,344 @@ class MainWindow(QMainWindow):
     # The idea is to load the script then for every text change update the math content, schedule mathjax render and
     # render/extract (copy if enabled) svg.
     def load_mathjax(self):
-        base_packages = ['base', 'ams', 'bbox', 'boldsymbol', 'braket', 'cancel', 'color', 'enclose', 'extpfeil',
-                         'html', 'mhchem', 'newcommand', 'noerrors', 'unicode', 'verb', 'autoload', 'require',
-                         'configmacros', 'tagformat', 'action', 'bbox', 'boldsymbol', 'colorv2', 'enclose', 'extpfeil',
-                         'html', 'mhchem', 'newcommand', 'noerrors', 'unicode', 'verb', 'autoload', 'require',
-                         'configmacros', 'tagformat', 'action']
-
-        if self.physicsEnabled:
-            base_packages.append('physics')
-        else:
-            try:
-                base_packages.remove('physics')
-            except ValueError:
-                pass
-
-        # Convert the list of packages to a string
-        packages_str = ', '.join(f"'{pkg}'" for pkg in base_packages)
-
-        # Define the loader packages
-        loader_packages = ['[tex]/physics'] if self.physicsEnabled else ['[tex]/autoload']
-        loader_packages_str = ', '.join(f"'{pkg}'" for pkg in loader_packages)
-
-        html = """
-        <!DOCTYPE html>
-        <html>
-        <style>
-        body {{
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                height: 100vh;
-                margin: 0;
-                background-color: darkgray;
-                overflow: auto;
-            }}
-        </style>
-        <head>
-            <script type="text/x-mathjax-config">
-                MathJax = {{
-                    loader: {{
-                        load: [{loader_packages}]
-                    }},
-                    svg: {{
-                        scale: 1,
-                        minScale: .1,
-                        fontCache: 'global',
-                        stroke: 'black',
-                    }},
-                    tex: {{
-                        displayMath: [['$$','$$']],
-                        packages: {{'[+]': [{packages}]}}
-                    }}
-                }};
-            </script>
-            {mathjax_script}
-        </head>
-        <body>
-            <p id="math-content">
-            </p>
-            <script>
-                var svg;
-                var isDragging = false;
-                var previousMousePosition;
-
-                document.addEventListener('mousedown', function(event) {{
-                    svg = document.querySelector('svg');
-                    if (svg) {{
-                        isDragging = true;
-                        previousMousePosition = {{ x: event.clientX, y: event.clientY }};
-                    }}
-                }});
-
-                document.addEventListener('mousemove', function(event) {{
-                    if (isDragging && svg) {{
-                        var dx = event.clientX - previousMousePosition.x;
-                        var dy = event.clientY - previousMousePosition.y;
-                        var transform = svg.getAttribute('transform') || '';
-                        transform += ' translate(' + dx + ' ' + dy + ')';
-                        svg.setAttribute('transform', transform);
-                        previousMousePosition = {{ x: event.clientX, y: event.clientY }};
-                    }}
-                }});
-                document.addEventListener('mouseup', function(event) {{
-                    isDragging = false;
-                }});
-            </script>
-        </body>
-        </html>
-        """.format(packages=packages_str, loader_packages=loader_packages_str, mathjax_script=self.mathjax_script)
-
+        self.mathjaxStarted = True
+        self.renderer.reload(self.mathjaxSource, self.physicsEnabled, self.colorsv2Enabled)
+        # After the reload, so pages warm up once their new MathJax is in
+        if self.warmUpCorpus is not None:
+            self.renderer.warmUp(self.warmUpCorpus.equations(self.physicsEnabled), self.renderOptions())
+        # Queued by the renderer until MathJax is up
         self.update_mathjax()
 
-        self.view.setHtml(html)
+    def renderTarget(self):
+        return 'smallView' if self.wordHookStatus else 'view'
+
+    def renderOptions(self):
+        return RenderOptions(self.displayStyle, self.physicsEnabled, self.colorsv2Enabled)
+
+    def withPlaceholder(self, plainTextEquation):
+        if not plainTextEquation and not self.wordHookStatus:
+            return r"\Large \text{you gonna type something or what?}"
+        return plainTextEquation
+
+    def renderKey(self, plainTextEquation):
+        return RenderCache.key(plainTextEquation, self.displayStyle, self.physicsEnabled, self.colorsv2Enabled,
+                               f'{self.renderer.identity()}|{self.svgOptimizer.identity()}')
+
+    def showSvg(self, target, svg):
+        (self.smallView if target == 'smallView' else self.view).setSvg(svg)
+
+    # Render one equation for target and call done(svg), '' if it could not be rendered.
+    # With display the SVG is also shown in the target's view.
+    def renderSvg(self, target, plainTextEquation, done, display=True):
+        renderKey = self.renderKey(plainTextEquation)
+        documentCache = self.documentSessions[self.documentName]['cache'] \
+            if target == 'smallView' and self.documentName in self.documentSessions else None
+        cachedSvg = documentCache.get(renderKey) if documentCache is not None else None
+        if cachedSvg is None:
+            cachedSvg = self.renderCache.get(renderKey)
+            if cachedSvg is not None and documentCache is not None:
+                documentCache.put(renderKey, cachedSvg)
+        if cachedSvg is not None:
+            # Cache hit, skip rendering and just show the SVG
+            if display:
+                self.showSvg(target, cachedSvg)
+            done(cachedSvg)
+            return
+
+        started = time.perf_counter()
+
+        def rendered(svg, error):
+            tracer.since('render.mathjax', started)
+            # MathJax not loaded yet or still autoloading an extension, nothing worth caching
+            if not svg:
+                done('')
+                return
+            svg = self.svgOptimizer.optimize(svg)
+            self.renderCache.put(renderKey, svg)
+            if documentCache is not None:
+                documentCache.put(renderKey, svg)
+            if display:
+                self.showSvg(target, svg)
+            done(svg)
+
+        self.renderer.render(plainTextEquation, self.renderOptions(), rendered)
+
+    # MathML from MathJax converted to OMML, done('') if either step fails. Cached next to the SVG renders.
+    def renderOmml(self, plainTextEquation, done):
+        renderKey = RenderCache.key(plainTextEquation, self.displayStyle, self.physicsEnabled, self.colorsv2Enabled,
+                                    f'{self.renderer.identity()}|omml')
+        cachedOmml = self.renderCache.get(renderKey)
+        if cachedOmml is not None:
+            done(cachedOmml)
+            return
+
+        started = time.perf_counter()
+
+        def rendered(mathml, error):
+            tracer.since('render.mathml', started)
+            if not mathml:
+                done('')
+                return
+            try:
+                # Inline, Word shows an equation alone in its paragraph as display math by itself
+                with tracer.span('render.omml'):
+                    omml = self.ommlConverter.convert(mathml, display=False)
+            except Exception as e:
+                print(f'Error converting to OMML: {e}')
+                done('')
+                return
+            self.renderCache.put(renderKey, omml)
+            done(omml)
 
-        if self.wordHookStatus:
-            self.smallView.setHtml(html)
+        self.renderer.renderMathML(plainTextEquation, self.renderOptions(), rendered)
 
     def update_mathjax(self):
-        plainTextEquation = self.equation_edit.toPlainText()
-
-        def formatted(plainTxtEq):
-            if not plainTxtEq:
-                if not self.wordHookStatus:
-                    plainTxtEq = r"\Large \text{you gonna type something or what?}"
-                else:
-                    plainTxtEq = (r"")
-            return plainTxtEq.replace("\\", "\\\\").replace("\n","\\n").replace("'", "\\'")
-
-        physicsPreamble = formatted(r"\require{physics} ") if self.physicsEnabled else r""
-
-        displayStylePreamble = formatted(r"\displaystyle ") if self.displayStyle else r""
-
-        self.equation = f"{displayStylePreamble}{physicsPreamble}{formatted(plainTextEquation)}"
-
-        script = r"""
-        var element = document.getElementById('math-content');
-        var svg = MathJax.tex2svg('{}').outerHTML;
-        element.innerHTML = svg;
-        """.format(self.equation)
-
-        if self.autoCopy:
-            self.copySvg()
-
-        if self.wordHookStatus:
-            self.smallView.page().runJavaScript(script)
+        if not self.mathjaxStarted:
+            self.load_mathjax()
+            return
+        if self.renderRequestedAt is None:
+            self.renderRequestedAt = time.perf_counter()
+        self.renderScheduler.request(self.renderTarget(), self.render_mathjax)
+
+    # Runs when the scheduler dispatches, so it always picks up the latest text
+    def render_mathjax(self, done):
+        # Time spent debouncing and queued behind other renders
+        if self.renderRequestedAt is not None:
+            tracer.since('render.wait', self.renderRequestedAt)
+            self.renderRequestedAt = None
+        plainTextEquation = self.withPlaceholder(self.equation_edit.toPlainText())
+        if self.texValidator is not None:
+            with tracer.span('render.validate'):
+                error = self.texValidator.validate(plainTextEquation)
+            if error is not None:
+                self.currentRenderKey = None
+                target = self.renderTarget()
+                (self.smallView if target == 'smallView' else self.view).setMessage(
+                    f'{error.message} ({TexValidator.location(plainTextEquation, error.position)})')
+                done('')
+                return
+        renderKey = self.renderKey(plainTextEquation)
+        self.currentRenderKey = renderKey
+        self.equation = Renderer.texFor(plainTextEquation, self.renderOptions())
+
+        def finished(svg):
+            if svg and renderKey == self.currentRenderKey:
+                self.svgData = svg
+            done(svg)
+
+        self.renderSvg(self.renderTarget(), plainTextEquation, finished)
+
+    def renderFinished(self, target, svg):
+        # Keystroke in Word to preview, from the read that picked up the change
+        if target == 'smallView' and self.equationReadAt is not None and self.renderScheduler.isIdle(target):
+            tracer.since('wordhook.preview', self.equationReadAt)
+            self.equationReadAt = None
+        # Only act once the view has settled so auto-copy gets the final equation and not an intermediate one
+        if svg and self.autoCopy and self.renderScheduler.isIdle(target):
+            self.clipboardSvg = svg
+            self.clipboardTimer.start()
 
-        else:
-            self.view.page().runJavaScript(script)
     def update_equation_edit(self, text):
         self.equation_edit.setText(text)
+
+    # Focus moved to another document, show the equation it had
+    def switchDocument(self, documentName):
+        session = self.documentSessions.pop(documentName, None) or \
+            {'equation': '', 'cache': RenderCache(maxEntries=self.documentCacheSize)}
+        self.documentSessions[documentName] = session
+        while len(self.documentSessions) > WordComWorker.maxSessions:
+            self.documentSessions.popitem(last=False)
+        self.documentName = documentName
+        self.update_equation_edit(session['equation'])
+
+    # Everything WordComWorker has posted since the last call, handled on the GUI thread
+    def handleWordEvents(self, worker):
+        for event in worker.takeEvents():
+            if isinstance(event, SnapshotEvent):
+                if self.doneWidgetAutoShow:
+                    self.toggleShow(event.hasEquation)
+            elif isinstance(event, DocumentEvent):
+                self.switchDocument(event.documentName)
+            elif isinstance(event, ConnectionEvent):
+                if event.connected:
+                    self.doneWidgetStatusLabel.hide()
+                else:
+                    self.convertAllProgress(event.message)
+            elif isinstance(event, MatchEvent):
+                tracer.since('poll.signal', event.postedAt)
+                self.equationReadAt = event.readAt
+                if self.documentName in self.documentSessions:
+                    self.documentSessions[self.documentName]['equation'] = event.equation
+                self.update_equation_edit(event.equation)
+            elif isinstance(event, ReplaceRequestEvent):
+                self.update_equation_edit(event.equation)
+                self.insertEquation(event.equation, event.position, event.documentName)
+                if event.documentName in self.documentSessions:
+                    self.documentSessions[event.documentName]['equation'] = ''
+                self.update_equation_edit('')
+            elif isinstance(event, InsertDoneEvent):
+                tracer.since('insert.total', event.requestedAt, output=event.output)
+            elif isinstance(event, ScanEvent):
+                if event.indexed:
+                    self.reRenderIndexed(event.documentName, event.items)
+                else:
+                    self.convertAllScanned(event.documentName, event.items)
+            elif isinstance(event, ProgressEvent):
+                self.convertAllProgress(event.message)
+            elif isinstance(event, DoneEvent):
+                self.convertAllFinished(event.replaced, event.skipped)
+            elif isinstance(event, ErrorEvent):
+                print(event.message)
+                # Only the worker that is still hooked may unhook, a stopped one is just draining
+                if event.fatal and worker is self.comWorker:
+                    self.stop_word_hook()
+    # The WordHook widget and its preview, built the first time WordHook starts
+    def createWordHookWidgets(self):
+        savedValues = loadSavedValues()
+        self.doneWidget = DraggableWidget()
+        self.doneWidget.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
+        screen = QGuiApplication.primaryScreen().geometry()
+        x = 0
+        y = (screen.height() / 2) - 150
+        self.doneWidget.move(x, y)
+        self.doneWidgetButton = QPushButton("Done", self.doneWidget)
+        self.doneWidgetButton.setStyleSheet("background-color: #222288")
+        self.doneWidgetButton.clicked.connect(self.requestReplace)
+        self.doneWidgetCloseButton = QPushButton("Close", self.doneWidget)
+        self.doneWidgetCloseButton.setStyleSheet("background-color: darkred")
+        self.doneWidgetCloseButton.clicked.connect(self.stop_word_hook)
+        self.doneWidgetControlHelpButton = QPushButton("ⓘ Help") # ⓘ
+        self.doneWidgetControlHelpButton.setStyleSheet("background-color: darkgreen")
+        self.doneWidgetControlHelpButton.clicked.connect(lambda: self.infoDialog("- Click and drag in any empty space to move the widget."
+                                                                                 "\n- You can use Ctrl+Scroll to zoom in/out in the SVG view."
+                                                                                 "\n- Click the Done button to replace the typed equation with the rendered SVG."
+                                                                                 "\n - You can also type \\done anywhere within the equation to trigger the replacement."
+                                                                                 "\n- Click Convert All to replace every equation in the document in one go (undoable as one step)."
+                                                                                 "\n- Click the Close button to exit WordHook"
+                                                                                 "\n- Use the provided window size controls to adjust the view to your preference."
+                                                                                 "\n- Click the Set Default button to save the current window size and position as default."
+                                                                                 "\n- This way, WordHook will always start at the same position and size you saved."))
+        self.smallView = SvgPreview()
+        def smallViewSizeChange(dir, val):
+            if dir == 'x':
+                self.smallView.setFixedSize(self.smallView.width() + val, self.smallView.height())
+                self.doneWidget.setFixedSize(self.doneWidget.width() + val, self.doneWidget.height())
+            elif dir == 'y':
+                self.smallView.setFixedSize(self.smallView.width(), self.smallView.height() + val)
+                self.doneWidget.setFixedSize(self.doneWidget.width(), self.doneWidget.height() + val)
+        self.doneWidgetSizeUpButton = QPushButton("⇧", self.doneWidget)
+        self.doneWidgetSizeUpButton.setStyleSheet("background-color: darkgray")
+        self.doneWidgetSizeUpButton.setMaximumWidth(40)
+        self.doneWidgetSizeUpButton.clicked.connect(lambda: smallViewSizeChange('y', -20))
+        self.doneWidgetSizeDownButton = QPushButton("⇩", self.doneWidget)
+        self.doneWidgetSizeDownButton.setStyleSheet("background-color: darkgray")
+        self.doneWidgetSizeDownButton.setMaximumWidth(40)
+        self.doneWidgetSizeDownButton.clicked.connect(lambda: smallViewSizeChange('y', 20))
+        self.doneWidgetSizeLeftButton = QPushButton("⇦", self.doneWidget)
+        self.doneWidgetSizeLeftButton.setStyleSheet("background-color: darkgray")
+        self.doneWidgetSizeLeftButton.setMaximumWidth(40)
+        self.doneWidgetSizeLeftButton.clicked.connect(lambda: smallViewSizeChange('x', -20))
+        self.doneWidgetSizeRightButton = QPushButton("⇨", self.doneWidget)
+        self.doneWidgetSizeRightButton.setStyleSheet("background-color: darkgray")
+        self.doneWidgetSizeRightButton.setMaximumWidth(40)
+        self.doneWidgetSizeRightButton.clicked.connect(lambda: smallViewSizeChange('x', 20))
+        self.doneWidgetSizeLabel = QLabel("Click and drag here to move view")
+        self.doneWidgetConvertAllButton = QPushButton("Convert All", self.doneWidget)
+        self.doneWidgetConvertAllButton.setToolTip('Render and replace every $$ equation in the document at once')
+        self.doneWidgetConvertAllButton.setStyleSheet("background-color: #222288")
+        self.doneWidgetConvertAllButton.clicked.connect(self.convertAll)
+        self.doneWidgetReRenderButton = QPushButton("Re-render", self.doneWidget)
+        self.doneWidgetReRenderButton.setToolTip('Re-render every equation inserted by MJ2G whose options or TeX '
+                                                 '(editable in the picture\'s alt text) changed since')
+        self.doneWidgetReRenderButton.setStyleSheet("background-color: #222288")
+        self.doneWidgetReRenderButton.clicked.connect(self.reRenderDocument)
+        self.doneWidgetStatusLabel = QLabel("", self.doneWidget)
+        self.doneWidgetStatusLabel.hide()
+        # Live p50/p95 of the traced stages
+        self.doneWidgetStatsLabel = QLabel("", self.doneWidget)
+        self.doneWidgetStatsLabel.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.doneWidgetStatsLabel.hide()
+        self.doneWidgetStatsTimer = QTimer(self)
+        self.doneWidgetStatsTimer.setInterval(500)
+        self.doneWidgetStatsTimer.timeout.connect(
+            lambda: self.doneWidgetStatsLabel.setText(tracer.summary() or 'No spans yet'))
+        self.doneWidgetStatsButton = QPushButton("Stats", self.doneWidget)
+        self.doneWidgetStatsButton.setToolTip('Show where time goes between typing in Word and the preview')
+        self.doneWidgetStatsButton.setStyleSheet("background-color: darkred")
+        self.doneWidgetStatsButton.clicked.connect(self.toggleStatsOverlay)
+        def doneWidgetSetDefault():
+            saveValues({'doneWidgetWidth': self.doneWidget.width(),
+                        'doneWidgetHeight': self.doneWidget.height(),
+                        'doneWidgetX': self.doneWidget.x(),
+                        'doneWidgetY': self.doneWidget.y()})
+        try:
+            if 'doneWidgetWidth' in savedValues:
+                self.doneWidget.setFixedWidth(int(savedValues['doneWidgetWidth']))
+            if 'doneWidgetHeight' in savedValues:
+                self.doneWidget.setFixedHeight(int(savedValues['doneWidgetHeight']))
+            if 'doneWidgetX' in savedValues:
+                self.doneWidget.move(int(savedValues['doneWidgetX']), self.doneWidget.y())
+            if 'doneWidgetY' in savedValues:
+                self.doneWidget.move(self.doneWidget.x(), int(savedValues['doneWidgetY']))
+        except Exception as e:
+            print(f'Error loading saved values: {e}')
+        self.doneWidgetSetDefaultButton = QPushButton("Set Default", self.doneWidget)
+        self.doneWidgetSetDefaultButton.setStyleSheet("background-color: #222288")
+        self.doneWidgetSetDefaultButton.clicked.connect(doneWidgetSetDefault)
+        def toggleWidgetAutoShow():
+            self.doneWidgetAutoShow = not self.doneWidgetAutoShow
+            if self.doneWidgetAutoShow:
+                self.doneWidget.setWindowOpacity(0)
+            self.doneWidgetAutoShowButton.setStyleSheet("background-color: darkgreen" if self.doneWidgetAutoShow else "background-color: darkred")
+        self.doneWidgetAutoShowButton = QPushButton("Auto-Show", self.doneWidget)
+        self.doneWidgetAutoShowButton.setStyleSheet("background-color: darkred")
+        self.doneWidgetAutoShowButton.clicked.connect(toggleWidgetAutoShow)
+        doneWidgetLayout = QHBoxLayout()
+        doneWidgetViewPortLayout = QVBoxLayout()
+        doneWidgetViewPortLayout.addStretch()
+        doneWidgetViewPortLayout.addWidget(self.doneWidgetButton)
+        doneWidgetViewPortLayout.addWidget(self.smallView)
+        doneWidgetViewPortLayout.addWidget(self.doneWidgetControlHelpButton)
+        doneWidgetViewPortLayout.addWidget(self.doneWidgetStatusLabel)
+        doneWidgetViewPortLayout.addWidget(self.doneWidgetStatsLabel)
+        doneWidgetViewPortLayout.addStretch()
+        doneWidgetHorizontalControlLayout = QHBoxLayout()
+        doneWidgetHorizontalControlLayout.addWidget(self.doneWidgetSizeLeftButton)
+        doneWidgetHorizontalControlLayout.addWidget(self.doneWidgetSizeRightButton)
+        doneWidgetHorizontalControlLayout.addStretch()
+        doneWidgetControlLayout = QVBoxLayout()
+        doneWidgetControlLayout.addWidget(self.doneWidgetCloseButton)
+        doneWidgetUpButtonPadLayout = QHBoxLayout()
+        doneWidgetUpButtonPadLayout.addStretch()
+        doneWidgetUpButtonPadLayout.addWidget(self.doneWidgetSizeUpButton)
+        doneWidgetUpButtonPadLayout.addStretch()
+        doneWidgetDownButtonPadLayout = QHBoxLayout()
+        doneWidgetDownButtonPadLayout.addStretch()
+        doneWidgetDownButtonPadLayout.addWidget(self.doneWidgetSizeDownButton)
+        doneWidgetDownButtonPadLayout.addStretch()
+        doneWidgetControlLayout.addLayout(doneWidgetUpButtonPadLayout)
+        doneWidgetControlLayout.addLayout(doneWidgetHorizontalControlLayout)
+        doneWidgetControlLayout.addLayout(doneWidgetDownButtonPadLayout)
+        doneWidgetControlLayout.addWidget(self.doneWidgetSetDefaultButton)
+        doneWidgetControlLayout.addWidget(self.doneWidgetAutoShowButton)
+        doneWidgetControlLayout.addWidget(self.doneWidgetConvertAllButton)
+        doneWidgetControlLayout.addWidget(self.doneWidgetReRenderButton)
+        doneWidgetControlLayout.addWidget(self.doneWidgetStatsButton)
+        doneWidgetControlLayout.addStretch()
+        doneWidgetLayout.addLayout(doneWidgetControlLayout)
+        doneWidgetLayout.addLayout(doneWidgetViewPortLayout)
+        self.doneWidget.setLayout(doneWidgetLayout)
+
     def start_word_hook(self):
+        if not loadWordSupport():
+            self.infoDialog(f'WordHook needs pywin32 and pynput: {wordSupportError}')
+            return
+        if self.doneWidget is None:
+            self.createWordHookWidgets()
         self.wordHookStatus = True
         self.controlsLabel.hide()
-        self.load_mathjax()
+        # Same renderer and MathJax as before, only the target changes, so re-render instead of reloading
+        self.update_mathjax()
         self.view.hide()
         self.showMinimized()
         self.doneWidget.show()
@@ -662,75 +3312,17 @@ class MainWindow(QMainWindow):
             widget = self.optionLowerLayout.itemAt(i).widget()
             if widget is not None:
                 widget.hide()
-        self.word_polling_thread = threading.Thread(target=self.poll_word_content)
-        self.word_polling_thread.daemon = True
-        self.word_polling_thread.start()
+        worker = WordComWorker(parent=self)
+        worker.eventsPosted.connect(lambda: self.handleWordEvents(worker))
+        worker.finished.connect(worker.deleteLater)
+        self.comWorker = worker
+        worker.start()
 
-    def poll_word_content(self):
-        pythoncom.CoInitialize()
-        word = win32.gencache.EnsureDispatch('Word.Application')
-        while self.wordHookStatus:
-            try:
-                wordDoc = word.ActiveDocument
-            except Exception as e:
-                print(f'No active word document, or error: {e}')
-                self.stop_word_hook()
-                return
-            try:
-                word_content = wordDoc.Range().Text
-            except Exception as e:
-                print(f'Error reading word content: {e}')
-                self.stop_word_hook()
-                return
-            matches = []
-            matches = re.findall(r'\$\$(.*?)(?<!\\)\$\$', word_content, re.DOTALL)
-            if len(matches) == 0:
-                if self.doneWidgetAutoShow:
-                    self.doneWidgetAutoShowSignal.emit(False)
-                    time.sleep(1/3)
-                continue
-            if self.doneWidgetAutoShow:
-                self.doneWidgetAutoShowSignal.emit(True)
-            self.update_equation_edit_signal.emit(fr"{matches[0].replace('$$', '')}")
-            if r'\done' in matches[0]:
-                self.replaceFlag = True
-                self.DoneMarker = True
-                rangeFindDoneReplace = wordDoc.Range().Find
-                rangeFindDoneReplace.ClearFormatting()
-                rangeFindDoneReplace.Text = r'\done'
-                rangeFindDoneReplace.Replacement.Text = ''
-                rangeFindDoneReplace.Execute()
-            if self.replaceFlag:
-                self.replaceFlag = False
-                match = fr"{matches[0].replace('$$', '')}"
-                if self.DoneMarker:
-                    match = match.replace(r'\done', '')
-                    self.DoneMarker = False
-                self.update_equation_edit_signal.emit(fr'{match}')
-                rangeFind = wordDoc.Range()
-                rangeFind.Find.ClearFormatting()
-                rangeFind.Find.Text = '$$'
-                found = rangeFind.Find.Execute()
-                if found:
-                    firstStartPos = rangeFind.Start
-                    firstEndPos = rangeFind.End
-                rangeFind = wordDoc.Range(firstEndPos, wordDoc.Range().End)
-                rangeFind.Find.ClearFormatting()
-                rangeFind.Find.Text = '$$'
-                found = rangeFind.Find.Execute()
-                if found:
-                    secondStartPos = rangeFind.Start
-                    secondEndPos = rangeFind.End
-                rangeToDelete = wordDoc.Range(firstStartPos, secondEndPos)
-                rangeToDelete.Delete()
-                self.thread_safe_svg_paste_signal.emit("1")
-                self.update_equation_edit_signal.emit('')
-            # Refresh rate for word doc content polling here change this if ur lagging
-            matches.clear()
-            time.sleep(1 / 15)
-        pythoncom.CoUninitialize()
     def stop_word_hook(self):
         self.wordHookStatus = False
+        if self.comWorker is not None:
+            self.comWorker.stop()
+            self.comWorker = None
         self.doneWidget.hide()
         self.view.show()
         self.controlsLabel.show()
@@ -750,6 +3342,155 @@ class MainWindow(QMainWindow):
         if self.alwaysOnTopButton.styleSheet() == "background-color: darkgreen":
             self.toggleAlwaysOnTop()
         self.show()
+    # Convert all: the COM worker scans the document once, every distinct equation is rendered through the render
+    # queue, then the worker replaces all blocks from the end backwards in a single undo record.
+    def convertAll(self):
+        if self.comWorker is None or self.convertAllRunning:
+            return
+        self.convertAllRunning = True
+        self.convertAllStarted = time.perf_counter()
+        self.convertAllProgress('Scanning document...')
+        if not self.comWorker.setPolling(False):
+            self.convertAllBusy()
+            return
+        worker = self.comWorker
+
+        def scan(word):
+            try:
+                wordDoc = word.ActiveDocument
+                worker.post(ScanEvent(wordDoc.FullName, scanEquationBlocks(wordDoc.Range().Text), False))
+            except Exception:
+                worker.post(DoneEvent(0, 0))
+                raise
+        if not worker.submit(scan):
+            self.convertAllBusy()
+
+    def convertAllScanned(self, documentName, blocks):
+        equations = list(dict.fromkeys(equation for _, _, equation in blocks))
+        for equation in equations:
+            self.recordEquation(equation)
+        self.renderAll(equations, lambda svgs, wordOutput: self.replaceAll(
+            documentName, svgs, wordOutput, len(blocks),
+            lambda wordDoc, *arguments: replaceEquationBlocks(wordDoc, blocks, *arguments)))
+
+    def reRenderDocument(self):
+        if self.comWorker is None or self.convertAllRunning:
+            return
+        self.convertAllRunning = True
+        self.convertAllStarted = time.perf_counter()
+        self.convertAllProgress('Indexing equations...')
+        if not self.comWorker.setPolling(False):
+            self.convertAllBusy()
+            return
+        worker = self.comWorker
+
+        def scan(word):
+            try:
+                wordDoc = word.ActiveDocument
+                worker.post(ScanEvent(wordDoc.FullName, EquationSource.index(wordDoc), True))
+            except Exception:
+                worker.post(DoneEvent(0, 0))
+                raise
+        if not worker.submit(scan):
+            self.convertAllBusy()
+
+    def reRenderIndexed(self, documentName, entries):
+        # Only pictures rendered with other options, or whose TeX was edited, need a new render
+        stale = [entry for entry in entries if entry[2] != self.equationHash(entry[1])]
+        self.renderAll(list(dict.fromkeys(tex for _, tex, _ in stale)), lambda svgs, wordOutput: self.replaceAll(
+            documentName, svgs, wordOutput, len(stale),
+            lambda wordDoc, *arguments: reRenderEquations(wordDoc, stale, *arguments)))
+
+    def equationHash(self, equation):
+        return EquationSource.optionsHash(equation, self.renderOptions(), self.svgOptimizer.identity())
+
+    def describeEquation(self, equation):
+        return EquationSource.describe(equation, self.equationHash(equation))
+
+    # Render every equation in the current output mode, through the cache, then call finished(svgs, wordOutput)
+    def renderAll(self, equations, finished):
+        if not equations or self.comWorker is None:
+            self.convertAllFinished(0, 0)
+            return
+        svgs = {}
+        wordOutput = self.wordOutput
+
+        def rendered(equation, svg):
+            svgs[equation] = svg
+            self.convertAllProgress(f'Rendering {len(svgs)}/{len(equations)}')
+            if len(svgs) == len(equations):
+                finished(svgs, wordOutput)
+
+        def render(done, equation):
+            if wordOutput == 'omml':
+                self.renderOmml(equation, done)
+            else:
+                self.renderSvg(self.renderTarget(), equation, done, display=False)
+
+        for equation in equations:
+            self.renderScheduler.submit(self.renderTarget(),
+                                        lambda done, equation=equation: render(done, equation),
+                                        lambda svg, equation=equation: rendered(equation, svg))
+
+    # svgs maps equations to SVG, or to OMML when wordOutput is omml. replace(wordDoc, pictureFor, progress, insert,
+    # describe) does the swapping on the COM worker and returns (replaced, skipped).
+    def replaceAll(self, documentName, svgs, wordOutput, total, replace):
+        if self.comWorker is None:
+            self.convertAllFinished(0, total)
+            return
+        worker = self.comWorker
+        descriptions = {equation: self.describeEquation(equation) for equation in svgs}
+
+        def job(word):
+            pictures = {}
+            try:
+                if wordOutput == 'omml':
+                    contents, insert = {equation: omml for equation, omml in svgs.items() if omml}, insertOmml
+                else:
+                    for equation, svg in svgs.items():
+                        if svg:
+                            pictures[equation] = worker.writeTemp(svg)
+                    contents, insert = pictures, insertPicture
+                replaced, skipped = replace(
+                    word.Documents(documentName), contents.get,
+                    lambda done, total: worker.post(ProgressEvent(f'Replacing {done}/{total}')), insert,
+                    descriptions.get)
+                worker.post(DoneEvent(replaced, skipped))
+            except Exception:
+                worker.post(DoneEvent(0, total))
+                raise
+            finally:
+                for picture in pictures.values():
+                    os.unlink(picture)
+        if not worker.submit(job):
+            self.convertAllBusy()
+
+    # The Word worker's queue is full, give up on this run rather than freeze the window waiting for room
+    def convertAllBusy(self):
+        self.convertAllRunning = False
+        if self.comWorker is not None:
+            self.comWorker.setPolling(True)
+        self.convertAllProgress('Word is busy, try again in a moment')
+
+    def convertAllProgress(self, message):
+        self.doneWidgetStatusLabel.setText(message)
+        self.doneWidgetStatusLabel.show()
+
+    def convertAllFinished(self, replaced, skipped):
+        elapsed = time.perf_counter() - self.convertAllStarted
+        self.convertAllRunning = False
+        if self.comWorker is not None:
+            self.comWorker.setPolling(True)
+        message = f'Converted {replaced} equations in {elapsed:.1f} s ({replaced / max(elapsed, 1e-6):.1f}/s)'
+        if skipped:
+            message += f', {skipped} skipped'
+        print(message)
+        self.convertAllProgress(message)
+
+    def requestReplace(self):
+        if self.comWorker is not None:
+            self.comWorker.requestReplace()
+
     def wordHook(self):
         if not self.wordHookStatus:
             self.start_word_hook()
@@ -759,6 +3500,11 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
+    arguments = parseArguments()
+    if arguments.batch:
+        sys.exit(runBatch(arguments))
+    if arguments.serve is not None:
+        sys.exit(runService(arguments))
     app = QApplication([])
     window = MainWindow()
     # Hide console
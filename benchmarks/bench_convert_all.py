@@ -0,0 +1,90 @@
+# Convert all against the fake Word object: scan a document full of $$ blocks, replace them all from the end
+# backwards and check the result, reporting throughput. Rendering is not part of this, every equation gets a
+# small placeholder SVG, so this measures the COM side of the pipeline. Then restyles the document: every picture is
+# re-rendered in place from the TeX kept in its AlternativeText, as after switching display style.
+#
+#   python benchmarks/bench_convert_all.py [--equations 300] [--duplicates 0.3] [--latency 0.0005]
+import argparse, os, random, shutil, tempfile, time
+import benchutil
+
+from fakeword import FakeWordApplication
+from MJ2G_BLEEDINGEDGE_WIN import scanEquationBlocks, replaceEquationBlocks, reRenderEquations, EquationSource, \
+    RenderOptions
+
+
+def buildDocument(equations, duplicates, seed=0):
+    random.seed(seed)
+    pool = []
+    paragraphs = []
+    for i in range(equations):
+        if pool and random.random() < duplicates:
+            equation = random.choice(pool)
+        else:
+            equation = f'\\frac{{a_{{{i}}}}}{{b}} + \\sqrt{{x^{i}}}'
+            pool.append(equation)
+        paragraphs.append(f'Paragraph {i} with some text around $${equation}$$ and a bit more.')
+    return '\r'.join(paragraphs) + '\r', len(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--equations', type=int, default=300)
+    parser.add_argument('--duplicates', type=float, default=0.3)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every COM call')
+    args = parser.parse_args()
+
+    text, distinct = buildDocument(args.equations, args.duplicates)
+    word = FakeWordApplication(text, latency=args.latency)
+    wordDoc = word.ActiveDocument
+    tempDir = tempfile.mkdtemp(prefix='MJ2G')
+    try:
+        start = time.perf_counter()
+        blocks = scanEquationBlocks(wordDoc.Range().Text)
+        scanned = time.perf_counter()
+        pictures = {}
+        for equation in dict.fromkeys(equation for _, _, equation in blocks):
+            path = os.path.join(tempDir, f'{len(pictures)}.svg')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'<svg><!-- {equation} --></svg>')
+            pictures[equation] = path
+        progress = []
+        options = RenderOptions()
+        replaced, skipped = replaceEquationBlocks(
+            wordDoc, blocks, pictures.get, lambda done, total: progress.append(done),
+            describe=lambda equation: EquationSource.describe(equation, EquationSource.optionsHash(equation, options)))
+        finished = time.perf_counter()
+
+        # Restyle: display style off makes every picture stale
+        options = RenderOptions(displayStyle=False)
+        entries = EquationSource.index(wordDoc)
+        stale = [entry for entry in entries if entry[2] != EquationSource.optionsHash(entry[1], options)]
+        restyled = reRenderEquations(
+            wordDoc, stale, pictures.get,
+            describe=lambda equation: EquationSource.describe(equation, EquationSource.optionsHash(equation, options)))
+        reRendered = time.perf_counter()
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    assert len(blocks) == args.equations, len(blocks)
+    assert len(pictures) == distinct, (len(pictures), distinct)
+    assert (replaced, skipped) == (args.equations, 0), (replaced, skipped)
+    assert '$$' not in wordDoc.text
+    assert wordDoc.text.count('/') == args.equations
+    assert wordDoc.InlineShapes.Count == args.equations
+    assert word.UndoRecord.records == ['MJ2G Convert all', 'MJ2G Re-render'] and word.UndoRecord.depth == 0
+    assert progress == list(range(1, args.equations + 1))
+    # Pictures are in document order, the first block got the first equation's SVG
+    assert wordDoc.InlineShapes.shapes[0].data.endswith(f'<!-- {blocks[0][2]} --></svg>')
+    assert len(entries) == len(stale) == args.equations and restyled == (args.equations, 0), restyled
+    assert [tex for _, tex, _ in EquationSource.index(wordDoc)] == [equation for _, _, equation in blocks]
+    assert all(entry[2] == EquationSource.optionsHash(entry[1], options) for entry in EquationSource.index(wordDoc))
+
+    total = finished - start
+    print(f'{args.equations} equations ({distinct} distinct), {word.calls} COM calls')
+    print(f'scan {1000 * (scanned - start):.1f} ms, replace {1000 * (finished - scanned):.1f} ms, '
+          f'{args.equations / total:.0f} equations/s')
+    print(f're-render {1000 * (reRendered - finished):.1f} ms, {args.equations / (reRendered - finished):.0f} equations/s')
+
+
+if __name__ == '__main__':
+    main()
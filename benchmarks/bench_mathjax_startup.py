@@ -0,0 +1,91 @@
+# Cold start of MathJax for each source: time from setHtml until MathJax is ready, and until the first equation is
+# typeset. Every run uses a fresh off-the-record profile so nothing comes from the HTTP cache.
+#
+#   python benchmarks/bench_mathjax_startup.py [--runs 5] [--local path/to/mathjax/es5]
+#
+# The cached copy is downloaded first if it is not there yet.
+import argparse, sys, time
+import benchutil
+
+from PySide6.QtCore import QTimer, QEventLoop
+from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile
+from PySide6.QtWidgets import QApplication
+
+app = QApplication(sys.argv)
+
+from MJ2G_BLEEDINGEDGE_WIN import MathJaxSource, buildMathJaxHtml
+
+
+def waitFor(page, script, timeout):
+    loop = QEventLoop()
+    result = {'value': None}
+    deadline = time.perf_counter() + timeout
+
+    def poll():
+        if time.perf_counter() > deadline:
+            loop.quit()
+            return
+        page.runJavaScript(script, 0, check)
+
+    def check(value):
+        if value:
+            result['value'] = value
+            loop.quit()
+        else:
+            QTimer.singleShot(5, poll)
+
+    poll()
+    loop.exec()
+    return result['value']
+
+
+def coldStart(source, timeout):
+    profile = QWebEngineProfile()
+    page = QWebEnginePage(profile)
+    start = time.perf_counter()
+    script, baseUrl = source.resolve()
+    page.setHtml(buildMathJaxHtml(script, False), baseUrl)
+    if not waitFor(page, "typeof MathJax !== 'undefined' && typeof MathJax.tex2svg === 'function'", timeout):
+        page.deleteLater()
+        return None, None
+    ready = time.perf_counter() - start
+    waitFor(page, "MathJax.tex2svg('\\\\int_0^1 x^2 \\\\, dx').outerHTML.length", timeout)
+    firstRender = time.perf_counter() - start
+    page.deleteLater()
+    return ready, firstRender
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--local', help='directory holding the MathJax es5 build')
+    args = parser.parse_args()
+
+    if not MathJaxSource.isCached():
+        print('Downloading MathJax cache...')
+        MathJaxSource.downloadCache()
+
+    sources = [('cdn', MathJaxSource('cdn')), ('cached', MathJaxSource('cached'))]
+    if args.local:
+        sources.append(('local', MathJaxSource('local', args.local)))
+
+    print(f"{'source':<8} {'ready ms (median)':>18} {'first render ms (median)':>26}")
+    for name, source in sources:
+        readies, renders = [], []
+        for _ in range(args.runs):
+            ready, firstRender = coldStart(source, args.timeout)
+            if ready is None:
+                break
+            readies.append(ready * 1000)
+            renders.append(firstRender * 1000)
+        if not readies:
+            print(f'{name:<8} {"failed to load":>18}')
+            continue
+        readies.sort()
+        renders.sort()
+        print(f'{name:<8} {readies[len(readies) // 2]:>18.1f} {renders[len(renders) // 2]:>26.1f}')
+
+
+if __name__ == '__main__':
+    main()
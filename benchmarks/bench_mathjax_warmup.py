@@ -0,0 +1,110 @@
+# First render after MathJax loads, cold against warmed up: each run starts a fresh process, loads MathJax in a
+# renderer page and renders a few typical equations one after the other, reporting the first render and the median of
+# the rest (steady state). Modes:
+#   cold    no warm-up, what every launch and page reload paid before
+#   corpus  the built-in warm-up corpus typeset once MathJax is up
+#   recent  the corpus plus the test equations themselves saved by a previous launch (!warmUpRecent set), as after
+#           using them last time
+# Renders start once the warm-up is through, as when typing starts a moment after launch (--settle adds more time).
+#
+#   python benchmarks/bench_mathjax_warmup.py [--runs 5] [--settle 0]
+import argparse, json, os, subprocess, sys, tempfile, time
+from benchutil import median, wait
+
+equations = [
+    r'\int_{-\infty}^{\infty} e^{-x^2}\,dx = \sqrt{\pi}',
+    r'\nabla \times \mathbf{B} = \mu_0 \mathbf{J} + \mu_0 \varepsilon_0 \frac{\partial \mathbf{E}}{\partial t}',
+    r'f(x) = \begin{cases} x^2 & x \geq 0 \\ -x & x < 0 \end{cases}',
+    r'\det \begin{pmatrix} a & b \\ c & d \end{pmatrix} = ad - bc',
+    r'\sum_{n=0}^{\infty} \frac{x^n}{n!} = e^x',
+    r'\lim_{h \to 0} \frac{f(x + h) - f(x)}{h} = f^{\prime}(x)',
+]
+modes = ['cold', 'corpus', 'recent']
+
+
+def child(mode, corpusPath, settle, timeout):
+    from PySide6.QtWidgets import QApplication
+    import MJ2G_BLEEDINGEDGE_WIN as mj2g
+    app = QApplication(sys.argv[:1])
+    source = mj2g.MathJaxSource.fromSavedValues(mj2g.loadSavedValues())
+    renderer = mj2g.WebEngineRenderer(source=source)
+    options = mj2g.RenderOptions()
+    result = {}
+
+    started = time.perf_counter()
+    renderer.reload(source)
+    if mode != 'cold':
+        corpus = mj2g.WarmUpCorpus(corpusPath, maxRecent=len(equations)) if mode == 'recent' else mj2g.WarmUpCorpus()
+        renderer.warmUp(corpus.equations(), options)
+    page = renderer.pages[0]
+    if not wait(app, lambda: page.ready, timeout):
+        print(json.dumps({'error': 'MathJax did not load'}))
+        return
+    result['ready'] = (time.perf_counter() - started) * 1000
+    if mode != 'cold':
+        warmUp = []
+        while not warmUp and time.perf_counter() - started < timeout:
+            page.runJavaScript('window.mj2gWarmUpMs', 0, lambda value: value is not None and warmUp.append(value))
+            wait(app, lambda: warmUp, 0.02)
+        result['warmup'] = float(warmUp[0]) if warmUp else None
+    wait(app, lambda: False, settle)
+
+    renders = []
+    for tex in equations:
+        done = []
+        renderStarted = time.perf_counter()
+        renderer.render(tex, options, lambda svg, error: done.append(svg))
+        if not wait(app, lambda: done, timeout) or not done[0]:
+            print(json.dumps({'error': f'{tex} did not render'}))
+            return
+        renders.append((time.perf_counter() - renderStarted) * 1000)
+    result['first'] = renders[0]
+    result['steady'] = median(renders[1:])
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--settle', type=float, default=0.0, help='seconds between the warm-up and the first render')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--child', choices=modes, help=argparse.SUPPRESS)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.corpus, args.settle, args.timeout)
+        return 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        # What a previous launch that inserted these equations left behind
+        import MJ2G_BLEEDINGEDGE_WIN as mj2g
+        corpusPath = os.path.join(directory, 'warmup.json')
+        corpus = mj2g.WarmUpCorpus(corpusPath, maxRecent=len(equations))
+        for tex in equations:
+            corpus.record(tex)
+        corpus.save()
+
+        print(f'{"mode":<8} {"ready":>9} {"warm-up":>9} {"first":>9} {"steady":>9}  first/steady (medians of '
+              f'{args.runs} launches)')
+        for mode in modes:
+            runs = []
+            for _ in range(args.runs):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, '--corpus',
+                                         corpusPath, '--settle', str(args.settle), '--timeout', str(args.timeout)],
+                                        capture_output=True, text=True).stdout
+                lines = [line for line in output.splitlines() if line.startswith('{')]
+                run = json.loads(lines[-1]) if lines else {'error': f'no result\n{output}'}
+                if 'error' in run:
+                    print(f'Error in {mode} run: {run["error"]}')
+                    return 1
+                runs.append(run)
+            values = {name: median([run[name] for run in runs if run.get(name) is not None])
+                      for name in ('ready', 'warmup', 'first', 'steady')}
+            warmUp = f'{values["warmup"]:6.1f} ms' if mode != 'cold' else '       -'
+            print(f'{mode:<8} {values["ready"]:6.1f} ms {warmUp} {values["first"]:6.1f} ms {values["steady"]:6.1f} ms  '
+                  f'{values["first"] / values["steady"]:.1f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# Word equations (OMML) against SVG pictures, offline. First checks the MathML to OMML conversion on MathML as MathJax's
+# tex2mml produces it and inserts the results into the fake Word document, then compares payload size and insert time
+# of both WordHook output modes. Word also keeps a PNG fallback for every SVG picture, which is not counted here.
+#
+#   python benchmarks/bench_omml.py [--equations 200] [--latency 0.0005]
+import argparse, os, random, shutil, tempfile, time
+import xml.etree.ElementTree as ET
+import benchutil
+
+from fakeword import FakeWordApplication
+from bench_svg_optimizer import sampleSvg
+from MJ2G_BLEEDINGEDGE_WIN import OmmlConverter, SvgOptimizer, insertOmml, insertPicture, replaceEquationBlocks
+
+mathml = '<math xmlns="http://www.w3.org/1998/Math/MathML" display="block">{}</math>'
+# (tex, tex2mml output, OMML elements expected, text of the OMML runs)
+samples = [
+    (r'\frac{a}{b}+\sqrt{x^2}',
+     '<mfrac><mi>a</mi><mi>b</mi></mfrac><mo>+</mo><msqrt><msup><mi>x</mi><mn>2</mn></msup></msqrt>',
+     {'f', 'num', 'den', 'rad', 'degHide', 'sSup'}, 'ab+x2'),
+    (r'\sum_{i=1}^{n} i^2',
+     '<munderover><mo data-mjx-texclass="OP">∑</mo><mrow data-mjx-texclass="ORD"><mi>i</mi><mo>=</mo><mn>1</mn>'
+     '</mrow><mrow data-mjx-texclass="ORD"><mi>n</mi></mrow></munderover><msup><mi>i</mi><mn>2</mn></msup>',
+     {'nary', 'chr', 'limLoc', 'sub', 'sup', 'sSup'}, 'i=1ni2'),
+    (r'\left( \begin{matrix} a & b \\ c & d \end{matrix} \right)',
+     '<mrow data-mjx-texclass="INNER"><mo data-mjx-texclass="OPEN">(</mo><mtable columnspacing="1em" rowspacing="4pt">'
+     '<mtr><mtd><mi>a</mi></mtd><mtd><mi>b</mi></mtd></mtr><mtr><mtd><mi>c</mi></mtd><mtd><mi>d</mi></mtd></mtr>'
+     '</mtable><mo data-mjx-texclass="CLOSE">)</mo></mrow>',
+     {'d', 'begChr', 'endChr', 'm', 'mr'}, 'abcd'),
+    (r'\hat{x} + \sin\theta',
+     '<mrow data-mjx-texclass="ORD"><mover><mi>x</mi><mo stretchy="false">^</mo></mover></mrow><mo>+</mo><mi>sin</mi>'
+     '<mo data-mjx-texclass="NONE">⁡</mo><mi>θ</mi>',
+     {'acc', 'accPr', 'sty'}, 'x+sinθ'),
+    (r'\int_0^1 f(x)\,dx',
+     '<msubsup><mo data-mjx-texclass="OP">∫</mo><mn>0</mn><mn>1</mn></msubsup><mi>f</mi><mo stretchy="false">(</mo>'
+     '<mi>x</mi><mo stretchy="false">)</mo><mstyle scriptlevel="0"><mspace width="0.167em"></mspace></mstyle>'
+     '<mi>d</mi><mi>x</mi>',
+     {'nary', 'limLoc'}, '01f(x)dx'),
+    (r'\mathbb{R}^n \text{ for all } n',
+     '<msup><mrow data-mjx-texclass="ORD"><mi mathvariant="double-struck">R</mi></mrow><mi>n</mi></msup>'
+     '<mtext> for all </mtext><mi>n</mi>',
+     {'scr', 'nor'}, 'Rn for all n'),
+    (r'\sqrt[3]{y}', '<mroot><mi>y</mi><mn>3</mn></mroot>', {'rad', 'deg'}, '3y'),
+]
+
+
+def ommlTags(omml):
+    return {element.tag.rpartition('}')[2] for element in ET.fromstring(omml).iter()}
+
+
+def ommlText(omml):
+    return ''.join(element.text or '' for element in ET.fromstring(omml).iter(f'{{{OmmlConverter.ommlNamespace}}}t'))
+
+
+def check(converter):
+    for tex, body, tags, text in samples:
+        omml = converter.convert(mathml.format(body))
+        missing = tags - ommlTags(omml)
+        assert not missing, f'{tex}: no {missing} in {omml}'
+        assert ommlText(omml) == text, f'{tex}: text {ommlText(omml)!r}, expected {text!r}'
+        ET.fromstring(OmmlConverter.package(omml))
+
+    # Through Convert All's replace loop into the fake document
+    document = ''.join(f'Equation {index}: $${tex}$$.\r' for index, (tex, _, _, _) in enumerate(samples))
+    word = FakeWordApplication(document)
+    blocks = [(document.index(f'$${tex}$$'), document.index(f'$${tex}$$') + len(tex) + 4, tex)
+              for tex, _, _, _ in samples]
+    contents = {tex: converter.convert(mathml.format(body), display=False) for tex, body, _, _ in samples}
+    replaced, skipped = replaceEquationBlocks(word.ActiveDocument, blocks, contents.get, insert=insertOmml)
+    assert (replaced, skipped) == (len(samples), 0), (replaced, skipped)
+    expected = ''.join(f'Equation {index}: {text}.\r' for index, (_, _, _, text) in enumerate(samples))
+    assert word.ActiveDocument.text == expected, word.ActiveDocument.text
+    assert len(word.ActiveDocument.equations) == len(samples)
+    print(f'OMML check passed for {len(samples)} equations')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--equations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every COM call')
+    args = parser.parse_args()
+
+    converter = OmmlConverter()
+    check(converter)
+
+    rng = random.Random(0)
+    picks = [rng.choice(samples) for _ in range(args.equations)]
+    started = time.perf_counter()
+    omml = [converter.convert(mathml.format(body), display=False) for _, body, _, _ in picks]
+    convertSeconds = time.perf_counter() - started
+    optimizer = SvgOptimizer()
+    svgs = [optimizer.optimize(sampleSvg(index, rng)) for index in range(args.equations)]
+
+    text = ''.join(f'Paragraph {index} $$e{index}$$ text.\r' for index in range(args.equations))
+    blocks = []
+    for index in range(args.equations):
+        start = text.index(f'$$e{index}$$')
+        blocks.append((start, start + len(f'$$e{index}$$'), f'e{index}'))
+
+    tempDir = tempfile.mkdtemp(prefix='MJ2G')
+    try:
+        word = FakeWordApplication(text, latency=args.latency)
+        started = time.perf_counter()
+        pictures = {}
+        for index, svg in enumerate(svgs):
+            pictures[f'e{index}'] = os.path.join(tempDir, f'equation{index}.svg')
+            with open(pictures[f'e{index}'], 'w', encoding='utf-8') as f:
+                f.write(svg)
+        replaceEquationBlocks(word.ActiveDocument, blocks, pictures.get, insert=insertPicture)
+        svgSeconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    word = FakeWordApplication(text, latency=args.latency)
+    started = time.perf_counter()
+    replaceEquationBlocks(word.ActiveDocument, blocks, {f'e{index}': xml for index, xml in enumerate(omml)}.get,
+                          insert=insertOmml)
+    ommlSeconds = time.perf_counter() - started
+
+    svgBytes = sum(len(svg.encode()) for svg in svgs)
+    ommlBytes = sum(len(xml.encode()) for xml in omml)
+    print(f'{args.equations} equations, {args.latency * 1000:.2f} ms per COM call')
+    print(f'SVG:  {svgBytes / args.equations:8.0f} bytes/equation  insert {svgSeconds / args.equations * 1000:.3f} ms/equation')
+    print(f'OMML: {ommlBytes / args.equations:8.0f} bytes/equation  insert {ommlSeconds / args.equations * 1000:.3f} ms/equation'
+          f'  (conversion {convertSeconds / args.equations * 1000:.3f} ms/equation)')
+
+
+if __name__ == '__main__':
+    main()
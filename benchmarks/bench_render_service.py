@@ -0,0 +1,96 @@
+# Load test for the render service. Start one first, then point this at it:
+#
+#   python MJ2G_BLEEDINGEDGE_WIN.py --serve 8765 --jobs 4
+#   python benchmarks/bench_render_service.py [--url http://127.0.0.1:8765] [--requests 2000] [--concurrency 8]
+#                                             [--distinct 200] [--batch 1]
+#
+# Clients send equations drawn from --distinct variants over keep-alive connections, --batch per request, so repeats
+# exercise the cache and concurrent duplicates the deduplication. Reports requests/s, equations/s, latency percentiles
+# and what the service counted meanwhile (renders, cache hits, deduplicated requests).
+import argparse, http.client, json, random, sys, threading, time
+from urllib.parse import urlparse
+from benchutil import percentile
+
+templates = [r'\frac{{a_{{{0}}}}}{{b + {0}}}', r'\sum_{{i=1}}^{{{0}}} i^2', r'\int_0^{{{0}}} e^{{-x^2}}\,dx',
+             r'\begin{{pmatrix}} {0} & 1 \\ 0 & {0} \end{{pmatrix}}', r'\sqrt[{0}]{{x^2 + y^2}}']
+
+
+def equation(index):
+    return templates[index % len(templates)].format(index)
+
+
+def stats(host, port):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.request('GET', '/stats')
+    return json.loads(connection.getresponse().read())
+
+
+def client(host, port, jobs, batch, seed, latencies, errors, lock):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port, timeout=120)
+    while True:
+        with lock:
+            if not jobs[0]:
+                return
+            count = min(batch, jobs[0])
+            jobs[0] -= count
+        requests = [{'tex': equation(rng.randrange(jobs[1]))} for _ in range(count)]
+        body = json.dumps(requests if batch > 1 else requests[0]).encode()
+        started = time.perf_counter()
+        try:
+            connection.request('POST', '/render', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            result = json.loads(response.read())
+            failed = sum(1 for item in result['results'] if not item['svg']) if batch > 1 else response.status != 200
+        except Exception as e:
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=120)
+            failed = count
+            print(f'Error in request: {e}', file=sys.stderr)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed * 1000)
+            errors[0] += failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--requests', type=int, default=2000, help='equations to send in total')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct', type=int, default=200, help='different equations to draw from')
+    parser.add_argument('--batch', type=int, default=1, help='equations per request')
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+    try:
+        before = stats(host, port)
+    except OSError as e:
+        print(f'Error reaching the render service at {args.url}: {e}')
+        return 1
+    jobs = [args.requests, args.distinct]
+    latencies, errors, lock = [], [0], threading.Lock()
+    threads = [threading.Thread(target=client, args=(host, port, jobs, max(1, args.batch), index, latencies, errors,
+                                                     lock)) for index in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    after = stats(host, port)
+
+    print(f'{args.requests} equations, {len(latencies)} requests of {args.batch}, {args.concurrency} clients, '
+          f'{args.distinct} distinct equations')
+    print(f'throughput: {len(latencies) / elapsed:.1f} requests/s, {args.requests / elapsed:.1f} equations/s, '
+          f'{errors[0]} failed')
+    print(f'latency: p50 {percentile(latencies, 0.5):.1f} ms, p95 {percentile(latencies, 0.95):.1f} ms, '
+          f'p99 {percentile(latencies, 0.99):.1f} ms, max {max(latencies, default=float("nan")):.1f} ms')
+    print('service: ' + ', '.join(f'{name} {after[name] - before[name]}'
+                                  for name in ('rendered', 'cached', 'deduplicated', 'errors')))
+    return 1 if errors[0] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# Startup budget: time from process start to the first painted window and to the first rendered equation (the
+# placeholder), each run in a fresh process so nothing is warm but the OS file cache. Also reports whether WordHook's
+# widgets, its Windows modules or a WebEngine page already existed when the window first painted, which should all be
+# left for later. Exits with 1 when a median goes over its budget.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--window-budget 2] [--render-budget 5]
+import argparse, json, os, subprocess, sys, time
+from benchutil import median, wait
+
+
+def child(spawned, timeout):
+    from PySide6.QtCore import QEvent, QObject
+    from PySide6.QtWidgets import QApplication
+    import MJ2G_BLEEDINGEDGE_WIN as mj2g
+    result = {'import': time.time() - spawned}
+
+    class FirstPaint(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and 'window' not in result:
+                result['window'] = time.time() - spawned
+                result['pages'] = len(getattr(window.renderer, 'pages', []))
+                result['wordhook'] = window.doneWidget is not None
+                result['win32'] = 'win32com' in sys.modules or 'pynput' in sys.modules
+            return False
+
+    app = QApplication(sys.argv[:1])
+    window = mj2g.MainWindow()
+    firstPaint = FirstPaint()
+    window.view.installEventFilter(firstPaint)
+    window.renderScheduler.renderFinished.connect(
+        lambda target, svg: svg and result.setdefault('render', time.time() - spawned))
+    window.show()
+    wait(app, lambda: 'render' in result, timeout)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--window-budget', type=float, default=2.0, help='seconds to the first painted window')
+    parser.add_argument('--render-budget', type=float, default=5.0, help='seconds to the first rendered equation')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child, args.timeout)
+        return 0
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', repr(time.time()),
+                                 '--timeout', str(args.timeout)], capture_output=True, text=True).stdout
+        lines = [line for line in output.splitlines() if line.startswith('{')]
+        if not lines:
+            print(f'Error in startup run: no result\n{output}')
+            return 1
+        runs.append(json.loads(lines[-1]))
+
+    print(f'{"run":>4}  {"import":>8}  {"window":>8}  {"render":>8}  at first paint')
+    for index, run in enumerate(runs):
+        early = [name for name, built in (('WordHook widgets', run.get('wordhook')), ('win32/pynput', run.get('win32')),
+                                          (f'{run.get("pages")} WebEngine pages', run.get('pages'))) if built]
+        render = f'{run["render"]:7.2f}s' if 'render' in run else '   none'
+        print(f'{index + 1:>4}  {run["import"]:7.2f}s  {run.get("window", float("nan")):7.2f}s  {render}  '
+              f'{", ".join(early) or "nothing deferred was built"}')
+
+    over = False
+    for name, budget in (('window', args.window_budget), ('render', args.render_budget)):
+        value = median([run[name] for run in runs if name in run])
+        over |= not value <= budget
+        print(f'first {name}: median {value:.2f}s, budget {budget:.2f}s, {"ok" if value <= budget else "OVER"}')
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
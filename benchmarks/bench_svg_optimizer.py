@@ -0,0 +1,92 @@
+# SVG optimizer before/after: bytes and time per equation, plus the total with shared glyphs moved to a sprite file.
+# Takes the SVGs of a batch export made with --no-optimize, or builds MathJax-shaped SVGs when no directory is given.
+#
+#   python MJ2G_BLEEDINGEDGE_WIN.py --batch notes.md -o raw --no-optimize
+#   python benchmarks/bench_svg_optimizer.py [raw] [--precision 1] [--equations 300]
+import argparse, glob, os, random, time
+import benchutil
+
+from MJ2G_BLEEDINGEDGE_WIN import SvgOptimizer
+
+# A few TeX font glyphs as MathJax emits them with fontCache 'local'
+glyphs = {
+    'MJX-TEX-I-1D44E': 'M33 157Q33 258 109 349T280 441Q331 441 370 392Q386 422 416 422Q429 422 439 414T449 395Q449 381 '
+                       '412 234T374 68Q374 43 381 35T402 26Q411 27 422 35Q443 55 463 131Q469 151 473 152Q475 153 483 '
+                       '153H487Q506 153 506 144Q506 138 501 117T481 63T449 13Q436 0 417 -8Q409 -10 393 -10Q359 -10 336 '
+                       '5T306 36L300 51Q299 52 296 50Q294 48 292 46Q233 -10 172 -10Q117 -10 75 30T33 157Z',
+    'MJX-TEX-I-1D44F': 'M73 647Q73 657 77 670T89 683Q90 683 161 688T234 694Q246 694 246 685T212 542Q204 508 195 472T180 '
+                       '418L176 399Q176 396 182 402Q231 442 283 442Q345 442 383 396T422 280Q422 169 343 79T173 -11Q123 '
+                       '-11 82 27T40 150V159Q40 180 48 217T97 414Q147 611 147 623T109 637Q104 637 101 637H96Q86 637 83 '
+                       '637T76 640T73 647Z',
+    'MJX-TEX-N-2B': 'M56 237T56 250T70 270H369V420L370 570Q380 583 389 583Q402 583 409 568V270H707Q722 262 722 250T707 '
+                    '230H409V-68Q401 -82 391 -82H389H387Q375 -82 369 -68V230H70Q56 237 56 250Z',
+    'MJX-TEX-N-32': 'M109 429Q82 429 66 447T50 491Q50 562 103 614T235 666Q326 666 387 610T449 465Q449 422 429 383T381 '
+                    '315T301 241Q265 210 201 149L142 93L218 92Q375 92 385 97Q392 99 409 186V189H449V186Q448 183 436 '
+                    '95T421 3V0H50V19V31Q50 38 56 46T86 81Q115 113 136 137Q145 147 170 174T204 211T233 244T261 278T284 '
+                    '308T305 340T320 369T333 401T340 431T343 464Q343 527 309 573T212 619Q179 619 154 602T119 569T109 '
+                    '550Q109 549 114 549Q132 549 151 535T170 489Q170 464 154 447T109 429Z',
+    'MJX-TEX-N-221A': 'M95 178Q89 178 81 186T72 200T103 230T169 280T207 309Q209 311 212 311H213Q219 311 227 294T281 '
+                      '177Q300 134 312 108L397 -77Q398 -77 501 136T707 565T814 786Q820 800 834 800Q841 800 846 794T853 '
+                      '782V776L620 293L385 -193Q381 -200 366 -200Q357 -200 354 -197Q352 -195 256 15L160 225L144 214Q129 '
+                      '202 113 190T95 178Z',
+}
+
+
+def sampleSvg(index, random):
+    count = random.randint(3, 9)
+    x = 0.0
+    uses = []
+    used = set()
+    for i in range(count):
+        name = random.choice(list(glyphs))
+        used.add(name)
+        uses.append(f'<g data-mml-node="mi" transform="translate({x:.3f},0)"><use data-c="{name[-4:]}" '
+                    f'xlink:href="#MJX-{index}-{name[4:]}"></use></g>')
+        x += random.uniform(400, 800)
+    defs = ''.join(f'<path id="MJX-{index}-{name[4:]}" d="{glyphs[name]}"></path>' for name in sorted(used))
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{x / 432:.3f}ex" '
+            f'height="2.262ex" role="img" focusable="false" viewBox="0 -750 {x:.3f} 1000" '
+            f'style="vertical-align: -0.566ex;"><defs>{defs}</defs><g stroke="black" fill="black" stroke-width="0" '
+            f'transform="scale(1,-1)"><g data-mml-node="math"><g data-mml-node="mrow">{"".join(uses)}</g>'
+            f'<rect width="{x:.3f}" height="60" x="120.5" y="220.25"></rect></g></g></svg>')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', nargs='?', help='directory of unoptimized SVG files')
+    parser.add_argument('--precision', type=int, default=1)
+    parser.add_argument('--equations', type=int, default=300, help='SVGs to build when no directory is given')
+    args = parser.parse_args()
+
+    if args.directory:
+        svgs = []
+        for path in sorted(glob.glob(os.path.join(args.directory, '*.svg'))):
+            with open(path, encoding='utf-8') as f:
+                svgs.append(f.read())
+    else:
+        rng = random.Random(0)
+        svgs = [sampleSvg(index, rng) for index in range(args.equations)]
+    if not svgs:
+        print('No SVG files found')
+        return
+
+    optimizer = SvgOptimizer(args.precision)
+    started = time.perf_counter()
+    optimized = [optimizer.optimize(svg) for svg in svgs]
+    optimizeSeconds = time.perf_counter() - started
+    started = time.perf_counter()
+    sprite, sprited = optimizer.sprite(optimized, 'glyphs.svg')
+    spriteSeconds = time.perf_counter() - started
+
+    before = sum(len(svg.encode()) for svg in svgs)
+    after = sum(len(svg.encode()) for svg in optimized)
+    spriteTotal = len(sprite.encode()) + sum(len(svg.encode()) for svg in sprited)
+    print(f'{len(svgs)} equations, precision {args.precision}')
+    print(f'raw:        {before:10d} bytes')
+    print(f'optimized:  {after:10d} bytes  {after / before:6.1%}  {optimizeSeconds / len(svgs) * 1000:.3f} ms/equation')
+    print(f'sprite:     {spriteTotal:10d} bytes  {spriteTotal / before:6.1%}  {spriteSeconds * 1000:.1f} ms '
+          f'(glyphs.svg {len(sprite.encode())} bytes)')
+
+
+if __name__ == '__main__':
+    main()
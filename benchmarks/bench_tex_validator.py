@@ -0,0 +1,85 @@
+# TeX pre-validator: checks a few complete and incomplete equations, then times validate on aligned blocks of growing
+# size (time per character should stay flat) and on every prefix of a typed equation, which is what the preview sees
+# while typing, reporting how many of those prefixes never reach MathJax.
+#
+#   python benchmarks/bench_tex_validator.py [--lines 10,100,1000,10000]
+import argparse, time
+import benchutil
+
+from MJ2G_BLEEDINGEDGE_WIN import TexValidator
+
+# (tex, message of the expected error or None)
+samples = [
+    (r'\frac{a}{b}', None),
+    (r'\frac{a}{', 'Missing } for this {'),
+    (r'\begin{cases} x', r'Missing \end{cases}'),
+    (r'\begin{cases} x & y \end{cases}', None),
+    (r'\begin{foo} x \end{foo}', None),
+    (r'\begin{foo} x', r'Missing \end{foo}'),
+    (r'\begin{psmallmatrix} a \end{psmallmatrix} \begin{cases*} x \end{cases*}', None),
+    (r'\newenvironment{foo}{}{} \begin{foo} x \end{foo}', None),
+    (r'\text{50% off} + \mbox{{a}%}', None),
+    (r'\text{50% off', 'Missing } for this {'),
+    (r'\def\a{\left(} \a x \right)', None),
+    (r'\newcommand{\ba}{\begin{aligned}} \ba x \end{aligned}', None),
+    (r'\left( x \middle| y \right)', None),
+    (r'\left( {x \right) }', r'Missing } for this { before \right'),
+    (r'\left\{ x \right.', None),
+    (r'\{ 100\% \} % {', None),
+    (r'a}', 'Extra }'),
+    (r'\begin{ali', r'\begin without an environment name'),
+    ('x\\', 'Backslash at the end'),
+]
+typed = r'f(x) = \left\{ \begin{array}{ll} \frac{x^2}{\sqrt{1 + x}} & x \geq 0 \\ -\frac{1}{x} & x < 0 \end{array} \right.'
+
+
+def aligned(lines):
+    rows = (rf'x_{{{index}}} &= \frac{{a_{{{index}}} + b}}{{\sqrt{{c_{{{index}}}}}}} \left( y + \frac{{1}}{{2}} \right)'
+            for index in range(lines))
+    return r'\begin{aligned}' + '\n' + ' \\\\\n'.join(rows) + '\n' + r'\end{aligned}'
+
+
+def check(validator):
+    for tex, message in samples:
+        error = validator.validate(tex)
+        assert (error and error.message) == message, f'{tex}: {error}, expected {message}'
+    # The error of an unclosed brace deep inside a long block points at that brace
+    tex = aligned(500)
+    broken = tex.replace(r'\frac{a_{250}', r'\frac{{a_{250}', 1)
+    error = validator.validate(broken)
+    assert error is not None and broken[error.position] == '{', error
+    assert validator.location(broken, error.position).startswith('line 252,'), validator.location(broken, error.position)
+    print(f'Validator check passed for {len(samples) + 1} equations')
+
+
+def timed(validator, tex, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        validator.validate(tex)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default='10,100,1000,10000', help='lines of the aligned blocks')
+    args = parser.parse_args()
+
+    validator = TexValidator()
+    check(validator)
+
+    print(f'{"lines":>7}  {"characters":>10}  {"validate":>11}  {"per character":>13}')
+    for lines in [int(lines) for lines in args.lines.split(',')]:
+        tex = aligned(lines)
+        seconds = timed(validator, tex, max(1, 20000 // lines))
+        print(f'{lines:>7}  {len(tex):>10}  {seconds * 1000:>8.3f} ms  {seconds / len(tex) * 1e9:>10.1f} ns')
+
+    prefixes = [typed[:length] for length in range(1, len(typed) + 1)]
+    started = time.perf_counter()
+    rejected = sum(validator.validate(prefix) is not None for prefix in prefixes)
+    seconds = time.perf_counter() - started
+    print(f'typing {len(prefixes)} prefixes: {rejected} ({rejected / len(prefixes):.0%}) skip MathJax, '
+          f'{seconds / len(prefixes) * 1e6:.1f} us per check')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# WordHook end to end against the fake Word object: the real MainWindow and its Word worker run with
+# win32/pythoncom/pynput pointed at fakeword, rendering goes through MathJax as usual. Reports
+#   - Word worker CPU, COM calls and characters read over COM against document size, idle and while typing at
+#     10 keys/s (every keystroke changes the snapshot), in plain prose and in a document full of $$ blocks with the
+#     cursor in its last equation (the window read has to find where that equation starts)
+#   - keystroke to preview latency while an equation is typed, until the WordHook preview shows the new render, in a
+#     one line document and at the end of the largest document with equations
+#   - insertions per second through the insertion path, SVG pictures and native equations
+#   - the per-stage p50/p95 the tracer collected along the way (MJ2G_TRACE=path also writes them as JSON lines)
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_wordhook.py [--sizes 1000,10000,100000,1000000] [--latency 0.0005]
+import argparse, sys, threading, time
+from benchutil import percentile, wait
+
+from PySide6.QtWidgets import QApplication
+from fakeword import FakeDocument, FakeWordApplication, installFakeCom, typeText
+import MJ2G_BLEEDINGEDGE_WIN as mj2g
+
+
+# Prose, or prose with an aligned equation over five paragraphs after every four paragraphs of it. Returns the text
+# and the cursor: the end of the document, or the last line of its last equation, so the paragraphs read around the
+# cursor start inside that equation.
+def document(size, equations=False):
+    paragraph = 'Some text of a paragraph in a long document, nothing to render here. ' * 4 + '\r'
+    if not equations:
+        text = paragraph * (size // len(paragraph) + 1)
+        return text[:size] + '\r', size
+    unit = paragraph * 4 + ('$$\\begin{aligned}\ra &= b \\\\\rc &= d \\\\\re &= f \\\\\r'
+                            '\\sum_{k=0}^{n} k^2 &= \\frac{n(n+1)(2n+1)}{6}\r\\end{aligned}$$\r')
+    text = unit * max(1, size // len(unit))
+    return text, text.rindex('k^2') + 3
+
+
+# CPU time of the Word worker thread alone where the platform can tell, of the whole process otherwise
+def pollCpuTime(window):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(window.comWorker.ident))
+    except (AttributeError, OSError):
+        return time.process_time()
+
+
+def measurePolling(app, window, word, keyboard, size, seconds, typing, equations):
+    with word.lock:
+        word.documents[0].text, word.selectionStart = document(size, equations)
+    stop = threading.Event()
+
+    def typist():
+        while not stop.wait(0.1):
+            typeText(word, 'a')
+            keyboard.press()
+    thread = threading.Thread(target=typist, daemon=True)
+    # Let the poller settle on the new document first
+    wait(app, lambda: False, 0.5)
+    calls, characters, cpu, started = word.calls, word.characters, pollCpuTime(window), time.perf_counter()
+    if typing:
+        thread.start()
+    wait(app, lambda: False, seconds)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    return ((pollCpuTime(window) - cpu) / elapsed * 1000, (word.calls - calls) / elapsed,
+            (word.characters - characters) / elapsed)
+
+
+def measureKeystrokes(app, window, word, keyboard, keystrokes, size=None):
+    with word.lock:
+        if size is None:
+            word.documents[0].text = 'Equation: $$x$$ and more text.\r'
+            word.selectionStart = word.documents[0].text.index('x') + 1
+        else:
+            word.documents[0].text, word.selectionStart = document(size, equations=True)
+    shown = []
+    showSvg = window.showSvg
+    window.showSvg = lambda target, svg: (shown.append(time.perf_counter()), showSvg(target, svg))
+    wait(app, lambda: shown, 10)
+    latencies = []
+    for index in range(keystrokes):
+        count = len(shown)
+        pressed = time.perf_counter()
+        # Unique digits so every keystroke needs a fresh render instead of a cache hit
+        typeText(word, str(index % 10))
+        keyboard.press()
+        if wait(app, lambda: len(shown) > count, 5):
+            latencies.append((shown[-1] - pressed) * 1000)
+        wait(app, lambda: False, 0.05)
+    window.showSvg = showSvg
+    return latencies
+
+
+def measureInsertions(app, window, word, count, wordOutput):
+    window.wordOutput = wordOutput
+    with word.lock:
+        word.documents[0] = FakeDocument(word, 'Insertions: \r', 'Document1')
+        word.selectionStart = len('Insertions: ')
+    target = word.documents[0]
+    started = time.perf_counter()
+    for index in range(count):
+        window.insertEquation(f'x_{{{index}}}^2')
+    inserted = lambda: (target.InlineShapes.Count if wordOutput == 'svg' else len(target.equations)) >= count
+    done = wait(app, inserted, 60)
+    elapsed = time.perf_counter() - started
+    return (count if done else 0) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='document sizes in characters')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every COM call')
+    parser.add_argument('--seconds', type=float, default=2.0, help='measuring time per document size')
+    parser.add_argument('--keystrokes', type=int, default=40)
+    parser.add_argument('--insertions', type=int, default=100)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    word = FakeWordApplication('\r', latency=args.latency)
+    keyboard = installFakeCom(mj2g, word)
+    window = mj2g.MainWindow()
+    window.start_word_hook()
+    try:
+        print(f'COM latency {args.latency * 1000:.2f} ms per call, read mode '
+              f'{mj2g.loadSavedValues().get("wordReadMode", "window")}')
+        print(f'{"document":>10}  {"content":<9}  {"idle CPU":>12}  {"typing CPU":>12}  {"COM calls/s":>11}  '
+              f'{"characters read/s":>17}')
+        sizes = [int(size) for size in args.sizes.split(',')]
+        for size in sizes:
+            for equations in (False, True):
+                idle, _, _ = measurePolling(app, window, word, keyboard, size, args.seconds, False, equations)
+                typing, calls, characters = measurePolling(app, window, word, keyboard, size, args.seconds, True,
+                                                           equations)
+                print(f'{size:>10}  {"equations" if equations else "prose":<9}  {idle:>7.1f} ms/s  '
+                      f'{typing:>7.1f} ms/s  {calls:>11.0f}  {characters:>17.0f}')
+
+        for size in (None, max(sizes)):
+            latencies = measureKeystrokes(app, window, word, keyboard, args.keystrokes, size)
+            where = 'one line document' if size is None else f'{size} characters with equations'
+            print(f'keystroke to preview ({where}): p50 {percentile(latencies, 0.5):.1f} ms, '
+                  f'p95 {percentile(latencies, 0.95):.1f} ms ({len(latencies)}/{args.keystrokes} keystrokes shown)')
+
+        for wordOutput in ('svg', 'omml'):
+            rate = measureInsertions(app, window, word, args.insertions, wordOutput)
+            print(f'insertions ({wordOutput}): {rate:.1f}/s')
+        print(mj2g.tracer.summary())
+    finally:
+        worker = window.comWorker
+        window.stop_word_hook()
+        worker.wait(5000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# Helpers shared by the benchmark and check scripts. Importing it defaults Qt to the offscreen platform and puts the
+# repository root on sys.path, so MJ2G_BLEEDINGEDGE_WIN can be imported next.
+import os, sys, time
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float('nan')
+
+
+def median(values):
+    return percentile(values, 0.5)
+
+
+# Runs the Qt event loop until condition() holds or timeout seconds have passed, returns condition()
+def wait(app, condition, timeout=10, step=0.001):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(step)
+    return condition()
@@ -0,0 +1,133 @@
+# WordHook with several documents open, against the fake Word object: the preview follows the focused document and
+# comes back to each one's equation (from that document's render cache), the hook survives Word having no active
+# document or rejecting calls for a while, \done inserts into the document it was typed in, and equations spanning
+# more paragraphs than WordHook reads around the cursor are paired up right.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/check_wordhook_documents.py
+import sys
+from benchutil import wait
+
+from PySide6.QtWidgets import QApplication
+from fakeword import FakeWordApplication, installFakeCom, typeText
+import MJ2G_BLEEDINGEDGE_WIN as mj2g
+
+
+def check(app, window, word, keyboard):
+    renders = []
+    render = window.renderer.render
+    window.renderer.render = lambda tex, *arguments: (renders.append(tex), render(tex, *arguments))
+    edit = window.equation_edit.toPlainText
+    shown = []
+    showSvg = window.showSvg
+    window.showSvg = lambda target, svg: (shown.append(target), showSvg(target, svg))
+
+    assert wait(app, lambda: edit() == 'a+b'), f'first document: {edit()!r}'
+    # Its first render can wait for MathJax to load, let it finish so it lands in the cache
+    assert wait(app, lambda: any(tex.endswith('a+b') for tex in renders)), 'first document never rendered'
+    shownCount = len(shown)
+    assert wait(app, lambda: len(shown) > shownCount), 'first document never shown'
+    word.addDocument('Second $$c^2$$ document\r', 'Second.docx')
+    word.selectionStart = len('Second $$c^2')
+    keyboard.press()
+    assert wait(app, lambda: edit() == 'c^2' and window.documentName == 'Second.docx'), f'second: {edit()!r}'
+
+    # Back to the first one: its equation is shown again without MathJax
+    assert wait(app, lambda: renders and renders[-1].endswith('c^2'))
+    count, shownCount = len(renders), len(shown)
+    word.activate('First.docx')
+    keyboard.press()
+    assert wait(app, lambda: edit() == 'a+b' and len(shown) > shownCount), f'back to first: {edit()!r}'
+    wait(app, lambda: False, 0.3)
+    assert len(renders) == count, f'rendered {renders[count:]} again'
+
+    # No active document (Save dialog), then Word rejecting calls, the hook stays on and picks up afterwards
+    for name, enter, leave in (('no document', lambda: word.activate(None), lambda: word.activate('First.docx')),
+                               ('busy', lambda: setattr(word, 'busy', True), lambda: setattr(word, 'busy', False))):
+        with word.lock:
+            enter()
+        keyboard.press()
+        assert wait(app, lambda: window.doneWidgetStatusLabel.isVisible()), f'{name}: not reported'
+        wait(app, lambda: False, 1.0)
+        assert window.wordHookStatus and window.comWorker.isRunning(), f'{name}: unhooked'
+        with word.lock:
+            leave()
+            typeText(word, 'c')
+        keyboard.press()
+        assert wait(app, lambda: edit() == 'a+bc' and not window.doneWidgetStatusLabel.isVisible(), 5), \
+            f'{name}: not picked up again, {edit()!r}'
+        with word.lock:
+            document = word.documents[word.activeIndex]
+            document.replace(document.selectionStart - 1, document.selectionStart, '')
+        keyboard.press()
+        assert wait(app, lambda: edit() == 'a+b'), f'{name}: {edit()!r}'
+
+    # \done in the second document, with focus moving back to the first while it is inserted
+    word.activate('Second.docx')
+    with word.lock:
+        typeText(word, r'\done')
+    keyboard.press()
+    second = word.documents[1]
+    assert wait(app, lambda: second.InlineShapes.Count == 1), 'nothing inserted into the second document'
+    word.activate('First.docx')
+    assert word.documents[0].InlineShapes.Count == 0
+    assert second.text == 'Second / document\r', second.text
+
+    # Closing the focused document moves on to the one left
+    word.activate('Second.docx')
+    keyboard.press()
+    assert wait(app, lambda: window.documentName == 'Second.docx')
+    word.closeDocument('Second.docx')
+    keyboard.press()
+    assert wait(app, lambda: window.documentName == 'First.docx' and edit() == 'a+b'), f'after close: {edit()!r}'
+    assert window.wordHookStatus
+
+    # Cursor in prose between two multi-paragraph equations: the window around it starts inside the first one and ends
+    # inside the second, its $$ must not be paired up with each other
+    prose = '\rSome prose the user is writing\r'
+    text = f'Intro\r$$a &= b\rc &= d\re &= f\rg &= h$${prose}$$x &= y\rz &= w\ru &= v\rq$$\rEnd\r'
+    word.addDocument(text, 'Prose.docx')
+    word.selectionStart = text.index('prose') + 2
+    keyboard.press()
+    assert wait(app, lambda: window.documentName == 'Prose.docx')
+    wait(app, lambda: False, 0.3)
+    assert edit() != prose, 'prose between two equations previewed as an equation'
+    window.requestReplace()
+    keyboard.press()
+    wait(app, lambda: False, 0.5)
+    document = word.documents[word.activeIndex]
+    assert prose in document.text and 'x &= y' in document.text, document.text
+
+    # Cursor on the last line of an equation starting further back than the paragraphs read around the cursor: the
+    # preview shows all of it, and typing in it reads about those paragraphs instead of the text before them
+    text = 'Prose\r' * 200 + '$$a &= b\rc &= d\re &= f\rg &= h\rk &= l$$\r' + 'More prose\r' * 200
+    word.addDocument(text, 'Aligned.docx')
+    word.selectionStart = text.index('k &= l') + 1
+    keyboard.press()
+    assert wait(app, lambda: window.documentName == 'Aligned.docx' and 'k' in edit() and 'a &= b' in edit()), \
+        f'equation starting before the window: {edit()!r}'
+    characters = word.characters
+    typeText(word, 'm')
+    keyboard.press()
+    assert wait(app, lambda: 'km' in edit()), f'typing in it: {edit()!r}'
+    assert word.characters - characters < len(text) // 4, f'read {word.characters - characters} characters'
+    print(f'Multi-document check passed, {len(renders)} renders, {word.calls} COM calls')
+
+
+def main():
+    app = QApplication(sys.argv[:1])
+    word = FakeWordApplication('First $$a+b$$ document\r', fullName='First.docx')
+    word.selectionStart = len('First $$a+b')
+    keyboard = installFakeCom(mj2g, word)
+    window = mj2g.MainWindow()
+    window.start_word_hook()
+    try:
+        check(app, window, word, keyboard)
+    finally:
+        worker = window.comWorker
+        window.stop_word_hook()
+        if worker is not None:
+            worker.wait(5000)
+
+
+if __name__ == '__main__':
+    main()
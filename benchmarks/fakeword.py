@@ -0,0 +1,304 @@
+# In-process stand-in for the parts of the Word COM object model MJ2G uses, so WordHook code can run and be measured
+# without Windows or Office. Documents are plain strings, positions are string offsets, an inline picture shows up as
+# a single '/' in Range.Text like it does in Word. An equation inserted with InsertXML shows up as its OMML text.
+# latency adds a sleep to every COM call to mimic cross-process cost, calls and characters count what went across.
+# Several documents can be open, each with its own cursor, and Word can be put in the states where it has no active
+# document or rejects calls (Save dialog, busy).
+import threading, time, types
+import xml.etree.ElementTree as ET
+
+ommlNamespace = 'http://schemas.openxmlformats.org/officeDocument/2006/math'
+
+
+# What pywin32 raises for a failed call
+class FakeComError(Exception):
+    pass
+
+
+class FakeUndoRecord:
+    def __init__(self, app):
+        self.app = app
+        self.records = []
+        self.depth = 0
+
+    def StartCustomRecord(self, name=''):
+        self.app.call()
+        self.depth += 1
+        self.records.append(name)
+
+    def EndCustomRecord(self):
+        self.app.call()
+        self.depth -= 1
+
+
+class FakeInlineShape:
+    def __init__(self, document, path, data, start):
+        self.document = document
+        self.path = path
+        self.data = data
+        self.start = start
+        self.AlternativeText = ''
+
+    @property
+    def Range(self):
+        self.document.app.call()
+        return FakeRange(self.document, self.start, self.start + 1)
+
+
+class FakeInlineShapes:
+    def __init__(self, document):
+        self.document = document
+        self.shapes = []
+
+    def AddPicture(self, FileName, LinkToFile=False, SaveWithDocument=True, Range=None):
+        self.document.app.call()
+        if Range is None:
+            start = end = self.document.selectionStart
+        else:
+            start, end = Range.Start, Range.End
+        self.document.replace(start, end, '/')
+        with open(FileName, 'r', encoding='utf-8') as f:
+            shape = FakeInlineShape(self.document, FileName, f.read(), start)
+        # Kept in document order like Word does
+        self.shapes.append(shape)
+        self.shapes.sort(key=lambda shape: shape.start)
+        return shape
+
+    # Shapes in a replaced range go away, the ones after it move
+    def shift(self, start, end, delta):
+        self.shapes = [shape for shape in self.shapes if not start <= shape.start < end]
+        for shape in self.shapes:
+            if shape.start >= end:
+                shape.start += delta
+
+    def __call__(self, index):
+        self.document.app.call()
+        return self.shapes[index - 1]
+
+    @property
+    def Count(self):
+        return len(self.shapes)
+
+
+# Plain text search inside its range, moving the range onto the match like Word does. Forward = False finds the last
+# match instead.
+class FakeFind:
+    def __init__(self, range):
+        self.range = range
+        self.Text = ''
+        self.Forward = True
+
+    def ClearFormatting(self):
+        self.range.document.app.call()
+
+    def Execute(self, FindText=None):
+        self.range.document.app.call()
+        text = self.Text if FindText is None else FindText
+        search = self.range.document.text.find if self.Forward else self.range.document.text.rfind
+        position = search(text, self.range.Start, self.range.End)
+        if position < 0:
+            return False
+        self.range.Start, self.range.End = position, position + len(text)
+        return True
+
+
+class FakeRange:
+    wdParagraph = 4
+
+    def __init__(self, document, start, end):
+        self.document = document
+        self.Start = start
+        self.End = end
+        self.Find = FakeFind(self)
+
+    @property
+    def Text(self):
+        self.document.app.call()
+        self.document.app.characters += max(0, self.End - self.Start)
+        return self.document.text[self.Start:self.End]
+
+    @Text.setter
+    def Text(self, value):
+        self.document.app.call()
+        self.document.replace(self.Start, self.End, value)
+        self.End = self.Start + len(value)
+
+    # Takes a Flat OPC package like Word does, only the equations in it are kept
+    def InsertXML(self, XML, Transform=None):
+        self.document.app.call()
+        package = ET.fromstring(XML)
+        equations = package.findall(f'.//{{{ommlNamespace}}}oMath')
+        if not equations:
+            raise ValueError('no equation in the inserted XML')
+        text = ''.join(element.text or '' for equation in equations for element in equation.iter(f'{{{ommlNamespace}}}t'))
+        self.document.equations.extend(ET.tostring(equation, encoding='unicode') for equation in equations)
+        self.document.replace(self.Start, self.End, text)
+        self.End = self.Start + len(text)
+
+    def Delete(self):
+        self.document.app.call()
+        self.document.replace(self.Start, self.End, '')
+        self.End = self.Start
+
+    def MoveStart(self, Unit=1, Count=1):
+        self.document.app.call()
+        if Unit == self.wdParagraph:
+            for _ in range(-Count):
+                self.Start = self.document.text.rfind('\r', 0, max(self.Start - 1, 0)) + 1
+        else:
+            self.Start = max(0, min(self.End, self.Start + Count))
+        return Count
+
+    def MoveEnd(self, Unit=1, Count=1):
+        self.document.app.call()
+        if Unit == self.wdParagraph:
+            for _ in range(Count):
+                end = self.document.text.find('\r', self.End)
+                self.End = len(self.document.text) if end < 0 else end + 1
+        else:
+            self.End = max(self.Start, min(len(self.document.text), self.End + Count))
+        return Count
+
+
+class FakeDocument:
+    def __init__(self, app, text, fullName):
+        self.app = app
+        self.text = text
+        self.FullName = fullName
+        self.Name = fullName
+        self.InlineShapes = FakeInlineShapes(self)
+        self.equations = []
+        self.selectionStart = 0
+
+    @property
+    def Application(self):
+        return self.app
+
+    def Range(self, Start=None, End=None):
+        self.app.call()
+        return FakeRange(self, 0 if Start is None else Start, len(self.text) if End is None else End)
+
+    @property
+    def Content(self):
+        return self.Range()
+
+    def replace(self, start, end, value):
+        self.text = self.text[:start] + value + self.text[end:]
+        self.InlineShapes.shift(start, end, len(value) - (end - start))
+        if self.selectionStart >= end:
+            self.selectionStart += len(value) - (end - start)
+
+
+class FakeSelection:
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def Range(self):
+        document = self.app.ActiveDocument
+        return FakeRange(document, document.selectionStart, document.selectionStart)
+
+
+class FakeWordApplication:
+    def __init__(self, text='', latency=0.0, fullName='Document1'):
+        self.latency = latency
+        self.calls = 0
+        # Characters copied out of documents through Range.Text
+        self.characters = 0
+        self.documents = [FakeDocument(self, text, fullName)]
+        self.activeIndex = 0
+        self.busy = False
+        self.UndoRecord = FakeUndoRecord(self)
+        self.Selection = FakeSelection(self)
+        # Word serializes COM calls, so does the fake: one call at a time across threads
+        self.lock = threading.RLock()
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+            if self.latency:
+                time.sleep(self.latency)
+            if self.busy:
+                raise FakeComError('Call was rejected by callee.')
+
+    @property
+    def ActiveDocument(self):
+        self.call()
+        if self.activeIndex is None:
+            raise FakeComError('This command is not available because no document is open.')
+        return self.documents[self.activeIndex]
+
+    # Cursor of the active document
+    @property
+    def selectionStart(self):
+        return self.documents[self.activeIndex].selectionStart if self.activeIndex is not None else 0
+
+    @selectionStart.setter
+    def selectionStart(self, value):
+        self.documents[self.activeIndex].selectionStart = value
+
+    def addDocument(self, text, fullName):
+        with self.lock:
+            self.documents.append(FakeDocument(self, text, fullName))
+            self.activeIndex = len(self.documents) - 1
+            return self.documents[-1]
+
+    # Focus another document, or none at all with None like while a Save dialog is open
+    def activate(self, fullName):
+        with self.lock:
+            self.activeIndex = None if fullName is None else \
+                [document.FullName for document in self.documents].index(fullName)
+
+    def closeDocument(self, fullName):
+        with self.lock:
+            self.documents = [document for document in self.documents if document.FullName != fullName]
+            self.activeIndex = len(self.documents) - 1 if self.documents else None
+
+    def Documents(self, name):
+        self.call()
+        for document in self.documents:
+            if name in (document.FullName, document.Name):
+                return document
+        raise KeyError(name)
+
+
+# Typing into the active document at the cursor, from any thread, the way a user would
+def typeText(word, text):
+    with word.lock:
+        document = word.documents[word.activeIndex]
+        document.replace(word.selectionStart, word.selectionStart, text)
+
+
+# Keyboard listener stand-in, press() calls every started listener like a key press in Word would
+class FakeKeyboard:
+    def __init__(self):
+        self.listeners = []
+        keyboard = self
+
+        class Listener:
+            def __init__(self, on_press=None):
+                self.on_press = on_press
+
+            def start(self):
+                keyboard.listeners.append(self)
+
+            def stop(self):
+                if self in keyboard.listeners:
+                    keyboard.listeners.remove(self)
+        self.Listener = Listener
+
+    def press(self, key=None):
+        for listener in list(self.listeners):
+            listener.on_press(key)
+
+
+# Point a module's COM entry points (win32, pythoncom, keyboard) at word, so WordHook runs against the fake.
+# Call before creating the MainWindow. Returns the fake keyboard.
+def installFakeCom(module, word):
+    keyboard = FakeKeyboard()
+    module.win32 = types.SimpleNamespace(gencache=types.SimpleNamespace(EnsureDispatch=lambda name: word),
+                                         GetActiveObject=lambda name: word)
+    module.pythoncom = types.SimpleNamespace(CoInitialize=lambda: None, CoUninitialize=lambda: None)
+    module.keyboard = keyboard
+    module.win32comsupport = True
+    return keyboard